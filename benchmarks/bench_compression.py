@@ -0,0 +1,84 @@
+"""
+Compare block-compressed storage with plain storage.
+
+Reports on-disk size, full scan throughput and random point fetch
+throughput for the plain file and for every codec.
+
+    python -m benchmarks.bench_compression --records 100000
+"""
+import argparse
+import json
+import random
+import tempfile
+import time
+
+from pysql.storagemanager.storage import StorageManager
+
+
+STATUSES = ('active', 'pending', 'disabled', 'deleted')
+
+
+def make_records(n, seed=0):
+    rnd = random.Random(seed)
+    for i in range(n):
+        yield {
+            'user_id': i,
+            'status': rnd.choice(STATUSES),
+            'country': rnd.choice(('UA', 'PL', 'DE', 'US', 'GB')),
+            'score': rnd.randint(0, 1000),
+            'tags': rnd.sample(('a', 'b', 'c', 'd', 'e', 'f'), 2),
+        }
+
+
+def fill(storage, records):
+    lines = []
+    for i, rec in enumerate(records):
+        rec['_id'] = f'{i:032x}'
+        lines.append(json.dumps(rec) + '\n')
+    return storage.storage_file_ops.append_many(lines)
+
+
+def run(compression, n, fetches, block_size, seed):
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = StorageManager(tmp, compression=compression, block_size=block_size)
+        ops = storage.storage_file_ops
+        offsets = fill(storage, make_records(n, seed))
+        size = ops.compressed_size if compression else ops.size
+
+        start = time.perf_counter()
+        scanned = sum(1 for _ in ops.all_records())
+        scan_time = time.perf_counter() - start
+
+        sample = random.Random(seed).sample(offsets, min(fetches, len(offsets)))
+        start = time.perf_counter()
+        fetched = sum(1 for _ in ops.records_by_charno(sample))
+        fetch_time = time.perf_counter() - start
+
+    return {
+        'storage': compression or 'plain',
+        'bytes': size,
+        'scan_rec_per_s': round(scanned / scan_time),
+        'fetch_rec_per_s': round(fetched / fetch_time),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=100_000)
+    parser.add_argument('--fetches', type=int, default=10_000)
+    parser.add_argument('--block-size', type=int, default=64 * 1024)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = [
+        run(compression, args.records, args.fetches, args.block_size, args.seed)
+        for compression in (None, 'zlib', 'lzma')
+    ]
+    plain = results[0]['bytes']
+    for r in results:
+        r['ratio'] = round(plain / r['bytes'], 2)
+        print(json.dumps(r))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Memory and speed of RedBlackTree at large sizes.
+
+Reports insert, search, in-order iteration, iteration from a key and
+delete throughput, plus resident memory per key.
+
+    python -m benchmarks.bench_rbtree --keys 10000000
+"""
+import argparse
+import json
+import random
+import resource
+import sys
+import time
+
+from pysql.datastructures.rbtree import Node, RedBlackTree
+
+
+def rss_bytes():
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def timed(fn):
+    start = time.perf_counter()
+    count = fn()
+    return count, time.perf_counter() - start
+
+
+def run(n, probes, seed):
+    rnd = random.Random(seed)
+    keys = list(range(n))
+    rnd.shuffle(keys)
+    sample = rnd.sample(keys, min(probes, n))
+
+    tree = RedBlackTree()
+    rss_before = rss_bytes()
+
+    def insert():
+        for k in keys:
+            tree.insert(k, k)
+        return n
+
+    def search():
+        return sum(1 for k in sample if tree.search(k) is not tree.TNULL)
+
+    def iterate():
+        return sum(1 for _ in tree.inorder())
+
+    def iterate_from():
+        it = tree.inorder(start=n // 2)
+        return sum(1 for _, _ in zip(range(probes), it))
+
+    def delete():
+        for k in sample:
+            tree.delete(k)
+        return len(sample)
+
+    results = {'keys': n, 'node_bytes': sys.getsizeof(Node(0, 0))}
+    for name, fn in (('insert', insert), ('search', search), ('inorder', iterate),
+                     ('inorder_from', iterate_from), ('delete', delete)):
+        count, elapsed = timed(fn)
+        results[f'{name}_per_s'] = round(count / elapsed)
+        if name == 'insert':
+            results['rss_bytes_per_key'] = round((rss_bytes() - rss_before) / n, 1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--keys', type=int, default=10_000_000)
+    parser.add_argument('--probes', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(run(args.keys, args.probes, args.seed)))
+
+
+if __name__ == '__main__':
+    main()
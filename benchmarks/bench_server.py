@@ -0,0 +1,112 @@
+"""
+Load generator for the pysql server.
+
+Runs `--clients` concurrent clients; each keeps `--depth` requests in
+flight on its own pipelined connection until `--requests` have completed
+in total. Reports throughput and latency percentiles per operation mix.
+Without `--port`/`--path` it starts a server on a temporary store first.
+
+    python -m benchmarks.bench_server --clients 8 --depth 16 --requests 20000
+"""
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+
+from pysql.backend import Connection, Server
+from pysql.storagemanager.storage import StorageManager
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return round(sorted_values[idx] * 1000, 3)
+
+
+async def worker(conn, rnd, quota, depth, read_ratio, keys, latencies):
+    async def one():
+        if rnd.random() < read_ratio:
+            op, args = 'get', {'constraints': {'k': rnd.randrange(keys)}}
+        else:
+            op, args = 'create', {'obj': {'k': rnd.randrange(keys), 'payload': 'x' * 64}}
+        start = time.perf_counter()
+        await conn.request(op, **args)
+        latencies.append(time.perf_counter() - start)
+
+    async def lane(n):
+        for _ in range(n):
+            await one()
+
+    per_lane, extra = divmod(quota, depth)
+    await asyncio.gather(*(lane(per_lane + (i < extra)) for i in range(depth)))
+
+
+async def run_load(host, port, path, args):
+    rnd = random.Random(args.seed)
+    conns = [await Connection.open(host, port, path) for _ in range(args.clients)]
+
+    # seed the store so reads hit something
+    await asyncio.gather(*(
+        conns[i % len(conns)].request('create', obj={'k': i % args.keys, 'payload': 'x' * 64})
+        for i in range(args.keys)
+    ))
+
+    latencies = []
+    per_client, extra = divmod(args.requests, args.clients)
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        worker(conn, random.Random(rnd.random()), per_client + (i < extra), args.depth,
+               args.read_ratio, args.keys, latencies)
+        for i, conn in enumerate(conns)
+    ))
+    elapsed = time.perf_counter() - start
+
+    for conn in conns:
+        await conn.close()
+
+    latencies.sort()
+    return {
+        'clients': args.clients,
+        'depth': args.depth,
+        'requests': len(latencies),
+        'read_ratio': args.read_ratio,
+        'elapsed_s': round(elapsed, 3),
+        'ops_per_s': round(len(latencies) / elapsed, 1),
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': percentile(latencies, 1.0),
+    }
+
+
+async def main_async(args):
+    if args.port or args.path:
+        return await run_load(args.host, args.port, args.path, args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        async with Server(StorageManager(tmp)) as server:
+            host, port = server.address
+            return await run_load(host, port, None, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--path', default=None, help='Unix socket of a running server')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--depth', type=int, default=16, help='requests in flight per client')
+    parser.add_argument('--requests', type=int, default=20_000)
+    parser.add_argument('--read-ratio', type=float, default=0.8)
+    parser.add_argument('--keys', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(main_async(args))))
+
+
+if __name__ == '__main__':
+    main()
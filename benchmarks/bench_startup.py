@@ -0,0 +1,61 @@
+"""
+Cold start of StorageManager with many indexed fields.
+
+Reports the time to open the store, to run the first query (which loads
+one field's index) and to load every index eagerly, as opening did before
+indexes were loaded lazily.
+
+    python -m benchmarks.bench_startup --records 100000 --fields 20
+"""
+import argparse
+import json
+import random
+import tempfile
+import time
+
+from pysql.storagemanager.storage import StorageManager
+
+
+def build(directory, n, fields, seed):
+    rnd = random.Random(seed)
+    storage = StorageManager(directory)
+    lines = []
+    for i in range(n):
+        rec = {f'f{j}': rnd.randint(0, 1000) for j in range(fields)}
+        rec['_id'] = f'{i:032x}'
+        lines.append(json.dumps(rec) + '\n')
+    storage.storage_file_ops.append_many(lines)
+    storage._index.rebuild(storage.storage_file_ops.all_records(include_charno=True))
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, round(time.perf_counter() - start, 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=100_000)
+    parser.add_argument('--fields', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        build(tmp, args.records, args.fields, args.seed)
+
+        storage, open_s = timed(lambda: StorageManager(tmp))
+        _, first_query_s = timed(lambda: list(storage.get_objects(f0=500)))
+        _, load_all_s = timed(lambda: StorageManager(tmp)._index.load_all())
+
+    print(json.dumps({
+        'records': args.records,
+        'fields': args.fields,
+        'open_s': open_s,
+        'first_query_s': first_query_s,
+        'eager_load_s': load_all_s,
+    }))
+
+
+if __name__ == '__main__':
+    main()
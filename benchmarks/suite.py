@@ -0,0 +1,315 @@
+"""
+Benchmark suite for the storage, index and data structure hot paths.
+
+For every size, builds a store of synthetic records from a fixed seed and
+times, in this order: bulk ingest, create_object, equality and range
+lookups, full scans, Indexes.save and load, delete_objects and vacuum,
+then RedBlackTree insert, search and iteration and SortedList.insert_sorted.
+Benchmarks whose single operation costs O(n) run fewer operations as n
+grows: at most --max-ops, and about --work / n. Each benchmark but the
+destructive ones is run --repeat times and the best time is kept.
+
+Results are printed as JSON (or written to --output). --save-baseline
+stores them; --baseline compares against stored results, per operation,
+and exits with status 1 if anything got slower than --threshold allows.
+
+    python -m benchmarks.suite --sizes 1000,10000,100000 --save-baseline base.json
+    python -m benchmarks.suite --sizes 1000,10000,100000 --baseline base.json
+"""
+import argparse
+import json
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from pysql.compiler import F
+from pysql.datastructures.rbtree import RedBlackTree
+from pysql.datastructures.sorted_list import SortedList
+from pysql.storagemanager.bulk import bulk_import
+from pysql.storagemanager.data_index import Indexes
+from pysql.storagemanager.storage import StorageManager
+
+BENCHMARKS = []
+
+
+def benchmark(fn=None, repeat: bool = True, setup: bool = False):
+    """
+    Register a benchmark. Ones with `repeat=False` change the store and are
+    timed once; `setup` ones prepare state for later ones and run even when
+    not selected.
+    """
+    def register(fn):
+        fn.repeat = repeat
+        fn.setup = setup
+        BENCHMARKS.append(fn)
+        return fn
+    return register(fn) if fn is not None else register
+
+
+def make_record(rnd: random.Random, i: int, n: int) -> dict:
+    return {
+        'n': i,
+        'k': rnd.randrange(max(1, n // 10)),
+        'tag': rnd.choice(('red', 'green', 'blue', 'black')),
+        'score': round(rnd.random() * 1000, 3),
+        'text': 'x' * rnd.randint(10, 60),
+    }
+
+
+class Context:
+    """State shared by the benchmarks of one size, which run in order."""
+
+    def __init__(self, n: int, seed: int, max_ops: int, work: int, workdir: Path):
+        self.n = n
+        self.seed = seed
+        self.max_ops = max_ops
+        self.work = work
+        self.rnd = random.Random(seed)
+        self.dir = workdir
+        self.storage = None
+
+    def sample(self, k: int):
+        return [self.rnd.randrange(self.n) for _ in range(k)]
+
+    @property
+    def linear_ops(self) -> int:
+        """Number of operations for benchmarks costing O(n) per operation"""
+        return max(3, min(self.n, self.max_ops, self.work // self.n))
+
+
+@benchmark(setup=True)
+def bulk_ingest(ctx: Context):
+    rnd = random.Random(ctx.seed)
+    lines = [json.dumps(make_record(rnd, i, ctx.n)) + '\n' for i in range(ctx.n)]
+    shutil.rmtree(ctx.dir, ignore_errors=True)
+    ctx.dir.mkdir(parents=True)
+    ctx.storage = StorageManager(ctx.dir)
+
+    start = time.perf_counter()
+    bulk_import(ctx.storage, lines)
+    return ctx.n, time.perf_counter() - start
+
+
+@benchmark
+def create_object(ctx: Context):
+    # every create saves the changed indexes, so one costs O(n)
+    ops = ctx.linear_ops
+    records = [make_record(ctx.rnd, ctx.n + i, ctx.n) for i in range(ops)]
+    start = time.perf_counter()
+    for record in records:
+        ctx.storage.create_object(record)
+    elapsed = time.perf_counter() - start
+    ctx.storage.delete_objects(F('n') >= ctx.n)
+    ctx.storage.vacuum()
+    return ops, elapsed
+
+
+@benchmark
+def eq_lookup(ctx: Context):
+    keys = ctx.sample(1000)
+    start = time.perf_counter()
+    for key in keys:
+        ctx.storage.get_objects(k=key // 10)
+    return len(keys), time.perf_counter() - start
+
+
+@benchmark
+def range_lookup(ctx: Context):
+    lows = ctx.sample(200)
+    start = time.perf_counter()
+    for low in lows:
+        ctx.storage.get_objects((F('n') >= low) & (F('n') < low + 100))
+    return len(lows), time.perf_counter() - start
+
+
+@benchmark
+def full_scan(ctx: Context):
+    start = time.perf_counter()
+    found = len(ctx.storage.get_objects())
+    return found, time.perf_counter() - start
+
+
+@benchmark
+def filtered_scan(ctx: Context):
+    # no index can answer a negation, so every record is decoded and tested
+    start = time.perf_counter()
+    ctx.storage.get_objects(~(F('tag') == 'red'))
+    return ctx.n, time.perf_counter() - start
+
+
+@benchmark
+def indexes_save(ctx: Context):
+    indexes = ctx.storage._index
+    indexes.load_all()
+    for field_name in indexes.fields():
+        indexes._dirty.add(field_name)
+    start = time.perf_counter()
+    indexes.save()
+    return ctx.n, time.perf_counter() - start
+
+
+@benchmark
+def indexes_load(ctx: Context):
+    start = time.perf_counter()
+    indexes = Indexes(ctx.dir / 'pynosql.index')
+    indexes.load_all()
+    return ctx.n, time.perf_counter() - start
+
+
+@benchmark(repeat=False)
+def delete_objects(ctx: Context):
+    # each tombstone is inserted into a sorted list, so one costs O(deleted)
+    count = min(ctx.n // 10, ctx.max_ops)
+    start = time.perf_counter()
+    deleted = ctx.storage.delete_objects(F('n') < count)
+    return max(deleted, 1), time.perf_counter() - start
+
+
+@benchmark(repeat=False)
+def vacuum(ctx: Context):
+    start = time.perf_counter()
+    ctx.storage.vacuum()
+    return ctx.n, time.perf_counter() - start
+
+
+@benchmark(setup=True)
+def rbtree_insert(ctx: Context):
+    keys = list(range(ctx.n))
+    random.Random(ctx.seed).shuffle(keys)
+    ctx.tree = RedBlackTree()
+    start = time.perf_counter()
+    for key in keys:
+        ctx.tree.insert(key, key)
+    return ctx.n, time.perf_counter() - start
+
+
+@benchmark
+def rbtree_search(ctx: Context):
+    keys = ctx.sample(min(ctx.n, 100_000))
+    start = time.perf_counter()
+    for key in keys:
+        ctx.tree.search(key)
+    return len(keys), time.perf_counter() - start
+
+
+@benchmark
+def rbtree_iterate(ctx: Context):
+    start = time.perf_counter()
+    count = sum(1 for _ in ctx.tree.inorder())
+    return count, time.perf_counter() - start
+
+
+@benchmark
+def sortedlist_insert_sorted(ctx: Context):
+    # each insert moves the value into place from the front, so one costs O(n)
+    items = SortedList(range(0, 2 * ctx.n, 2))
+    values = [2 * v + 1 for v in ctx.sample(ctx.linear_ops)]
+    start = time.perf_counter()
+    for value in values:
+        items.insert_sorted(value)
+    return len(values), time.perf_counter() - start
+
+
+def run_suite(sizes, seed: int, repeat: int, max_ops: int, work: int, only=None) -> dict:
+    results = []
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            ctx = Context(n, seed, max_ops, work, Path(tmp) / 'store')
+            for fn in BENCHMARKS:
+                selected = not only or fn.__name__ in only
+                if not selected:
+                    if fn.setup:
+                        fn(ctx)
+                    continue
+                best = None
+                for _ in range(repeat if fn.repeat else 1):
+                    # every repeat starts from the same random state
+                    ctx.rnd = random.Random(f'{seed}-{fn.__name__}')
+                    ops, seconds = fn(ctx)
+                    if best is None or seconds < best[1]:
+                        best = ops, seconds
+                ops, seconds = best
+                results.append({
+                    'name': fn.__name__,
+                    'n': n,
+                    'ops': ops,
+                    'seconds': round(seconds, 6),
+                    'us_per_op': round(seconds / ops * 1e6, 3),
+                })
+                print(f'{fn.__name__:>26} n={n:<8} {results[-1]["us_per_op"]:>12.3f} us/op', file=sys.stderr)
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'seed': seed,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Benchmarks slower than the baseline by more than `threshold`, per op."""
+    base = {(r['name'], r['n']): r for r in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        old = base.get((result['name'], result['n']))
+        if old is None:
+            continue
+        ratio = result['us_per_op'] / old['us_per_op'] if old['us_per_op'] else 1.0
+        result['baseline_us_per_op'] = old['us_per_op']
+        result['ratio'] = round(ratio, 3)
+        if ratio > 1 + threshold:
+            regressions.append(result)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma separated record counts, 10^3 to 10^6')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-ops', type=int, default=1000,
+                        help='most operations of benchmarks that cost O(n) each')
+    parser.add_argument('--work', type=int, default=10 ** 6,
+                        help='operations times n for benchmarks that cost O(n) each')
+    parser.add_argument('--only', default=None, help='comma separated benchmark names')
+    parser.add_argument('--output', default=None, help='write results here instead of stdout')
+    parser.add_argument('--baseline', default=None, help='results to compare against')
+    parser.add_argument('--save-baseline', default=None, help='also store results as a baseline here')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown per op before a benchmark counts as a regression')
+    args = parser.parse_args()
+
+    sizes = [int(float(size)) for size in args.sizes.split(',')]
+    only = set(args.only.split(',')) if args.only else None
+    current = run_suite(sizes, args.seed, args.repeat, args.max_ops, args.work, only)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(current, json.load(f), args.threshold)
+        for r in regressions:
+            print(f'REGRESSION {r["name"]} n={r["n"]}: {r["baseline_us_per_op"]} -> {r["us_per_op"]} us/op '
+                  f'(x{r["ratio"]})', file=sys.stderr)
+
+    output = json.dumps(current, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(output)
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Bulk import and export of NDJSON, one JSON object per line.
+
+    python -m pysql import records.ndjson --dir ./db
+    python -m pysql export --dir ./db -o records.ndjson
+
+`-` (the default) stands for stdin or stdout. With --collection the
+records go to or come from a named collection of the directory.
+"""
+import argparse
+import logging
+import sys
+import time
+from contextlib import ExitStack
+
+from pysql.conf import DEFAULT_STORAGE_DIR
+from pysql.storagemanager.bulk import bulk_import, export
+from pysql.storagemanager.database import Database
+from pysql.storagemanager.storage import StorageManager
+
+
+def open_storage(args, create: bool) -> StorageManager:
+    options = {'compression': args.compression} if getattr(args, 'compression', None) else {}
+    if args.collection is None:
+        return StorageManager(args.dir, **options)
+
+    db = Database(args.dir)
+    if create:
+        return db.collection(args.collection, **options)
+    return db[args.collection]
+
+
+def run_import(args):
+    storage = open_storage(args, create=True)
+    start = time.perf_counter()
+    total = 0
+    with ExitStack() as stack:
+        for name in args.files:
+            f = sys.stdin if name == '-' else stack.enter_context(open(name))
+            total += bulk_import(storage, f, chunk_records=args.chunk_records, sort_buffer=args.sort_buffer)
+    report('imported', total, time.perf_counter() - start)
+
+
+def run_export(args):
+    storage = open_storage(args, create=False)
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        out = sys.stdout if args.output == '-' else stack.enter_context(open(args.output, 'w'))
+        total = export(storage, out, chunk_records=args.chunk_records)
+    report('exported', total, time.perf_counter() - start)
+
+
+def report(action: str, records: int, seconds: float):
+    rate = records / seconds if seconds else 0
+    print(f'{action} {records} records in {seconds:.2f}s ({rate:.0f} records/s)', file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pysql', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--dir', default=DEFAULT_STORAGE_DIR, help='storage directory')
+    common.add_argument('--collection', default=None, help='named collection in the directory')
+    common.add_argument('--chunk-records', type=int, default=10_000, help='records written at once')
+
+    import_parser = commands.add_parser(
+        'import', parents=[common], help='append records and bulk-build the indexes'
+    )
+    import_parser.add_argument('files', nargs='*', default=['-'])
+    import_parser.add_argument('--compression', choices=['zlib', 'lzma'], default=None,
+                               help='codec of a new storage')
+    import_parser.add_argument('--sort-buffer', type=int, default=1_000_000,
+                               help='postings sorted in memory before spilling to disk')
+    import_parser.set_defaults(run=run_import)
+
+    export_parser = commands.add_parser('export', parents=[common], help='write live records')
+    export_parser.add_argument('-o', '--output', default='-')
+    export_parser.set_defaults(run=run_export)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""
+Network access to a StorageManager over asyncio streams.
+
+Frames are a 4-byte big-endian length followed by a UTF-8 JSON body.
+
+Request:  {"id": 1, "op": "get", "args": {"constraints": {"a": 1}}}
+Response: {"id": 1, "ok": true, "result": [...]}
+          {"id": 1, "ok": false, "error": "..."}
+
+Clients may pipeline: send any number of requests without waiting for
+responses. Responses on a connection come back in request order and carry
+the request id. Operations from every connection run one at a time on a
+single worker thread, since StorageManager is not thread-safe, and never
+block the event loop.
+
+Operations and their args:
+    ping                             -> "pong"
+    create    {"obj": {...}}         -> id of the new object
+    get       {"constraints": {...}} -> list of objects
+    count     {"constraints": {...}} -> int
+    delete    {"constraints": {...}} -> number of deleted objects
+    vacuum                           -> null
+    batch     {"ops": [{"op": ..., "args": {...}}, ...]}
+              -> list of {"ok": ..., "result"/"error": ...}, one per op
+
+get, count and delete also take "query": a list of dict queries, see
+`pysql.compiler.parse`, ANDed with the constraints.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import struct
+import typing as tp
+from concurrent.futures import ThreadPoolExecutor
+
+from pysql.storagemanager.storage import StorageManager
+
+logger = logging.getLogger(__name__)
+
+_LENGTH = struct.Struct('>I')
+
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class RemoteError(Exception):
+    """An operation failed on the server."""
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tp.Optional[dict]:
+    """Read one frame, or return None if the peer closed the connection."""
+    try:
+        header = await reader.readexactly(_LENGTH.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ProtocolError('Connection closed in the middle of a frame')
+        return None
+
+    (length,) = _LENGTH.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f'Frame of {length} bytes exceeds {MAX_FRAME_SIZE}')
+    try:
+        body = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise ProtocolError('Connection closed in the middle of a frame')
+
+    try:
+        message = json.loads(body)
+    except ValueError as e:
+        raise ProtocolError(f'Frame is not valid JSON: {e}')
+    if not isinstance(message, dict):
+        raise ProtocolError(f'Frame holds {type(message).__name__}, not an object')
+    return message
+
+
+def encode_frame(message: dict) -> bytes:
+    body = json.dumps(message).encode()
+    return _LENGTH.pack(len(body)) + body
+
+
+class Server:
+    """
+    Serves one StorageManager over TCP, or over a Unix socket if `path`
+    is given. Use `port=0` to pick a free port; `address` has the result.
+    """
+
+    def __init__(self, storage: StorageManager, host: str = '127.0.0.1', port: int = 0,
+                 path: str = None):
+        self._storage = storage
+        self._host = host
+        self._port = port
+        self._path = path
+        self._server = None
+        self._handlers = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pysql-storage')
+        self._ops = {
+            'ping': lambda: 'pong',
+            'create': lambda obj: self._storage.create_object(obj),
+            'get': lambda query=(), constraints=None: self._storage.get_objects(*query, **(constraints or {})),
+            'count': lambda query=(), constraints=None: self._storage.count(*query, **(constraints or {})),
+            'delete': lambda query=(), constraints=None: self._storage.delete_objects(*query, **(constraints or {})),
+            'vacuum': lambda: self._storage.vacuum(),
+            'batch': self._batch,
+        }
+
+    @property
+    def address(self):
+        if self._path is not None:
+            return self._path
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def start(self):
+        if self._path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path=self._path)
+        else:
+            self._server = await asyncio.start_server(self._handle, self._host, self._port)
+        logger.info(f'Serving storage on {self.address}')
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for handler in list(self._handlers):
+                handler.cancel()
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+            await self._server.wait_closed()
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def _call(self, op: str, args: tp.Optional[dict]):
+        handler = self._ops.get(op)
+        if handler is None:
+            raise ValueError(f'Unknown operation: {op}')
+        return handler(**(args or {}))
+
+    def _batch(self, ops: tp.List[dict]):
+        return [self._result(item.get('op'), item.get('args')) for item in ops]
+
+    def _result(self, op: str, args: tp.Optional[dict]) -> dict:
+        try:
+            return {'ok': True, 'result': self._call(op, args)}
+        except Exception as e:
+            logger.debug(f'Operation {op} failed', exc_info=True)
+            return {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue()
+        responder = asyncio.create_task(self._respond(pending, writer))
+
+        try:
+            while True:
+                request = await read_frame(reader)
+                if request is None:
+                    break
+                future = loop.run_in_executor(
+                    self._executor, self._result, request.get('op'), request.get('args')
+                )
+                await pending.put((request.get('id'), future))
+            await pending.put(None)
+            await responder
+        except (ProtocolError, ValueError, ConnectionError) as e:
+            logger.warning(f'Dropping connection: {e}')
+        except asyncio.CancelledError:
+            # the server is closing
+            pass
+        finally:
+            responder.cancel()
+            writer.close()
+            self._handlers.discard(handler)
+
+    async def _respond(self, pending: asyncio.Queue, writer: asyncio.StreamWriter):
+        # answers go out in request order, each as soon as its turn comes
+        while True:
+            item = await pending.get()
+            if item is None:
+                return
+            request_id, future = item
+            response = await future
+            response['id'] = request_id
+            try:
+                writer.write(encode_frame(response))
+                await writer.drain()
+            except ConnectionError:
+                return
+
+
+class Connection:
+    """A single pipelined client connection."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self._ids = itertools.count(1)
+        self._waiting = {}
+        # why the connection closed, raised by requests made afterwards
+        self._error = None
+        self._reader_task = asyncio.create_task(self._read_responses())
+
+    @classmethod
+    async def open(cls, host: str = '127.0.0.1', port: int = None, path: str = None) -> 'Connection':
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    @property
+    def pending(self) -> int:
+        return len(self._waiting)
+
+    @property
+    def closed(self) -> bool:
+        return self._reader_task.done()
+
+    async def request(self, op: str, **args):
+        """Send one request and wait for its result. Calls may overlap."""
+        if self.closed:
+            raise self._error or ConnectionError('Connection closed')
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[request_id] = future
+        self._writer.write(encode_frame({'id': request_id, 'op': op, 'args': args}))
+        await self._writer.drain()
+
+        response = await future
+        if not response['ok']:
+            raise RemoteError(response['error'])
+        return response['result']
+
+    async def _read_responses(self):
+        error = ConnectionError('Connection closed')
+        try:
+            while True:
+                response = await read_frame(self._reader)
+                if response is None:
+                    break
+                future = self._waiting.pop(response['id'], None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (ProtocolError, ConnectionError) as e:
+            error = e
+        finally:
+            self._error = error
+            for future in self._waiting.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._waiting.clear()
+
+    async def close(self):
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+        await self._reader_task
+
+
+class Client:
+    """
+    Pool of up to `pool_size` pipelined connections to a Server.
+
+    Each request goes to the connection with the fewest requests in flight;
+    new connections are only opened while all existing ones are busy.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = None, path: str = None,
+                 pool_size: int = 4):
+        self._host = host
+        self._port = port
+        self._path = path
+        self._pool_size = pool_size
+        self._connections: tp.List[Connection] = []
+        self._connecting = asyncio.Lock()
+
+    async def _connection(self) -> Connection:
+        self._connections = [c for c in self._connections if not c.closed]
+        idle = [c for c in self._connections if not c.pending]
+        if idle or len(self._connections) >= self._pool_size:
+            return min(self._connections, key=lambda c: c.pending)
+
+        async with self._connecting:
+            if len(self._connections) < self._pool_size:
+                conn = await Connection.open(self._host, self._port, self._path)
+                self._connections.append(conn)
+                return conn
+        return min(self._connections, key=lambda c: c.pending)
+
+    async def request(self, op: str, **args):
+        conn = await self._connection()
+        return await conn.request(op, **args)
+
+    async def ping(self) -> str:
+        return await self.request('ping')
+
+    async def create_object(self, obj: dict) -> str:
+        return await self.request('create', obj=obj)
+
+    async def get_objects(self, *queries: dict, **constraints) -> tp.List[dict]:
+        return await self.request('get', query=list(queries), constraints=constraints)
+
+    async def count(self, *queries: dict, **constraints) -> int:
+        return await self.request('count', query=list(queries), constraints=constraints)
+
+    async def delete_objects(self, *queries: dict, **constraints) -> int:
+        return await self.request('delete', query=list(queries), constraints=constraints)
+
+    async def vacuum(self):
+        return await self.request('vacuum')
+
+    async def batch(self, ops: tp.Iterable[tp.Tuple[str, dict]]) -> tp.List[dict]:
+        """Run several operations in one round trip; one result dict per op."""
+        return await self.request('batch', ops=[{'op': op, 'args': args} for op, args in ops])
+
+    async def close(self):
+        for conn in self._connections:
+            await conn.close()
+        self._connections = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
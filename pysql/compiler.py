@@ -0,0 +1,549 @@
+"""
+Query expressions and their compilation into executable plans.
+
+Queries are built from fields:
+
+    (F('age') >= 18) & (F('address.city') == 'Kyiv') & ~F('banned').exists()
+
+or from a JSON-friendly dict, e.g. for network clients:
+
+    {'age': {'$gte': 18}, 'address.city': 'Kyiv', '$not': {'banned': {'$exists': True}}}
+
+Compiling a query splits it into index probes, which narrow the candidate
+records via field indexes, and a residual predicate, a Python closure run
+on the fetched records for whatever the probes don't cover. Plans depend
+only on the query's shape, i.e. the query with its constants taken out,
+so they are cached by shape and a repeated query is only normalized, never
+planned again.
+"""
+import operator
+import typing as tp
+from collections import OrderedDict
+
+from pysql.datastructures import postings
+
+
+class _Missing:
+
+    def __repr__(self):
+        return 'MISSING'
+
+
+MISSING = _Missing()
+
+_COMPARISONS = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'lt': operator.lt,
+    'le': operator.le,
+    'gt': operator.gt,
+    'ge': operator.ge,
+}
+_RANGE_OPS = ('lt', 'le', 'gt', 'ge')
+
+
+class QueryError(ValueError):
+    pass
+
+
+class Expr:
+    """Node of a query expression. Combine nodes with &, | and ~."""
+
+    def __and__(self, other: 'Expr') -> 'Expr':
+        return And(self, other)
+
+    def __or__(self, other: 'Expr') -> 'Expr':
+        return Or(self, other)
+
+    def __invert__(self) -> 'Expr':
+        return Not(self)
+
+
+class Compare(Expr):
+
+    def __init__(self, op: str, path: str, value: tp.Any):
+        if op not in _COMPARISONS and op not in ('in', 'exists'):
+            raise QueryError(f'Unknown comparison: {op}')
+        self.op = op
+        self.path = path
+        self.value = value
+
+    def __repr__(self):
+        return f'Compare({self.op!r}, {self.path!r}, {self.value!r})'
+
+
+class And(Expr):
+
+    def __init__(self, *children: Expr):
+        self.children = children
+
+    def __repr__(self):
+        return f'And{self.children!r}'
+
+
+class Or(Expr):
+
+    def __init__(self, *children: Expr):
+        self.children = children
+
+    def __repr__(self):
+        return f'Or{self.children!r}'
+
+
+class Not(Expr):
+
+    def __init__(self, child: Expr):
+        self.child = child
+
+    def __repr__(self):
+        return f'Not({self.child!r})'
+
+
+class Field:
+    """
+    Field reference, nested fields are joined by dots: F('address.city').
+    Comparing a field builds a query expression.
+    """
+    __hash__ = None
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __eq__(self, other) -> Compare:
+        return Compare('eq', self.path, other)
+
+    def __ne__(self, other) -> Compare:
+        return Compare('ne', self.path, other)
+
+    def __lt__(self, other) -> Compare:
+        return Compare('lt', self.path, other)
+
+    def __le__(self, other) -> Compare:
+        return Compare('le', self.path, other)
+
+    def __gt__(self, other) -> Compare:
+        return Compare('gt', self.path, other)
+
+    def __ge__(self, other) -> Compare:
+        return Compare('ge', self.path, other)
+
+    def in_(self, values: tp.Iterable) -> Compare:
+        return Compare('in', self.path, list(values))
+
+    def exists(self, flag: bool = True) -> Compare:
+        return Compare('exists', self.path, flag)
+
+
+F = Field
+
+_DICT_OPS = {
+    '$eq': 'eq', '$ne': 'ne', '$lt': 'lt', '$lte': 'le', '$gt': 'gt', '$gte': 'ge',
+    '$in': 'in', '$exists': 'exists',
+}
+
+
+def parse(query: dict) -> Expr:
+    """Build an expression from a dict query; top-level keys are ANDed."""
+    if not isinstance(query, dict):
+        raise QueryError(f'Query must be a dict, got {type(query).__name__}')
+
+    children = []
+    for key, value in query.items():
+        if key in ('$and', '$or'):
+            parts = [parse(q) for q in value]
+            children.append(And(*parts) if key == '$and' else Or(*parts))
+        elif key == '$not':
+            children.append(Not(parse(value)))
+        elif key.startswith('$'):
+            raise QueryError(f'Unknown operator: {key}')
+        elif isinstance(value, dict) and value and all(k.startswith('$') for k in value):
+            for op, operand in value.items():
+                if op not in _DICT_OPS:
+                    raise QueryError(f'Unknown operator: {op}')
+                children.append(Compare(_DICT_OPS[op], key, operand))
+        else:
+            children.append(Compare('eq', key, value))
+    return children[0] if len(children) == 1 else And(*children)
+
+
+def where(*exprs: tp.Union[Expr, dict], **constraints) -> tp.Optional[Expr]:
+    """ANDs expressions, dict queries and field=value constraints; None if empty."""
+    children = [parse(e) if isinstance(e, dict) else e for e in exprs]
+    children.extend(Compare('eq', key, value) for key, value in constraints.items())
+    if not children:
+        return None
+    return children[0] if len(children) == 1 else And(*children)
+
+
+def normalize(expr: Expr) -> tp.Tuple[tuple, list]:
+    """
+    Split an expression into its shape and constants.
+
+    The shape is a hashable tuple tree with the constants taken out;
+    constants are listed in the order their comparisons appear in the
+    shape. ANDs and ORs are flattened and their operands sorted, so
+    queries that only differ in constants or operand order share a shape.
+    """
+    if isinstance(expr, Compare):
+        return ('cmp', expr.op, tuple(expr.path.split('.'))), [expr.value]
+
+    if isinstance(expr, Not):
+        child = expr.child
+        if isinstance(child, Not):
+            return normalize(child.child)
+        shape, params = normalize(child)
+        return ('not', shape), params
+
+    if isinstance(expr, (And, Or)):
+        kind = 'and' if isinstance(expr, And) else 'or'
+        parts = []
+        for child in expr.children:
+            shape, params = normalize(child)
+            if shape[0] == kind:
+                # a nested node of the same kind was normalized already,
+                # but its params have to be split per operand again
+                parts.extend(_split(shape[1], params))
+            else:
+                parts.append((shape, params))
+        if len(parts) == 1:
+            return parts[0]
+        parts.sort(key=lambda part: repr(part[0]))
+        return (kind, tuple(shape for shape, _ in parts)), [p for _, params in parts for p in params]
+
+    raise QueryError(f'Not a query expression: {expr!r}')
+
+
+def _param_count(shape: tuple) -> int:
+    if shape[0] == 'cmp':
+        return 1
+    if shape[0] == 'not':
+        return _param_count(shape[1])
+    return sum(_param_count(child) for child in shape[1])
+
+
+def _split(shapes: tp.Tuple[tuple, ...], params: list):
+    pos = 0
+    for shape in shapes:
+        n = _param_count(shape)
+        yield shape, params[pos:pos + n]
+        pos += n
+
+
+Predicate = tp.Callable[[dict, list], bool]
+
+
+def _getter(path: tp.Tuple[str, ...]) -> tp.Callable[[dict], tp.Any]:
+    if len(path) == 1:
+        key = path[0]
+        return lambda record: record.get(key, MISSING)
+
+    def get(record):
+        value = record
+        for key in path:
+            if not isinstance(value, dict):
+                return MISSING
+            value = value.get(key, MISSING)
+        return value
+
+    return get
+
+
+def sort_key(path: str) -> tp.Callable[[dict], tuple]:
+    """Key ordering records by a field; records without it come first."""
+    get = _getter(tuple(path.split('.')))
+
+    def key(record):
+        value = get(record)
+        return (0,) if value is MISSING else (1, value)
+
+    return key
+
+
+def _compile_predicate(shape: tuple, slot: int) -> tp.Tuple[Predicate, int]:
+    """Closure evaluating `shape` on a record; params start at `slot`."""
+    kind = shape[0]
+
+    if kind == 'cmp':
+        _, op, path = shape
+        get = _getter(path)
+
+        if op == 'exists':
+            return (lambda record, params: (get(record) is not MISSING) == bool(params[slot])), slot + 1
+        if op == 'in':
+            def is_in(record, params):
+                value = get(record)
+                return value is not MISSING and any(value == v for v in params[slot])
+            return is_in, slot + 1
+        if op == 'ne':
+            # the negation of eq, so records without the field match
+            return (lambda record, params: get(record) != params[slot]), slot + 1
+
+        compare = _COMPARISONS[op]
+
+        def compare_field(record, params):
+            value = get(record)
+            if value is MISSING:
+                return False
+            try:
+                return compare(value, params[slot])
+            except TypeError:
+                return False
+        return compare_field, slot + 1
+
+    if kind == 'not':
+        child, slot = _compile_predicate(shape[1], slot)
+        return (lambda record, params: not child(record, params)), slot
+
+    children = []
+    for child_shape in shape[1]:
+        child, slot = _compile_predicate(child_shape, slot)
+        children.append(child)
+    if kind == 'and':
+        return (lambda record, params: all(child(record, params) for child in children)), slot
+    return (lambda record, params: any(child(record, params) for child in children)), slot
+
+
+class Probe:
+    """
+    Index lookup on one field; nested fields have their own dotted indexes.
+
+    `terms` are (op, slot) pairs: a single eq or in term gives the keys to
+    look up, range terms on the field are merged into one range scan.
+    """
+
+    def __init__(self, field: str, terms: tp.List[tp.Tuple[str, int]]):
+        self.field = field
+        self.terms = terms
+
+    def __repr__(self):
+        return f'Probe({self.field!r}, {self.terms!r})'
+
+    def describe(self, params: list) -> str:
+        return ' and '.join(f'{self.field} {op} {params[slot]!r}' for op, slot in self.terms)
+
+    def offsets(self, indexes, params: list) -> tp.Optional[postings.Offsets]:
+        """
+        Matching offsets in ascending order, None if the index can't answer
+        for these params. May be the index's own posting list, don't change it.
+        """
+        op, slot = self.terms[0]
+        if op == 'eq' and isinstance(params[slot], dict):
+            # objects are indexed by their fields, not as a whole
+            return None
+        if op == 'in' and any(isinstance(value, dict) for value in params[slot]):
+            return None
+
+        if self.field not in indexes:
+            return postings.make()
+        index = indexes[self.field]
+
+        try:
+            if op == 'eq':
+                return index.get(params[slot]) or postings.make()
+            if op == 'in':
+                return postings.union_all(index.get(value) for value in params[slot])
+
+            low = high = None
+            low_inclusive = high_inclusive = True
+            for op, slot in self.terms:
+                value = params[slot]
+                if value is None:
+                    # nothing orders against None
+                    return postings.make()
+                if op in ('gt', 'ge'):
+                    if low is None or value > low or (value == low and op == 'gt'):
+                        low, low_inclusive = value, op == 'ge'
+                else:
+                    if high is None or value < high or (value == high and op == 'lt'):
+                        high, high_inclusive = value, op == 'le'
+            if low is not None and high is not None and low > high:
+                return postings.make()
+            # every record has one value per field, so the lists are disjoint
+            return postings.union_all(
+                (key_postings for _, key_postings in index.iter_range(low, high, low_inclusive, high_inclusive)),
+                disjoint=True,
+            )
+        except TypeError:
+            # the query value can't be ordered against the indexed values,
+            # so none of them compare equal or within the range either
+            return postings.make()
+
+
+class UnionProbe:
+    """Offsets matching any of several probes: an OR of indexable terms."""
+
+    def __init__(self, alternatives: tp.List[tp.List[Probe]]):
+        self.alternatives = alternatives
+
+    def __repr__(self):
+        return f'UnionProbe({self.alternatives!r})'
+
+    def describe(self, params: list) -> str:
+        return ' or '.join(
+            '(' + ' and '.join(p.describe(params) for p in probes) + ')' for probes in self.alternatives
+        )
+
+    def offsets(self, indexes, params: list) -> tp.Optional[postings.Offsets]:
+        matches = []
+        for probes in self.alternatives:
+            offset_lists = [p.offsets(indexes, params) for p in probes]
+            if any(offsets is None for offsets in offset_lists):
+                return None
+            matches.append(postings.intersect_all(offset_lists))
+        return postings.union_all(matches)
+
+
+class Plan:
+    """
+    Compiled query: index probes and a residual predicate.
+
+    Without probes the plan has to scan every record. Without a residual
+    the probes alone decide which records match.
+    """
+
+    def __init__(self, shape: tuple, probes: tp.List[tp.Union[Probe, UnionProbe]],
+                 residual: tp.Optional[Predicate]):
+        self.shape = shape
+        self.probes = probes
+        self.residual = residual
+        self._predicate = None
+
+    def __repr__(self):
+        return f'Plan(probes={self.probes!r}, residual={self.residual is not None})'
+
+    @property
+    def full_scan(self) -> bool:
+        return not self.probes
+
+    @property
+    def predicate(self) -> Predicate:
+        """The whole query as a closure, for when probes can't be used"""
+        if self._predicate is None:
+            self._predicate = _compile_predicate(self.shape, 0)[0]
+        return self._predicate
+
+    def select(self, indexes, params: list, on_probe: tp.Callable = None
+               ) -> tp.Tuple[tp.Optional[postings.Offsets], tp.Optional[Predicate]]:
+        """
+        Candidate offsets, ascending, and the predicate they still have to pass.
+
+        Candidates are None if every record is one; the predicate is None
+        if every candidate matches. `on_probe(probe, offsets)` is called
+        after each probe.
+        """
+        if not self.probes:
+            return None, self.residual
+
+        offset_sets = []
+        for probe in self.probes:
+            offsets = probe.offsets(indexes, params)
+            if on_probe is not None:
+                on_probe(probe, offsets)
+            offset_sets.append(offsets)
+        usable = [offsets for offsets in offset_sets if offsets is not None]
+        if len(usable) < len(offset_sets):
+            # some probe can't answer for these params: narrow with the
+            # others and check the whole query on what is left
+            return (postings.intersect_all(usable) if usable else None), self.predicate
+        return postings.intersect_all(usable), self.residual
+
+
+def _probe_terms(shape: tuple, slot: int) -> tp.Optional[tp.List[Probe]]:
+    """Probes that exactly cover `shape`, or None if it needs the residual."""
+    if shape[0] == 'cmp':
+        _, op, path = shape
+        if op in ('eq', 'in') or op in _RANGE_OPS:
+            return [Probe('.'.join(path), [(op, slot)])]
+        return None
+
+    if shape[0] == 'and':
+        probes = []
+        for child in shape[1]:
+            child_probes = _probe_terms(child, slot)
+            if child_probes is None:
+                return None
+            probes.extend(child_probes)
+            slot += _param_count(child)
+        return _merge_ranges(probes)
+    return None
+
+
+def _merge_ranges(probes: tp.List[Probe]) -> tp.List[Probe]:
+    # range terms on one field become a single scan between both bounds
+    merged = OrderedDict()
+    result = []
+    for probe in probes:
+        if isinstance(probe, Probe) and all(op in _RANGE_OPS for op, _ in probe.terms):
+            if probe.field in merged:
+                merged[probe.field].terms.extend(probe.terms)
+                continue
+            probe = merged[probe.field] = Probe(probe.field, list(probe.terms))
+        result.append(probe)
+    return result
+
+
+def compile_shape(shape: tuple) -> Plan:
+    conjuncts = shape[1] if shape[0] == 'and' else (shape,)
+
+    probes = []
+    residual_parts = []
+    slot = 0
+    for conjunct in conjuncts:
+        covered = _probe_terms(conjunct, slot)
+        if covered is None and conjunct[0] == 'or':
+            alternatives = []
+            child_slot = slot
+            for child in conjunct[1]:
+                child_probes = _probe_terms(child, child_slot)
+                if child_probes is None:
+                    alternatives = None
+                    break
+                alternatives.append(child_probes)
+                child_slot += _param_count(child)
+            if alternatives is not None:
+                covered = [UnionProbe(alternatives)]
+
+        if covered is None:
+            residual_parts.append(_compile_predicate(conjunct, slot)[0])
+        else:
+            probes.extend(covered)
+        slot += _param_count(conjunct)
+
+    probes = _merge_ranges(probes)
+    if not residual_parts:
+        residual = None
+    elif len(residual_parts) == 1:
+        residual = residual_parts[0]
+    else:
+        residual = lambda record, params: all(part(record, params) for part in residual_parts)
+    return Plan(shape, probes, residual)
+
+
+class QueryCompiler:
+    """Compiles expressions into plans, keeping the most recently used plans."""
+
+    def __init__(self, cache_size: int = 256):
+        self._cache_size = cache_size
+        self._plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, expr: Expr) -> tp.Tuple[Plan, list]:
+        """The plan for `expr` and the params to run it with."""
+        shape, params = normalize(expr)
+        plan = self._plans.get(shape)
+        if plan is not None:
+            self.hits += 1
+            self._plans.move_to_end(shape)
+            return plan, params
+
+        self.misses += 1
+        plan = compile_shape(shape)
+        if self._cache_size > 0:
+            self._plans[shape] = plan
+            while len(self._plans) > self._cache_size:
+                self._plans.popitem(last=False)
+        return plan, params
+
+    def clear(self):
+        self._plans.clear()
@@ -0,0 +1,548 @@
+"""
+File-backed B+tree mapping keys to posting lists of integers.
+
+The file is split into fixed-size pages. Page 0 is the header, every other
+page holds one tree node, an overflow chunk of a long posting list or a
+link in the free list. Each page is a 4-byte big-endian length followed by
+JSON, zero padded up to the page size.
+
+Only pages in a bounded LRU cache are kept in memory; dirty pages are
+written back when they are evicted and on `flush`. There is no write-ahead
+log: the file is consistent after `flush` returns.
+"""
+import bisect
+import json
+import os
+import struct
+import typing as tp
+from collections import OrderedDict
+from pathlib import Path
+
+from pysql.interfaces import Comparable
+
+
+LEAF = 'l'
+INTERNAL = 'i'
+OVERFLOW = 'o'
+FREE = 'f'
+HEADER = 'h'
+
+_LENGTH = struct.Struct('>I')
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, separators=(',', ':'))
+
+
+class _Page:
+    __slots__ = ('id', 'kind', 'keys', 'values', 'next', 'size_hint')
+
+    def __init__(self, page_id: int, kind: str, keys=None, values=None, next_id: int = 0):
+        self.id = page_id
+        self.kind = kind
+        self.keys = keys if keys is not None else []
+        # posting lists or overflow refs for leaves, child ids for internal
+        # nodes, integers for overflow pages
+        self.values = values if values is not None else []
+        self.next = next_id
+        self.size_hint = 0
+
+    def encode(self) -> bytes:
+        return _dumps({'t': self.kind, 'k': self.keys, 'v': self.values, 'n': self.next}).encode()
+
+    @classmethod
+    def decode(cls, page_id: int, data: bytes) -> '_Page':
+        obj = json.loads(data)
+        page = cls(page_id, obj['t'], obj['k'], obj['v'], obj['n'])
+        page.size_hint = len(data)
+        return page
+
+
+class BPlusTree:
+    """
+    :param path: file holding the tree, created if missing
+    :param page_size: size of a page in bytes, fixed when the file is created
+    :param cache_pages: number of decoded pages kept in memory
+    :param inline_postings: posting lists longer than this move out of the
+        leaf into a chain of overflow pages
+    """
+    default_page_size = 8192
+
+    def __init__(self, path: tp.Union[str, Path], page_size: int = None,
+                 cache_pages: int = 256, inline_postings: int = 8):
+        self._path = Path(path)
+        self._cache = OrderedDict()
+        self._dirty = set()
+        self._cache_pages = max(cache_pages, 16)
+        self._inline_postings = inline_postings
+        self.hits = 0
+        self.misses = 0
+
+        exists = self._path.exists() and self._path.stat().st_size > 0
+        self._f = open(self._path, 'r+b' if exists else 'w+b')
+        if exists:
+            self._read_header()
+        else:
+            self._init_header(page_size or self.default_page_size)
+
+    # header #
+
+    def _init_header(self, page_size: int):
+        self.page_size = page_size
+        self._root = 1
+        self._next_page = 2
+        self._free_head = 0
+        self._height = 1
+        self._keys = 0
+        self._postings = 0
+        root = _Page(self._root, LEAF)
+        root.size_hint = len(root.encode())
+        self._mark_dirty(root)
+        self.flush()
+
+    def _read_header(self):
+        self._f.seek(0)
+        (length,) = _LENGTH.unpack(self._f.read(_LENGTH.size))
+        header = json.loads(self._f.read(length))
+        self.page_size = header['page_size']
+        self._root = header['root']
+        self._next_page = header['next_page']
+        self._free_head = header['free']
+        self._height = header['height']
+        self._keys = header['keys']
+        self._postings = header['postings']
+
+    def _write_header(self):
+        header = {
+            't': HEADER,
+            'page_size': self.page_size,
+            'root': self._root,
+            'next_page': self._next_page,
+            'free': self._free_head,
+            'height': self._height,
+            'keys': self._keys,
+            'postings': self._postings,
+        }
+        self._write_raw(0, _dumps(header).encode())
+
+    # page io #
+
+    @property
+    def _usable(self) -> int:
+        return self.page_size - _LENGTH.size
+
+    @property
+    def _max_key_size(self) -> int:
+        return self.page_size // 8
+
+    @property
+    def _overflow_capacity(self) -> int:
+        # offsets are non-negative 64-bit ints: at most 19 digits and a comma
+        return (self._usable - 32) // 20
+
+    def _write_raw(self, page_id: int, data: bytes):
+        if len(data) > self._usable:
+            raise ValueError(f'Page {page_id} does not fit into {self.page_size} bytes')
+        self._f.seek(page_id * self.page_size)
+        self._f.write(_LENGTH.pack(len(data)) + data + b'\0' * (self._usable - len(data)))
+
+    def _get(self, page_id: int) -> _Page:
+        page = self._cache.get(page_id)
+        if page is not None:
+            self.hits += 1
+            self._cache.move_to_end(page_id)
+            return page
+
+        self.misses += 1
+        self._f.seek(page_id * self.page_size)
+        (length,) = _LENGTH.unpack(self._f.read(_LENGTH.size))
+        page = _Page.decode(page_id, self._f.read(length))
+        self._cache[page_id] = page
+        return page
+
+    def _mark_dirty(self, page: _Page):
+        self._cache[page.id] = page
+        self._cache.move_to_end(page.id)
+        self._dirty.add(page.id)
+
+    def _evict(self):
+        # only called between operations: pages being changed can't be
+        # written out half way, e.g. while a leaf is waiting to be split
+        while len(self._cache) > self._cache_pages:
+            page_id, page = self._cache.popitem(last=False)
+            if page_id in self._dirty:
+                self._write_raw(page_id, page.encode())
+                self._dirty.discard(page_id)
+
+    def _allocate(self, kind: str) -> _Page:
+        if self._free_head:
+            page_id = self._free_head
+            self._free_head = self._get(page_id).next
+        else:
+            page_id = self._next_page
+            self._next_page += 1
+        page = _Page(page_id, kind)
+        page.size_hint = len(page.encode())
+        self._mark_dirty(page)
+        return page
+
+    def _release(self, page: _Page):
+        page.kind = FREE
+        page.keys = []
+        page.values = []
+        page.next = self._free_head
+        self._free_head = page.id
+        self._mark_dirty(page)
+
+    def flush(self):
+        for page_id in sorted(self._dirty):
+            self._write_raw(page_id, self._cache[page_id].encode())
+        self._dirty.clear()
+        self._write_header()
+        self._f.flush()
+
+    def close(self):
+        if not self._f.closed:
+            self.flush()
+            self._f.close()
+
+    def clear(self):
+        """Drop every key and shrink the file back to an empty tree."""
+        self._cache.clear()
+        self._dirty.clear()
+        self._f.truncate(0)
+        self._init_header(self.page_size)
+
+    # posting lists #
+
+    def _read_postings(self, value) -> tp.List[int]:
+        if isinstance(value, list):
+            return list(value)
+
+        postings = []
+        page_id = value['h']
+        while page_id:
+            page = self._get(page_id)
+            postings.extend(page.values)
+            page_id = page.next
+        return postings
+
+    def _append_overflow(self, ref: dict, items: tp.List[int]):
+        tail = self._get(ref['t'])
+        capacity = self._overflow_capacity
+        for item in items:
+            if len(tail.values) >= capacity:
+                new_tail = self._allocate(OVERFLOW)
+                tail.next = new_tail.id
+                self._mark_dirty(tail)
+                tail = new_tail
+                ref['t'] = tail.id
+            tail.values.append(item)
+        self._mark_dirty(tail)
+        ref['c'] += len(items)
+
+    def _to_overflow(self, items: tp.List[int]) -> dict:
+        head = self._allocate(OVERFLOW)
+        ref = {'h': head.id, 't': head.id, 'c': 0}
+        self._append_overflow(ref, items)
+        return ref
+
+    def _free_postings(self, value):
+        if isinstance(value, list):
+            return
+        page_id = value['h']
+        while page_id:
+            page = self._get(page_id)
+            page_id = page.next
+            self._release(page)
+
+    def _remove_posting(self, value, posting: int) -> bool:
+        """Remove one posting in place. Returns False if it was not there."""
+        if isinstance(value, list):
+            if posting not in value:
+                return False
+            value.remove(posting)
+            return True
+
+        page_id = value['h']
+        while page_id:
+            page = self._get(page_id)
+            if posting in page.values:
+                page.values.remove(posting)
+                self._mark_dirty(page)
+                value['c'] -= 1
+                return True
+            page_id = page.next
+        return False
+
+    @staticmethod
+    def _postings_count(value) -> int:
+        return len(value) if isinstance(value, list) else value['c']
+
+    # search #
+
+    def _find_leaf(self, key: Comparable) -> tp.Tuple[_Page, tp.List[_Page]]:
+        path = []
+        page = self._get(self._root)
+        while page.kind == INTERNAL:
+            path.append(page)
+            page = self._get(page.values[bisect.bisect_right(page.keys, key)])
+        return page, path
+
+    def _leftmost_leaf(self) -> _Page:
+        page = self._get(self._root)
+        while page.kind == INTERNAL:
+            page = self._get(page.values[0])
+        return page
+
+    def get(self, key: Comparable) -> tp.Optional[tp.List[int]]:
+        leaf, _ = self._find_leaf(key)
+        i = bisect.bisect_left(leaf.keys, key)
+        postings = None
+        if i < len(leaf.keys) and leaf.keys[i] == key:
+            postings = self._read_postings(leaf.values[i])
+        self._evict()
+        return postings
+
+    def __contains__(self, key: Comparable) -> bool:
+        leaf, _ = self._find_leaf(key)
+        i = bisect.bisect_left(leaf.keys, key)
+        self._evict()
+        return i < len(leaf.keys) and leaf.keys[i] == key
+
+    def __len__(self) -> int:
+        return self._keys
+
+    def iter_range(self, low: Comparable = None, high: Comparable = None,
+                   low_inclusive: bool = True, high_inclusive: bool = True
+                   ) -> tp.Iterator[tp.Tuple[Comparable, tp.List[int]]]:
+        """Yield (key, postings) in key order for keys between `low` and `high`."""
+        if low is None:
+            leaf, i = self._leftmost_leaf(), 0
+        else:
+            leaf, _ = self._find_leaf(low)
+            i = (bisect.bisect_left if low_inclusive else bisect.bisect_right)(leaf.keys, low)
+
+        while True:
+            keys = leaf.keys
+            while i < len(keys):
+                key = keys[i]
+                if high is not None and (key > high or (key == high and not high_inclusive)):
+                    return
+                yield key, self._read_postings(leaf.values[i])
+                i += 1
+            if not leaf.next:
+                return
+            leaf, i = self._get(leaf.next), 0
+            self._evict()
+
+    # insertion #
+
+    def insert(self, key: Comparable, posting: int):
+        """Append `posting` to the list stored under `key`."""
+        self._insert(key, posting)
+        self._evict()
+
+    def _insert(self, key: Comparable, posting: int):
+        leaf, path = self._find_leaf(key)
+        i = bisect.bisect_left(leaf.keys, key)
+
+        if i < len(leaf.keys) and leaf.keys[i] == key:
+            value = leaf.values[i]
+            if isinstance(value, list):
+                value.append(posting)
+                leaf.size_hint += len(str(posting)) + 1
+                if len(value) > self._inline_postings:
+                    ref = self._to_overflow(value)
+                    leaf.values[i] = ref
+                    leaf.size_hint += len(_dumps(ref)) - len(_dumps(value))
+            else:
+                ref_size = len(_dumps(value))
+                self._append_overflow(value, [posting])
+                leaf.size_hint += len(_dumps(value)) - ref_size
+            self._postings += 1
+            self._mark_dirty(leaf)
+            self._split_if_needed(leaf, path)
+            return
+
+        key_size = len(_dumps(key))
+        if key_size > self._max_key_size:
+            raise ValueError(f'Key is too long for a B+tree index: {key_size} bytes')
+
+        leaf.keys.insert(i, key)
+        leaf.values.insert(i, [posting])
+        leaf.size_hint += key_size + len(str(posting)) + 4
+        self._keys += 1
+        self._postings += 1
+        self._mark_dirty(leaf)
+        self._split_if_needed(leaf, path)
+
+    def _overfull(self, page: _Page) -> bool:
+        if page.size_hint <= self._usable:
+            return False
+        # the hint overestimates, so only measure when it says we might be full
+        page.size_hint = len(page.encode())
+        return page.size_hint > self._usable
+
+    def _split_if_needed(self, page: _Page, path: tp.List[_Page]):
+        while self._overfull(page):
+            right = self._allocate(page.kind)
+            mid = len(page.keys) // 2
+
+            if page.kind == LEAF:
+                right.keys, page.keys = page.keys[mid:], page.keys[:mid]
+                right.values, page.values = page.values[mid:], page.values[:mid]
+                right.next, page.next = page.next, right.id
+                separator = right.keys[0]
+            else:
+                separator = page.keys[mid]
+                right.keys, page.keys = page.keys[mid + 1:], page.keys[:mid]
+                right.values, page.values = page.values[mid + 1:], page.values[:mid + 1]
+
+            page.size_hint = len(page.encode())
+            right.size_hint = len(right.encode())
+            self._mark_dirty(page)
+            self._mark_dirty(right)
+
+            if path:
+                parent = path.pop()
+            else:
+                parent = self._allocate(INTERNAL)
+                parent.values = [page.id]
+                self._root = parent.id
+                self._height += 1
+
+            pos = bisect.bisect_right(parent.keys, separator)
+            parent.keys.insert(pos, separator)
+            parent.values.insert(pos + 1, right.id)
+            parent.size_hint += len(_dumps(separator)) + len(str(right.id)) + 2
+            self._mark_dirty(parent)
+            page = parent
+
+    # deletion #
+
+    def remove(self, key: Comparable, posting: int = None):
+        """
+        Remove `posting` from the list under `key`, or the whole key if no
+        posting is given. Leaves are allowed to underflow: pages are not
+        merged, which keeps deletes cheap and is fine for an index that
+        gets rebuilt on vacuum.
+        """
+        self._remove(key, posting)
+        self._evict()
+
+    def _remove(self, key: Comparable, posting: int = None):
+        leaf, _ = self._find_leaf(key)
+        i = bisect.bisect_left(leaf.keys, key)
+        if i >= len(leaf.keys) or leaf.keys[i] != key:
+            return
+
+        value = leaf.values[i]
+        if posting is not None:
+            if not self._remove_posting(value, posting):
+                return
+            self._postings -= 1
+            if self._postings_count(value):
+                self._mark_dirty(leaf)
+                return
+        else:
+            self._postings -= self._postings_count(value)
+
+        self._free_postings(value)
+        del leaf.keys[i]
+        del leaf.values[i]
+        leaf.size_hint = len(leaf.encode())
+        self._keys -= 1
+        self._mark_dirty(leaf)
+
+    # bulk loading #
+
+    def bulk_load(self, items: tp.Iterable[tp.Tuple[Comparable, tp.List[int]]], fill: float = 0.8):
+        """
+        Replace the contents with (key, postings) pairs sorted by key.
+
+        Leaves are filled left to right up to `fill` of a page and the
+        internal levels are built bottom up, so every page is written once.
+        Runs of equal keys are merged.
+        """
+        self.clear()
+        budget = int(self._usable * fill)
+
+        leaves = []
+        leaf = self._get(self._root)
+        leaf.size_hint = len(leaf.encode())
+        for key, postings in items:
+            if leaf.keys and leaf.keys[-1] == key:
+                value = leaf.values[-1]
+                value_size = len(_dumps(value))
+                if isinstance(value, list):
+                    value.extend(postings)
+                    if len(value) > self._inline_postings:
+                        leaf.values[-1] = self._to_overflow(value)
+                else:
+                    self._append_overflow(value, list(postings))
+                # the entry grew by its postings or by a longer overflow ref
+                leaf.size_hint += len(_dumps(leaf.values[-1])) - value_size
+                self._postings += len(postings)
+                continue
+
+            key_size = len(_dumps(key))
+            if key_size > self._max_key_size:
+                raise ValueError(f'Key is too long for a B+tree index: {key_size} bytes')
+            postings = list(postings)
+            value = postings if len(postings) <= self._inline_postings else self._to_overflow(postings)
+            entry_size = key_size + len(_dumps(value)) + 2
+
+            if leaf.keys and leaf.size_hint + entry_size > budget:
+                self._mark_dirty(leaf)
+                leaves.append((leaf.keys[0], leaf.id))
+                new_leaf = self._allocate(LEAF)
+                leaf.next = new_leaf.id
+                self._mark_dirty(leaf)
+                leaf = new_leaf
+
+            leaf.keys.append(key)
+            leaf.values.append(value)
+            leaf.size_hint += entry_size
+            self._keys += 1
+            self._postings += len(postings)
+
+        self._mark_dirty(leaf)
+        leaves.append((leaf.keys[0] if leaf.keys else None, leaf.id))
+
+        level = leaves
+        while len(level) > 1:
+            parents = []
+            node = None
+            for first_key, page_id in level:
+                entry_size = len(_dumps(first_key)) + len(str(page_id)) + 2
+                if node is None or node.size_hint + entry_size > budget:
+                    if node is not None:
+                        self._mark_dirty(node)
+                    node = self._allocate(INTERNAL)
+                    node.values.append(page_id)
+                    parents.append((first_key, node.id))
+                    continue
+                node.keys.append(first_key)
+                node.values.append(page_id)
+                node.size_hint += entry_size
+            self._mark_dirty(node)
+            level = parents
+            self._height += 1
+
+        self._root = level[0][1]
+        self.flush()
+        self._evict()
+
+    def stats(self) -> dict:
+        return {
+            'keys': self._keys,
+            'postings': self._postings,
+            'height': self._height,
+            'pages': self._next_page,
+            'page_size': self.page_size,
+            'cached_pages': len(self._cache),
+            'cache_hits': self.hits,
+            'cache_misses': self.misses,
+            'file_bytes': os.fstat(self._f.fileno()).st_size,
+        }
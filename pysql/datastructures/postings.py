@@ -0,0 +1,175 @@
+"""
+Compact posting lists: the sorted record offsets stored under one index key.
+
+In memory a posting list is an `array('q')`, 8 bytes per offset instead
+of a list of boxed ints. Large lists can be moved to a memory-mapped file
+(`SpilledPostings`) and read in place. Both are sorted, so intersections
+merge them or binary search the larger one instead of building sets.
+
+The functions here accept any sorted sequence of ints: arrays, spilled
+lists and the plain lists of on-disk indexes.
+"""
+import mmap
+import os
+import typing as tp
+import weakref
+from array import array
+from bisect import bisect_left
+from itertools import chain
+
+TYPECODE = 'q'
+ITEMSIZE = array(TYPECODE).itemsize
+
+# intersect by binary search in the larger list when it is this many
+# times larger than the smaller one, otherwise by merging both
+_SEARCH_RATIO = 8
+
+Offsets = tp.Sequence[int]
+
+
+def make(offsets: tp.Iterable[int] = ()) -> array:
+    """Posting list of `offsets`, which must be sorted"""
+    return array(TYPECODE, offsets)
+
+
+def insert(postings: array, offset: int):
+    """Add `offset`, keeping the list sorted; appending is the usual case"""
+    if not postings or offset > postings[-1]:
+        postings.append(offset)
+    else:
+        postings.insert(bisect_left(postings, offset), offset)
+
+
+def discard(postings: array, offset: int) -> bool:
+    """Remove `offset`; False if it isn't there"""
+    i = bisect_left(postings, offset)
+    if i < len(postings) and postings[i] == offset:
+        del postings[i]
+        return True
+    return False
+
+
+def copy(postings: Offsets) -> array:
+    if isinstance(postings, array):
+        return postings[:]
+    if isinstance(postings, SpilledPostings):
+        return postings.to_array()
+    return array(TYPECODE, postings)
+
+
+def intersect(a: Offsets, b: Offsets) -> array:
+    small, large = (a, b) if len(a) <= len(b) else (b, a)
+    if not small:
+        return make()
+    result = make()
+    if len(large) < _SEARCH_RATIO * len(small):
+        large = iter(large)
+        other = next(large)
+        for offset in small:
+            while other < offset:
+                other = next(large, None)
+                if other is None:
+                    return result
+            if other == offset:
+                result.append(offset)
+        return result
+
+    lo, end = 0, len(large)
+    for offset in small:
+        lo = bisect_left(large, offset, lo)
+        if lo == end:
+            break
+        if large[lo] == offset:
+            result.append(offset)
+    return result
+
+
+def intersect_all(lists: tp.List[Offsets]) -> array:
+    """Offsets in every list, as a new posting list; smallest lists first"""
+    lists = sorted(lists, key=len)
+    if len(lists) == 1:
+        return copy(lists[0])
+    result = intersect(lists[0], lists[1])
+    for postings in lists[2:]:
+        if not result:
+            break
+        result = intersect(result, postings)
+    return result
+
+
+def union_all(lists: tp.Iterable[Offsets], disjoint: bool = False) -> array:
+    """
+    Offsets in any list, as a new posting list. `disjoint` lists, like
+    those of different keys of one index, need no deduplication.
+    """
+    lists = [postings for postings in lists if postings]
+    if not lists:
+        return make()
+    if len(lists) == 1:
+        return copy(lists[0])
+    offsets = chain.from_iterable(lists)
+    return array(TYPECODE, sorted(offsets if disjoint else set(offsets)))
+
+
+class SpilledPostings:
+    """
+    Read-only posting list in a memory-mapped file, so it takes page
+    cache rather than heap. The file is removed once the list is dropped.
+    """
+    __slots__ = ('_view', '_release', '__weakref__')
+
+    def __init__(self, path: tp.Union[str, os.PathLike]):
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        raw = memoryview(mapped)
+        self._view = raw.cast(TYPECODE)
+        self._release = weakref.finalize(self, _release, (self._view, raw), mapped, os.fspath(path))
+
+    @classmethod
+    def write(cls, postings: array, path: tp.Union[str, os.PathLike]) -> 'SpilledPostings':
+        """Spill a non-empty posting list to `path`"""
+        with open(path, 'wb') as f:
+            postings.tofile(f)
+        return cls(path)
+
+    def __len__(self):
+        return len(self._view)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            # a copy, a view would keep the mapping open
+            with self._view[item] as view:
+                return array(TYPECODE, view.tolist())
+        return self._view[item]
+
+    def __iter__(self):
+        return iter(self._view)
+
+    def __repr__(self):
+        return f'SpilledPostings({len(self)} offsets)'
+
+    def to_array(self) -> array:
+        postings = make()
+        with self._view.cast('B') as data:
+            postings.frombytes(data)
+        return postings
+
+    def load(self) -> array:
+        """The list back in memory; the file is released"""
+        postings = self.to_array()
+        self._release()
+        return postings
+
+
+def _release(views: tp.Tuple[memoryview, ...], mapped: mmap.mmap, path: str):
+    try:
+        for view in views:
+            view.release()
+        mapped.close()
+    except BufferError:
+        # the view is still exported; the mapping goes with the export
+        pass
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
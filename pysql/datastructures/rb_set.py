@@ -1,6 +1,6 @@
 import typing as tp
 
-from pysql.datastructures.rbtree import RedBlackTree, Node
+from pysql.datastructures.rbtree import RedBlackTree, Node, TNULL, BLACK, RED
 
 
 class RBSet:
@@ -9,7 +9,7 @@ class RBSet:
         self._tree = RedBlackTree()
 
         for k, v in data:
-            self._tree.insert(k, v)
+            self.add(k, v)
 
     def __contains__(self, key: int):
         return not self._tree.search(key).is_null()
@@ -20,6 +20,10 @@ class RBSet:
     def __setitem__(self, key, value):
         self._tree.insert(key, value)
 
+    def add(self, key, value):
+        """Append `value` to the list stored under `key`."""
+        self._tree.setdefault(key, []).append(value)
+
     def delete(self, key):
         return self._tree.delete(key)
 
@@ -29,9 +33,31 @@ class RBSet:
     def __repr__(self):
         return str(self)
 
+    def __len__(self):
+        return self._tree.size
+
+    def nodes(self) -> tp.Iterator[Node]:
+        """Nodes in key order, to replace values in place"""
+        return self._tree.inorder()
+
+    def items(self) -> tp.Iterator[tp.Tuple[tp.Any, tp.Any]]:
+        """(key, value) pairs in key order."""
+        for node in self._tree.inorder():
+            yield node.get_key(), node.value
+
+    def iter_range(self, low=None, high=None, low_inclusive=True, high_inclusive=True):
+        """(key, value) pairs in key order for keys between `low` and `high`."""
+        for node in self._tree.inorder(start=low):
+            key = node.get_key()
+            if not low_inclusive and key == low:
+                continue
+            if high is not None and (key > high or (key == high and not high_inclusive)):
+                return
+            yield key, node.value
+
     def dump(self) -> tp.List[tp.Tuple[int, tp.Any, str]]:
         """Encodes a tree to a single list."""
-        if not self._tree.root:
+        if self._tree.root is TNULL:
             return []
 
         queue = [self._tree.root]
@@ -39,7 +65,7 @@ class RBSet:
 
         while queue:
             node = queue.pop(0)
-            if node:
+            if node is not TNULL:
                 result.append((node.get_key(), node.value, node._color))
                 queue.append(node.left)
                 queue.append(node.right)
@@ -51,37 +77,96 @@ class RBSet:
     def dump_str(self):
         return str(self.dump())
 
+    @classmethod
+    def from_sorted(cls, items: tp.Iterable[tp.Tuple[tp.Any, tp.List]],
+                    postings: tp.Callable[[tp.Iterable], tp.Any] = list) -> "RBSet":
+        """
+        Build a set from (key, postings) pairs sorted by key in O(n).
+
+        Runs of equal keys are merged into one posting list, made by
+        `postings` from the first run and then extended. The tree is
+        built by splitting at midpoints, so every path ends at the same
+        depth give or take one; nodes on an incomplete last level are red
+        and all others black, which makes it a valid red-black tree.
+        """
+        keys = []
+        values = []
+        for key, key_postings in items:
+            if keys and keys[-1] == key:
+                values[-1].extend(key_postings)
+            else:
+                keys.append(key)
+                values.append(postings(key_postings))
+
+        obj = cls()
+        n = len(keys)
+        if not n:
+            return obj
+
+        red_depth = n.bit_length() - 1
+        if n + 1 == 1 << n.bit_length():
+            # perfect tree, no partial last level
+            red_depth = -1
+
+        nodes = [None] * n
+        # (lo, hi, parent index, is left child, depth) ranges to build
+        stack = [(0, n, -1, False, 0)]
+        while stack:
+            lo, hi, parent, is_left, depth = stack.pop()
+            mid = (lo + hi) // 2
+            node = Node(keys[mid], values[mid], color=RED if depth == red_depth else BLACK)
+            nodes[mid] = node
+            if parent >= 0:
+                node.parent = nodes[parent]
+                if is_left:
+                    nodes[parent].left = node
+                else:
+                    nodes[parent].right = node
+            if lo < mid:
+                stack.append((lo, mid, mid, True, depth + 1))
+            if mid + 1 < hi:
+                stack.append((mid + 1, hi, mid, False, depth + 1))
+
+        obj._tree.root = nodes[n // 2]
+        obj._tree.size = n
+        return obj
+
     @classmethod
     def load(cls, data) -> tp.Optional["RBSet"]:
-        if data is None or len(data) == 0:
+        """Rebuild the exact tree written by `dump` in O(n)."""
+        if data is None or len(data) == 0 or data[0] is None or data[0][0] is None:
             return None
 
         # todo: Convert to a structure instead of tuple
         root = Node(data[0][0], data[0][1], color=data[0][2])
         queue = [root]
+        head = 0
         i = 1
-        size = 0
-
-        while queue and i < len(data):
-            node = queue.pop(0)
-
-            if data[i] is not None:
-                left_node = Node(data[i][0], data[i][1], data[i][2])
-                node.left = left_node
-                queue.append(left_node)
-                size += 1
-            i += 1
 
-            if i < len(data) and data[i] is not None:
-                right_node = Node(data[i][0], data[i][1], data[i][2])
-                node.right = right_node
-                queue.append(right_node)
-                size += 1
-            i += 1
+        while head < len(queue) and i < len(data):
+            node = queue[head]
+            head += 1
+
+            for side in ('left', 'right'):
+                entry = data[i] if i < len(data) else None
+                i += 1
+                if entry is None:
+                    continue
+                if entry[0] is None:
+                    # older dumps wrote the sentinel out as a (None, None, 0)
+                    # entry followed by its two empty children; skip them
+                    queue.append(None)
+                    continue
+
+                child = Node(entry[0], entry[1], color=entry[2])
+                if node is not None:
+                    child.parent = node
+                    setattr(node, side, child)
+                queue.append(child)
 
         obj = cls([])
         tree = RedBlackTree()
         tree.root = root
-        tree.size = size
+        tree.size = sum(1 for node in queue if node is not None)
         obj._tree = tree
         return obj
@@ -1,5 +1,5 @@
-# Taken from https://raw.githubusercontent.com/emilydolson/python-red-black-trees/main/src/rbtree.py
-# Unmodified code is below
+# Based on https://raw.githubusercontent.com/emilydolson/python-red-black-trees/main/src/rbtree.py
+# Reworked to be iterative, with slotted nodes and a single shared sentinel
 
 # Implementing Red-Black Tree in Python
 # Adapted from https://www.programiz.com/dsa/red-black-tree
@@ -12,15 +12,19 @@ from pysql.interfaces import Comparable
 
 T = TypeVar('T', bound='Node')
 
+BLACK = 0
+RED = 1
+
 
 # Node creation
 class Node():
+    __slots__ = ('_key', 'parent', 'left', 'right', '_color', 'value')
 
-    def __init__(self: T, key: Comparable, value: Any, color: int = 1) -> None:
+    def __init__(self: T, key: Comparable, value: Any, color: int = RED) -> None:
         self._key = key
         self.parent = None
-        self.left = None
-        self.right = None
+        self.left = TNULL
+        self.right = TNULL
         self._color = color
         self.value = value
 
@@ -28,13 +32,13 @@ class Node():
         return "Key: " + str(self._key) + " Value: " + str(self.value)
 
     def get_color(self: T) -> str:
-        return "black" if self._color == 0 else "red"
+        return "black" if self._color == BLACK else "red"
 
     def set_color(self: T, color: str) -> None:
         if color == "black":
-            self._color = 0
+            self._color = BLACK
         elif color == "red":
-            self._color = 1
+            self._color = RED
         else:
             raise Exception("Unknown color")
 
@@ -42,49 +46,68 @@ class Node():
         return self._key
 
     def is_red(self: T) -> bool:
-        return self._color == 1
+        return self._color == RED
 
     def is_black(self: T) -> bool:
-        return self._color == 0
+        return self._color == BLACK
 
     def is_null(self: T) -> bool:
-        return self._key is None
+        return self is TNULL
 
     def depth(self: T) -> int:
-        return 0 if self.parent is None else self.parent.depth() + 1
+        depth = 0
+        node = self.parent
+        while node is not None:
+            depth += 1
+            node = node.parent
+        return depth
 
     @classmethod
     def null(cls: Type[T]) -> T:
-        node = cls(0, None)
+        node = cls.__new__(cls)
         node._key = None
-        node.set_color("black")
+        node.parent = None
+        node.left = None
+        node.right = None
+        node._color = BLACK
+        node.value = None
         return node
 
 
+# Leaf sentinel shared by every tree. Unlike the CLRS version, no
+# operation ever writes to it, so trees in different threads can share it.
+TNULL = Node.null()
+
+
 S = TypeVar('S', bound='RedBlackTree')
 
 
 class RedBlackTree():
+    TNULL = TNULL
+
     def __init__(self: S) -> None:
-        self.TNULL = Node.null()
-        self.root = self.TNULL
+        self.root = TNULL
         self.size = 0
         self._iter_format = 0
 
     # Dunder Methods #
     def __iter__(self: S) -> Iterator:
         if self._iter_format == 0:
-            return iter(self.preorder())
+            return self.preorder()
         if self._iter_format == 1:
-            return iter(self.inorder())
+            return self.inorder()
         if self._iter_format == 2:
-            return iter(self.postorder())
+            return self.postorder()
+
+    def __len__(self: S) -> int:
+        return self.size
 
     def __getitem__(self: S, key: Comparable) -> Any:
         return self.search(key).value
 
     def __setitem__(self: S, key: Comparable, value: Any) -> None:
-        self.search(key).value = value
+        # a missing key is inserted, the shared TNULL sentinel is never written
+        self.insert(key, value)
 
     # Setters and Getters #
     def get_root(self: S) -> Node:
@@ -101,155 +124,187 @@ class RedBlackTree():
             raise Exception("Unknown style.")
 
     # Iterators #
-    def preorder(self: S) -> list:
+    def preorder(self: S) -> Iterator[Node]:
         return self.pre_order_helper(self.root)
 
-    def inorder(self: S) -> list:
-        return self.in_order_helper(self.root)
+    def inorder(self: S, start: Optional[Comparable] = None) -> Iterator[Node]:
+        """
+        Lazily yield nodes in key order. If `start` is given, iteration
+        begins at the first key >= `start`.
+        """
+        if start is None:
+            return self.in_order_helper(self.root)
+        return self._in_order_from(start)
 
-    def postorder(self: S) -> list:
+    def postorder(self: S) -> Iterator[Node]:
         return self.post_order_helper(self.root)
 
-    def pre_order_helper(self: S, node: Node) -> list:
+    def pre_order_helper(self: S, node: Node) -> Iterator[Node]:
         """
         Perform a preorder tree traversal starting at the
         given node.
         """
-        output = []
-        if not node.is_null():
-            left = self.pre_order_helper(node.left)
-            right = self.pre_order_helper(node.right)
-            output.extend([node])
-            output.extend(left)
-            output.extend(right)
-        return output
-
-    def in_order_helper(self: S, node: Node) -> list:
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node is TNULL:
+                continue
+            yield node
+            stack.append(node.right)
+            stack.append(node.left)
+
+    def in_order_helper(self: S, node: Node) -> Iterator[Node]:
         """
         Perform a inorder tree traversal starting at the
         given node.
         """
-        output = []
-        if not node.is_null():
-            left = self.in_order_helper(node.left)
-            right = self.in_order_helper(node.right)
-            output.extend(left)
-            output.extend([node])
-            output.extend(right)
-        return output
-
-    def post_order_helper(self: S, node: Node) -> list:
-        output = []
-        if not node.is_null():
-            left = self.post_order_helper(node.left)
-            right = self.post_order_helper(node.right)
-            output.extend(left)
-            output.extend(right)
-            output.extend([node])
-        return output
+        stack = []
+        while stack or node is not TNULL:
+            if node is not TNULL:
+                stack.append(node)
+                node = node.left
+            else:
+                node = stack.pop()
+                yield node
+                node = node.right
+
+    def post_order_helper(self: S, node: Node) -> Iterator[Node]:
+        stack = []
+        last = TNULL
+        while stack or node is not TNULL:
+            if node is not TNULL:
+                stack.append(node)
+                node = node.left
+                continue
+
+            top = stack[-1]
+            if top.right is not TNULL and top.right is not last:
+                node = top.right
+            else:
+                last = stack.pop()
+                yield last
+
+    def _in_order_from(self: S, start: Comparable) -> Iterator[Node]:
+        # the stack holds exactly the ancestors whose key is >= start and
+        # which are still to be visited, so the walk resumes from there
+        stack = []
+        node = self.root
+        while node is not TNULL:
+            if start <= node._key:
+                stack.append(node)
+                node = node.left
+            else:
+                node = node.right
+
+        while stack:
+            node = stack.pop()
+            yield node
+            node = node.right
+            while node is not TNULL:
+                stack.append(node)
+                node = node.left
 
     # Search the tree
     def search_tree_helper(self: S, node: Node, key: Comparable) -> Node:
-        if node.is_null() or key == node.get_key():
-            return node
-
-        if key < node.get_key():
-            return self.search_tree_helper(node.left, key)
-        return self.search_tree_helper(node.right, key)
+        while node is not TNULL:
+            node_key = node._key
+            if key == node_key:
+                return node
+            node = node.left if key < node_key else node.right
+        return node
 
     # Balancing the tree after deletion
-    def delete_fix(self: S, x: Node) -> None:
-        while x != self.root and x.is_black():
-            if x == x.parent.left:
-                s = x.parent.right
-                if s.is_red():
-                    s.set_color("black")
-                    x.parent.set_color("red")
-                    self.left_rotate(x.parent)
-                    s = x.parent.right
-
-                if s.left.is_black() and s.right.is_black():
-                    s.set_color("red")
-                    x = x.parent
+    def delete_fix(self: S, x: Node, parent: Node) -> None:
+        # `x` may be the shared sentinel, so its parent is passed in
+        # explicitly instead of being stored on TNULL
+        while x is not self.root and x._color == BLACK:
+            if x is parent.left:
+                s = parent.right
+                if s._color == RED:
+                    s._color = BLACK
+                    parent._color = RED
+                    self.left_rotate(parent)
+                    s = parent.right
+
+                if s.left._color == BLACK and s.right._color == BLACK:
+                    s._color = RED
+                    x = parent
+                    parent = x.parent
                 else:
-                    if s.right.is_black():
-                        s.left.set_color("black")
-                        s.set_color("red")
+                    if s.right._color == BLACK:
+                        s.left._color = BLACK
+                        s._color = RED
                         self.right_rotate(s)
-                        s = x.parent.right
+                        s = parent.right
 
-                    s.set_color(x.parent.get_color())
-                    x.parent.set_color("black")
-                    s.right.set_color("black")
-                    self.left_rotate(x.parent)
+                    s._color = parent._color
+                    parent._color = BLACK
+                    s.right._color = BLACK
+                    self.left_rotate(parent)
                     x = self.root
             else:
-                s = x.parent.left
-                if s.is_red():
-                    s.set_color("black")
-                    x.parent.set_color("red")
-                    self.right_rotate(x.parent)
-                    s = x.parent.left
-
-                if s.left.is_black() and s.right.is_black():
-                    s.set_color("red")
-                    x = x.parent
+                s = parent.left
+                if s._color == RED:
+                    s._color = BLACK
+                    parent._color = RED
+                    self.right_rotate(parent)
+                    s = parent.left
+
+                if s.left._color == BLACK and s.right._color == BLACK:
+                    s._color = RED
+                    x = parent
+                    parent = x.parent
                 else:
-                    if s.left.is_black():
-                        s.right.set_color("black")
-                        s.set_color("red")
+                    if s.left._color == BLACK:
+                        s.right._color = BLACK
+                        s._color = RED
                         self.left_rotate(s)
-                        s = x.parent.left
+                        s = parent.left
 
-                    s.set_color(x.parent.get_color())
-                    x.parent.set_color("black")
-                    s.left.set_color("black")
-                    self.right_rotate(x.parent)
+                    s._color = parent._color
+                    parent._color = BLACK
+                    s.left._color = BLACK
+                    self.right_rotate(parent)
                     x = self.root
-        x.set_color("black")
+        if x is not TNULL:
+            x._color = BLACK
 
     def __rb_transplant(self: S, u: Node, v: Node) -> None:
         if u.parent is None:
             self.root = v
-        elif u == u.parent.left:
+        elif u is u.parent.left:
             u.parent.left = v
         else:
             u.parent.right = v
-        v.parent = u.parent
+        if v is not TNULL:
+            v.parent = u.parent
 
     # Node deletion
     def delete_node_helper(self: S, node: Node, key: Comparable) -> None:
-        z = self.TNULL
-        while not node.is_null():
-            if node.get_key() == key:
-                z = node
-
-            if node.get_key() <= key:
-                node = node.right
-            else:
-                node = node.left
-
-        if z.is_null():
-            # print("Cannot find key in the tree")
+        z = self.search_tree_helper(node, key)
+        if z is TNULL:
             return
 
         y = z
-        y_original_color = y.get_color()
-        if z.left.is_null():
+        y_original_color = y._color
+        if z.left is TNULL:
             # If no left child, just scoot the right subtree up
             x = z.right
+            x_parent = z.parent
             self.__rb_transplant(z, z.right)
-        elif (z.right.is_null()):
+        elif z.right is TNULL:
             # If no right child, just scoot the left subtree up
             x = z.left
+            x_parent = z.parent
             self.__rb_transplant(z, z.left)
         else:
             y = self.minimum(z.right)
-            y_original_color = y.get_color()
+            y_original_color = y._color
             x = y.right
-            if y.parent == z:
-                x.parent = y
+            if y.parent is z:
+                x_parent = y
             else:
+                x_parent = y.parent
                 self.__rb_transplant(y, y.right)
                 y.right = z.right
                 y.right.parent = y
@@ -257,51 +312,57 @@ class RedBlackTree():
             self.__rb_transplant(z, y)
             y.left = z.left
             y.left.parent = y
-            y.set_color(z.get_color())
-        if y_original_color == "black":
-            self.delete_fix(x)
+            y._color = z._color
+        if y_original_color == BLACK:
+            self.delete_fix(x, x_parent)
 
         self.size -= 1
 
     # Balance the tree after insertion
     def fix_insert(self: S, node: Node) -> None:
-        while node.parent.is_red():
-            if node.parent == node.parent.parent.right:
-                u = node.parent.parent.left
-                if u.is_red():
-                    u.set_color("black")
-                    node.parent.set_color("black")
-                    node.parent.parent.set_color("red")
-                    node = node.parent.parent
+        while node.parent._color == RED:
+            grandparent = node.parent.parent
+            if node.parent is grandparent.right:
+                u = grandparent.left
+                if u._color == RED:
+                    u._color = BLACK
+                    node.parent._color = BLACK
+                    grandparent._color = RED
+                    node = grandparent
                 else:
-                    if node == node.parent.left:
+                    if node is node.parent.left:
                         node = node.parent
                         self.right_rotate(node)
-                    node.parent.set_color("black")
-                    node.parent.parent.set_color("red")
+                    node.parent._color = BLACK
+                    node.parent.parent._color = RED
                     self.left_rotate(node.parent.parent)
             else:
-                u = node.parent.parent.right
+                u = grandparent.right
 
-                if u.is_red():
-                    u.set_color("black")
-                    node.parent.set_color("black")
-                    node.parent.parent.set_color("red")
-                    node = node.parent.parent
+                if u._color == RED:
+                    u._color = BLACK
+                    node.parent._color = BLACK
+                    grandparent._color = RED
+                    node = grandparent
                 else:
-                    if node == node.parent.right:
+                    if node is node.parent.right:
                         node = node.parent
                         self.left_rotate(node)
-                    node.parent.set_color("black")
-                    node.parent.parent.set_color("red")
+                    node.parent._color = BLACK
+                    node.parent.parent._color = RED
                     self.right_rotate(node.parent.parent)
-            if node == self.root:
+            if node is self.root:
                 break
-        self.root.set_color("black")
+        self.root._color = BLACK
 
     # Printing the tree
     def __print_helper(self: S, node: Node, indent: str, last: bool) -> None:
-        if not node.is_null():
+        stack = [(node, indent, last)]
+        while stack:
+            node, indent, last = stack.pop()
+            if node is TNULL:
+                continue
+
             sys.stdout.write(indent)
             if last:
                 sys.stdout.write("R----  ")
@@ -312,8 +373,8 @@ class RedBlackTree():
 
             s_color = "RED" if node.is_red() else "BLACK"
             print(str(node.get_key()) + "(" + s_color + ")")
-            self.__print_helper(node.left, indent, False)
-            self.__print_helper(node.right, indent, True)
+            stack.append((node.right, indent, True))
+            stack.append((node.left, indent, False))
 
     def search(self: S, key: Comparable) -> Node:
         return self.search_tree_helper(self.root, key)
@@ -321,52 +382,52 @@ class RedBlackTree():
     def minimum(self: S, node: Node = None) -> Node:
         if node is None:
             node = self.root
-        if node.is_null():
-            return self.TNULL
-        while not node.left.is_null():
+        if node is TNULL:
+            return TNULL
+        while node.left is not TNULL:
             node = node.left
         return node
 
     def maximum(self: S, node: Node = None) -> Node:
         if node is None:
             node = self.root
-        if node.is_null():
-            return self.TNULL
-        while not node.right.is_null():
+        if node is TNULL:
+            return TNULL
+        while node.right is not TNULL:
             node = node.right
         return node
 
     def successor(self: S, x: Node) -> Node:
-        if not x.right.is_null():
+        if x.right is not TNULL:
             return self.minimum(x.right)
 
         y = x.parent
-        while not y.is_null() and x == y.right:
+        while y is not None and x is y.right:
             x = y
             y = y.parent
-        return y
+        return TNULL if y is None else y
 
     def predecessor(self: S,  x: Node) -> Node:
-        if (not x.left.is_null()):
+        if x.left is not TNULL:
             return self.maximum(x.left)
 
         y = x.parent
-        while not y.is_null() and x == y.left:
+        while y is not None and x is y.left:
             x = y
             y = y.parent
 
-        return y
+        return TNULL if y is None else y
 
     def left_rotate(self: S, x: Node) -> None:
         y = x.right
         x.right = y.left
-        if not y.left.is_null():
+        if y.left is not TNULL:
             y.left.parent = x
 
         y.parent = x.parent
         if x.parent is None:
             self.root = y
-        elif x == x.parent.left:
+        elif x is x.parent.left:
             x.parent.left = y
         else:
             x.parent.right = y
@@ -376,43 +437,43 @@ class RedBlackTree():
     def right_rotate(self: S, x: Node) -> None:
         y = x.left
         x.left = y.right
-        if not y.right.is_null():
+        if y.right is not TNULL:
             y.right.parent = x
 
         y.parent = x.parent
         if x.parent is None:
             self.root = y
-        elif x == x.parent.right:
+        elif x is x.parent.right:
             x.parent.right = y
         else:
             x.parent.left = y
         y.right = x
         x.parent = y
 
-
-    def insert(self: S, key: int, value: Any) -> None:
-        node = Node(key, [value])
-        node.left = self.TNULL
-        node.right = self.TNULL
-        node.set_color("red")
-
+    def insert(self: S, key: Comparable, value: Any) -> Node:
+        """
+        Insert `key` with `value`. If the key is already present its value
+        is replaced. Returns the node holding the key.
+        """
         y = None
         x = self.root
 
-        while not x.is_null():
+        while x is not TNULL:
             y = x
-            if node.get_key() < x.get_key():
+            x_key = x._key
+            if key < x_key:
                 x = x.left
-            elif node.get_key() > x.get_key():
+            elif key > x_key:
                 x = x.right
             else:
-                x.value.append(value)
-                return
+                x.value = value
+                return x
 
+        node = Node(key, value)
         node.parent = y
         if y is None:
             self.root = node
-        elif node.get_key() < y.get_key():
+        elif key < y._key:
             y.left = node
         else:
             y.right = node
@@ -420,15 +481,29 @@ class RedBlackTree():
         self.size += 1
 
         if node.parent is None:
-            node.set_color("black")
-            return
+            node._color = BLACK
+            return node
 
         if node.parent.parent is None:
-            return
+            return node
 
         self.fix_insert(node)
+        return node
+
+    def setdefault(self: S, key: Comparable, default: Any = None) -> Any:
+        """Like `dict.setdefault`: value for `key`, inserting `default` if missing."""
+        x = self.root
+        while x is not TNULL:
+            x_key = x._key
+            if key < x_key:
+                x = x.left
+            elif key > x_key:
+                x = x.right
+            else:
+                return x.value
+        return self.insert(key, default).value
 
-    def delete(self: S, key: int) -> None:
+    def delete(self: S, key: Comparable) -> None:
         self.delete_node_helper(self.root, key)
 
     def print_tree(self: S) -> None:
@@ -0,0 +1,122 @@
+import random
+
+import pytest
+
+from pysql.datastructures.bplustree import BPlusTree
+
+
+@pytest.fixture
+def tree_path(tmp_path):
+    return tmp_path / 'index.bpt'
+
+
+def _model_items(model, low=None, high=None):
+    return [
+        (k, model[k]) for k in sorted(model)
+        if (low is None or k >= low) and (high is None or k <= high)
+    ]
+
+
+def test_bplustree_matches_dict_model(tree_path):
+    rnd = random.Random(7)
+    # tiny pages and cache force splits, overflow chains and evictions
+    tree = BPlusTree(tree_path, page_size=512, cache_pages=16, inline_postings=4)
+    model = {}
+
+    for posting in range(5000):
+        key = rnd.randint(0, 300)
+        if rnd.random() < 0.85:
+            tree.insert(key, posting)
+            model.setdefault(key, []).append(posting)
+        elif key in model:
+            if rnd.random() < 0.5:
+                tree.remove(key)
+                del model[key]
+            else:
+                removed = rnd.choice(model[key])
+                tree.remove(key, removed)
+                model[key].remove(removed)
+                if not model[key]:
+                    del model[key]
+
+    assert tree.stats()['height'] >= 2
+    assert len(tree) == len(model)
+    assert list(tree.iter_range()) == _model_items(model)
+    for key in range(-1, 302):
+        assert tree.get(key) == model.get(key)
+
+    tree.close()
+    reopened = BPlusTree(tree_path, cache_pages=16)
+    assert reopened.page_size == 512
+    assert list(reopened.iter_range()) == _model_items(model)
+    assert reopened.stats()['postings'] == sum(len(v) for v in model.values())
+
+
+def test_bplustree_iter_range(tree_path):
+    tree = BPlusTree(tree_path, page_size=256)
+    for key in range(0, 100, 2):
+        tree.insert(key, key)
+
+    keys = lambda *args, **kwargs: [k for k, _ in tree.iter_range(*args, **kwargs)]
+    assert keys(10, 20) == [10, 12, 14, 16, 18, 20]
+    assert keys(10, 20, low_inclusive=False, high_inclusive=False) == [12, 14, 16, 18]
+    assert keys(11, 15) == [12, 14]
+    assert keys(high=4) == [0, 2, 4]
+    assert keys(95) == [96, 98]
+    assert keys(200) == []
+
+
+def test_bplustree_bulk_load(tree_path):
+    tree = BPlusTree(tree_path, page_size=512, cache_pages=16)
+    tree.insert(10 ** 6, 1)
+    items = [(k, list(range(k % 20))) for k in range(1, 3000)] + [(3000, [1]), (3000, [2])]
+    tree.bulk_load(items)
+
+    assert 10 ** 6 not in tree
+    assert tree.get(3000) == [1, 2]
+    assert tree.get(45) == list(range(5))
+    assert [k for k, _ in tree.iter_range(2990)] == list(range(2990, 3001))
+    assert tree.stats()['keys'] == 3000
+
+    tree.insert(0, 7)
+    assert tree.get(0) == [7]
+
+
+def test_bplustree_reuses_freed_pages(tree_path):
+    tree = BPlusTree(tree_path, page_size=512, inline_postings=2)
+    for posting in range(500):
+        tree.insert('hot', posting)
+    pages = tree.stats()['pages']
+
+    tree.remove('hot')
+    for posting in range(500):
+        tree.insert('other', posting)
+    assert tree.stats()['pages'] == pages
+    assert tree.get('other') == list(range(500))
+
+
+def test_bplustree_rejects_huge_keys(tree_path):
+    tree = BPlusTree(tree_path, page_size=512)
+    with pytest.raises(ValueError):
+        tree.insert('x' * 1000, 1)
+
+
+def test_bplustree_many_inserts_into_first_leaf(tree_path):
+    tree = BPlusTree(tree_path)
+    for i in range(3000):
+        tree.insert(i // 8, i * 60)
+        # as Indexes.save does after every record
+        tree.flush()
+    assert tree.get(100) == [i * 60 for i in range(800, 808)]
+    assert len(tree) == 375
+
+
+def test_bplustree_bulk_load_merges_single_posting_runs(tree_path):
+    tree = BPlusTree(tree_path)
+    # what Indexes sends: one posting per run, many runs per key
+    tree.bulk_load(sorted(((i % 1000, [i * 120]) for i in range(4000)), key=lambda item: item[0]))
+    tree.close()
+
+    reopened = BPlusTree(tree_path)
+    assert reopened.get(7) == [7 * 120, 1007 * 120, 2007 * 120, 3007 * 120]
+    assert reopened.stats()['postings'] == 4000
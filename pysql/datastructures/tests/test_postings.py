@@ -0,0 +1,64 @@
+import gc
+import random
+from array import array
+
+import pytest
+
+from pysql.datastructures import postings
+from pysql.datastructures.postings import SpilledPostings
+
+
+def random_postings(rnd, size, universe):
+    return postings.make(sorted(rnd.sample(range(universe), size)))
+
+
+@pytest.mark.parametrize('sizes', [(5, 5), (3, 500), (200, 300), (0, 10), (50, 50, 1000)])
+def test_intersect_and_union_match_sets(sizes):
+    rnd = random.Random(sum(sizes))
+    lists = [random_postings(rnd, size, 2000) for size in sizes]
+    sets = [set(p) for p in lists]
+
+    assert postings.intersect_all(lists).tolist() == sorted(set.intersection(*sets))
+    assert postings.union_all(lists).tolist() == sorted(set.union(*sets))
+
+
+def test_insert_and_discard_keep_order():
+    items = postings.make()
+    for offset in [10, 30, 20, 40, 0]:
+        postings.insert(items, offset)
+    assert items.tolist() == [0, 10, 20, 30, 40]
+    assert postings.discard(items, 20)
+    assert not postings.discard(items, 25)
+    assert items.tolist() == [0, 10, 30, 40]
+
+
+def test_spilled_postings(tmp_path):
+    items = postings.make(range(0, 30000, 3))
+    spilled = SpilledPostings.write(items, tmp_path / 'a.postings')
+    assert len(spilled) == len(items) and spilled[7] == 21
+    # intersected where they are, without loading them
+    assert postings.intersect(spilled, postings.make([3, 4, 29997])).tolist() == [3, 29997]
+    assert postings.intersect_all([spilled]) == items
+
+    assert spilled.load() == items
+    assert not (tmp_path / 'a.postings').exists()
+
+    SpilledPostings.write(items, tmp_path / 'b.postings')
+    gc.collect()
+    assert not (tmp_path / 'b.postings').exists()
+
+
+def test_spilled_postings_merge_and_slices(tmp_path):
+    items = postings.make(range(0, 3000, 3))
+    spilled = SpilledPostings.write(items, tmp_path / 'a.postings')
+    # similar sizes are merged, including past the end of the spilled list
+    other = postings.make(range(0, 4000, 4))
+    assert postings.intersect(spilled, other).tolist() == list(range(0, 3000, 12))
+
+    head = spilled[:3]
+    assert isinstance(head, array) and head == postings.make([0, 3, 6])
+    del spilled
+    gc.collect()
+    # slices are copies, so they don't keep the file mapped
+    assert not (tmp_path / 'a.postings').exists()
+    assert head.tolist() == [0, 3, 6]
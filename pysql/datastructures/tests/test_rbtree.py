@@ -0,0 +1,163 @@
+import random
+import sys
+
+import pytest
+
+from pysql.datastructures.rb_set import RBSet
+from pysql.datastructures.rbtree import RedBlackTree, TNULL
+
+
+def assert_valid(tree):
+    """Check BST order, red-black properties and parent links."""
+    assert tree.root.is_black()
+    assert tree.root is TNULL or tree.root.parent is None
+
+    black_heights = set()
+    stack = [(tree.root, 0)]
+    while stack:
+        node, blacks = stack.pop()
+        if node is TNULL:
+            black_heights.add(blacks)
+            continue
+        blacks += node.is_black()
+        for child in (node.left, node.right):
+            if child is not TNULL:
+                assert child.parent is node
+                assert not (node.is_red() and child.is_red())
+            stack.append((child, blacks))
+        if node.left is not TNULL:
+            assert node.left.get_key() < node.get_key()
+        if node.right is not TNULL:
+            assert node.right.get_key() > node.get_key()
+
+    assert len(black_heights) <= 1
+    assert tree.size == sum(1 for _ in tree.inorder())
+
+
+def test_rbtree_insert_delete_random():
+    rnd = random.Random(42)
+    tree = RedBlackTree()
+    keys = set()
+
+    for _ in range(2000):
+        key = rnd.randint(0, 500)
+        if rnd.random() < 0.6:
+            tree.insert(key, str(key))
+            keys.add(key)
+        else:
+            tree.delete(key)
+            keys.discard(key)
+
+    assert_valid(tree)
+    assert [n.get_key() for n in tree.inorder()] == sorted(keys)
+    for key in range(501):
+        assert (tree.search(key) is not TNULL) == (key in keys)
+
+
+def test_rbtree_insert_replaces_value():
+    tree = RedBlackTree()
+    tree.insert(1, 'a')
+    tree.insert(1, 'b')
+    assert tree.size == 1
+    assert tree[1] == 'b'
+    assert tree.setdefault(1, 'c') == 'b'
+    assert tree.setdefault(2, 'c') == 'c'
+
+
+def test_rbtree_traversals():
+    tree = RedBlackTree()
+    for key in (5, 3, 8, 1, 4, 7, 9):
+        tree.insert(key, None)
+
+    assert [n.get_key() for n in tree.preorder()] == [5, 3, 1, 4, 8, 7, 9]
+    assert [n.get_key() for n in tree.inorder()] == [1, 3, 4, 5, 7, 8, 9]
+    assert [n.get_key() for n in tree.postorder()] == [1, 4, 3, 7, 9, 8, 5]
+
+    assert [n.get_key() for n in tree.inorder(start=4)] == [4, 5, 7, 8, 9]
+    assert [n.get_key() for n in tree.inorder(start=6)] == [7, 8, 9]
+    assert [n.get_key() for n in tree.inorder(start=10)] == []
+
+    tree.set_iteration_style('in')
+    assert [n.get_key() for n in tree] == [1, 3, 4, 5, 7, 8, 9]
+
+
+def test_rbtree_large_tree_without_recursion():
+    tree = RedBlackTree()
+    n = 50_000
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(100)
+    try:
+        for key in range(n):
+            tree.insert(key, None)
+        assert sum(1 for _ in tree.inorder()) == n
+        assert sum(1 for _ in tree.postorder()) == n
+        assert tree.search(n - 1).get_key() == n - 1
+        for key in range(0, n, 2):
+            tree.delete(key)
+    finally:
+        sys.setrecursionlimit(limit)
+
+    assert_valid(tree)
+
+
+def test_rbtree_nodes_are_slotted():
+    tree = RedBlackTree()
+    node = tree.insert(1, None)
+    with pytest.raises(AttributeError):
+        node.__dict__
+    assert node.left is TNULL and RedBlackTree().root is TNULL
+
+
+def test_rbset_dump_load_roundtrip():
+    s = RBSet([(k, str(k)) for k in range(100)])
+    loaded = RBSet.load(s.dump())
+    assert_valid(loaded._tree)
+
+    loaded.add(100, 'x')
+    for k in range(0, 100, 3):
+        loaded.delete(k)
+    assert_valid(loaded._tree)
+    assert [n.get_key() for n in loaded._tree.inorder()] == [k for k in range(101) if k % 3]
+
+
+def test_rbset_loads_legacy_dump():
+    # written by the previous RBSet.dump, which also encoded the sentinels
+    legacy = [(2, ['a'], 0), (1, ['b'], 1), (None, None, 0), (None, None, 0), (None, None, 0),
+              None, None, None, None, None, None]
+    loaded = RBSet.load(legacy)
+    assert [n.get_key() for n in loaded._tree.inorder()] == [1, 2]
+    assert loaded[1].value == ['b']
+
+
+@pytest.mark.parametrize('n', [0, 1, 2, 3, 7, 8, 100, 1023, 1024, 5000])
+def test_rbset_from_sorted_is_valid(n):
+    s = RBSet.from_sorted((k, [k, -k]) for k in range(n))
+    assert_valid(s._tree)
+    assert s._tree.size == n
+    assert [k for k, _ in s.items()] == list(range(n))
+    if n:
+        assert s[n - 1].value == [n - 1, 1 - n]
+
+    # the result is an ordinary tree that can be updated afterwards
+    for k in range(0, n, 2):
+        s.delete(k)
+    s.add(n, 'x')
+    assert_valid(s._tree)
+
+
+def test_rbset_from_sorted_merges_runs():
+    s = RBSet.from_sorted([(1, [10]), (1, [11]), (2, [12]), (3, [13]), (3, [14])])
+    assert list(s.items()) == [(1, [10, 11]), (2, [12]), (3, [13, 14])]
+    assert_valid(s._tree)
+
+
+def test_setitem_missing_key_inserts():
+    tree = RedBlackTree()
+    tree[5] = 'a'
+    tree[5] = 'b'
+    tree[3] = 'c'
+    assert tree[5] == 'b' and tree[3] == 'c'
+    assert tree.size == 2
+    assert TNULL.value is None
+    assert tree[4] is None
+    assert_valid(tree)
@@ -25,3 +25,31 @@ class Comparable(tp.Protocol):
     def __gt__(self, other): pass
 
     def __eq__(self, other): pass
+
+
+class IndexBackend(Serializable, tp.Protocol):
+    """Maps the values of one field to the offsets of records holding them."""
+
+    def __getitem__(self, key): pass
+
+    def add(self, key, value): pass
+
+    def remove(self, key, value=None): pass
+
+    def get(self, key): pass
+
+    def iter_range(self, low=None, high=None, low_inclusive=True, high_inclusive=True): pass
+
+    def load_sorted(self, items): pass
+
+    def stats(self) -> dict: pass
+
+    def save(self): pass
+
+    def close(self): pass
+
+
+class OperationHook(tp.Protocol):
+    """Called after each instrumented storage operation, see `Metrics`."""
+
+    def __call__(self, op: str, seconds: float, details: dict): pass
@@ -0,0 +1,445 @@
+import bisect
+import copy
+import json
+import lzma
+import os
+import re
+import threading
+import weakref
+import zlib
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Iterable
+
+from pysql.storagemanager.file_ops import FileOps, RecordReader, read_line_at, split_lines
+
+
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress),
+    'lzma': (lambda data: lzma.compress(data, preset=6), lzma.decompress),
+}
+
+
+class BlockCache:
+    """Small thread-safe LRU cache of decoded blocks, keyed by (generation, block number)."""
+
+    def __init__(self, capacity: int = 64):
+        self._capacity = capacity
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._blocks.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._blocks.move_to_end(key)
+            return data
+
+    def put(self, key, data: str):
+        if self._capacity <= 0:
+            return
+        with self._lock:
+            self._blocks[key] = data
+            self._blocks.move_to_end(key)
+            while len(self._blocks) > self._capacity:
+                self._blocks.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+
+
+class BlockSnapshot(RecordReader):
+    """
+    A generation of a BlockFileOps as it was when the snapshot was taken.
+
+    Keeps the generation's files open and pinned, so compaction leaves
+    them in place until the last snapshot of the generation is closed.
+    The tail file is truncated in place when it is sealed into a block;
+    the sealing writer first hands the tail's content to live snapshots,
+    so it never waits for them.
+    """
+
+    def __init__(self, ops: 'BlockFileOps'):
+        self._ops = ops
+        self.generation = ops._generation
+        self._blocks = list(ops._blocks)
+        self._starts = list(ops._starts)
+        self._tail_start = ops.tail_start
+        self._data_fd = os.open(ops._data_path, os.O_RDONLY)
+        self._tail_fd = os.open(ops._tail_path, os.O_RDONLY)
+        self.size = self._tail_start + os.fstat(self._tail_fd).st_size
+        self._decompress = ops._decompress
+        self._cache = ops._cache
+        self._tail = None
+        self._frozen_tail = None
+
+    def _freeze_tail(self, data: bytes):
+        if self._frozen_tail is None:
+            self._frozen_tail = data
+
+    def _tail_bytes(self) -> bytes:
+        if self._tail is None:
+            n = self.size - self._tail_start
+            data = os.pread(self._tail_fd, n, 0)
+            # checked after reading: if the tail was sealed meanwhile, what
+            # was read may be cut short or already hold newer records
+            frozen = self._frozen_tail
+            self._tail = data if frozen is None else frozen[:n]
+        return self._tail
+
+    def _read_block(self, block_no: int) -> str:
+        key = (self.generation, block_no)
+        data = self._cache.get(key)
+        if data is None:
+            _, file_pos, comp_len, _ = self._blocks[block_no]
+            data = self._decompress(os.pread(self._data_fd, comp_len, file_pos)).decode()
+            self._cache.put(key, data)
+        return data
+
+    def iter_lines(self):
+        for block_no, (start, _, _, _) in enumerate(self._blocks):
+            _, file_pos, comp_len, _ = self._blocks[block_no]
+            data = self._decompress(os.pread(self._data_fd, comp_len, file_pos))
+            yield from split_lines(data, start)
+        yield from split_lines(self._tail_bytes(), self._tail_start)
+
+    def read_lines_at(self, charno_list: Iterable[int]):
+        for char_no in charno_list:
+            if char_no >= self._tail_start:
+                tail = self._tail_bytes()
+                pos = char_no - self._tail_start
+                yield char_no, tail[pos:tail.index(b'\n', pos) + 1].decode()
+                continue
+
+            block_no = bisect.bisect_right(self._starts, char_no) - 1
+            data = self._read_block(block_no)
+            pos = char_no - self._starts[block_no]
+            yield char_no, data[pos:data.index('\n', pos) + 1]
+
+    def close(self):
+        if self._data_fd is not None:
+            os.close(self._data_fd)
+            os.close(self._tail_fd)
+            self._data_fd = self._tail_fd = None
+            self._ops._unpin(self.generation)
+
+    def __del__(self):
+        self.close()
+
+
+class BlockFileOps(FileOps):
+    """
+    Block-compressed storage file.
+
+    Records keep their logical (uncompressed) char offsets, so indexes and
+    the deletion index work exactly as with plain storage. Records are
+    appended to an uncompressed tail file; once the tail grows past
+    `block_size` chars it is compressed into a single block and appended
+    to the data file. The block index maps logical offsets to blocks, so
+    fetching a record only decompresses the block that holds it.
+
+    Files used, next to `path`:
+        <path>.blocks        - block index: codec, generation, tail base and
+                               [logical start, file pos, compressed length,
+                               raw length] per block
+        <path>.g<N>          - compressed blocks of generation N, back to back
+        <path>.g<N>.tail     - uncompressed records that don't fill a block yet
+
+    The block index is the only file that is ever replaced. Compaction
+    writes a new generation next to the current one and switches over by
+    replacing the block index, so a crash leaves either the old or the new
+    generation intact.
+    """
+    default_codec = 'zlib'
+    default_block_size = 64 * 1024
+
+    def __init__(self, path, codec: str = None, block_size: int = None, cache_blocks: int = 64):
+        super().__init__(path)
+        self._blocks_path = Path(str(path) + '.blocks')
+        self._cache = BlockCache(cache_blocks)
+
+        self.codec = codec or self.default_codec
+        self.block_size = block_size or self.default_block_size
+        self._generation = 0
+        self._staging = False
+        # logical offset of the first char in the tail file
+        self._tail_base = 0
+        self._blocks = []
+        self._starts = []
+
+        # generations read by open snapshots, and the files of those
+        # compaction replaced, to be removed when their last snapshot closes
+        self._pin_lock = threading.Lock()
+        self._pins = Counter()
+        self._retired = {}
+        self._snapshots = weakref.WeakSet()
+
+        self._init_files()
+        if codec is not None and codec != self.codec:
+            raise ValueError(f'{path} is compressed with {self.codec}, not {codec}')
+        self._compress, self._decompress = CODECS[self.codec]
+
+    @classmethod
+    def exists(cls, path) -> bool:
+        return os.path.exists(str(path) + '.blocks')
+
+    @property
+    def _data_path(self) -> Path:
+        return Path(f'{self._path}.g{self._generation}')
+
+    @property
+    def _tail_path(self) -> Path:
+        return Path(f'{self._path}.g{self._generation}.tail')
+
+    def _init_files(self):
+        if os.path.exists(self._blocks_path):
+            with open(self._blocks_path) as f:
+                meta = json.loads(f.read())
+            self.codec = meta['codec']
+            self.block_size = meta['block_size']
+            self._generation = meta['generation']
+            self._tail_base = meta['tail_base']
+            self._blocks = meta['blocks']
+            self._starts = [b[0] for b in self._blocks]
+        else:
+            if os.path.exists(self._path) and os.path.getsize(self._path):
+                raise ValueError(f'{self._path} is not a block-compressed storage file')
+            if self.codec not in CODECS:
+                raise ValueError(f'Unknown codec: {self.codec}')
+            self._save_block_index()
+
+        for f_name in (self._data_path, self._tail_path):
+            f_name.touch(exist_ok=True)
+        self._reconcile_tail()
+        self._remove_stale_generations()
+
+    def _reconcile_tail(self):
+        # a crash between saving the block index and truncating the tail
+        # leaves the already sealed records at the head of the tail file
+        sealed = self.tail_start - self._tail_base
+        if sealed <= 0:
+            return
+
+        with open(self._tail_path) as f:
+            f.seek(sealed)
+            rest = f.read()
+        with open(self._tail_path, 'w') as f:
+            f.write(rest)
+        self._tail_base = self.tail_start
+        self._save_block_index()
+
+    def _remove_stale_generations(self):
+        current = {self._data_path.name, self._tail_path.name}
+        directory = self._blocks_path.parent
+        generation_file = re.compile(re.escape(Path(self._path).name) + r'\.g\d+(\.tail)?$')
+        for f_name in directory.iterdir():
+            if generation_file.match(f_name.name) and f_name.name not in current:
+                f_name.unlink(missing_ok=True)
+
+    def _next_generation(self) -> 'BlockFileOps':
+        """Empty copy writing the next generation's files; it never saves the block index."""
+        new_ops = copy.copy(self)
+        new_ops._staging = True
+        new_ops._cache = BlockCache(0)
+        new_ops._generation = self._generation + 1
+        new_ops._tail_base = 0
+        new_ops._blocks = []
+        new_ops._starts = []
+        for f_name in (new_ops._data_path, new_ops._tail_path):
+            with open(f_name, 'w'):
+                pass
+        return new_ops
+
+    def _save_block_index(self):
+        if self._staging:
+            return
+
+        meta = {
+            'codec': self.codec,
+            'block_size': self.block_size,
+            'generation': self._generation,
+            'tail_base': self._tail_base,
+            'blocks': self._blocks,
+        }
+        tmp_path = Path(str(self._blocks_path) + '.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(meta))
+        os.replace(tmp_path, self._blocks_path)
+
+    @property
+    def tail_start(self) -> int:
+        if not self._blocks:
+            return 0
+        start, _, _, raw_len = self._blocks[-1]
+        return start + raw_len
+
+    @property
+    def size(self) -> int:
+        return self.tail_start + os.stat(self._tail_path).st_size
+
+    @property
+    def compressed_size(self) -> int:
+        return os.stat(self._data_path).st_size + os.stat(self._tail_path).st_size
+
+    @property
+    def cache(self) -> BlockCache:
+        return self._cache
+
+    def append(self, line: str) -> int:
+        return self.append_many([line])[0]
+
+    def append_many(self, lines: Iterable[str]):
+        offsets = []
+        batch = []
+        tail_size = os.stat(self._tail_path).st_size
+
+        for line in lines:
+            offsets.append(self.tail_start + tail_size)
+            batch.append(line)
+            tail_size += len(line)
+
+            if tail_size >= self.block_size:
+                self._write_tail(batch)
+                self._seal_tail()
+                batch = []
+                tail_size = 0
+
+        if batch:
+            self._write_tail(batch)
+        return offsets
+
+    def _write_tail(self, lines):
+        with open(self._tail_path, 'a') as f:
+            f.writelines(lines)
+
+    def _seal_tail(self):
+        """Compress the tail into a new block and start an empty tail."""
+        with open(self._tail_path) as f:
+            raw = f.read()
+        if not raw:
+            return
+
+        compressed = self._compress(raw.encode())
+        with open(self._data_path, 'ab') as f:
+            file_pos = f.tell()
+            f.write(compressed)
+
+        # the index still records the old tail base, so if we crash before
+        # the tail is truncated, opening the store drops the sealed prefix
+        start = self.tail_start
+        self._blocks.append([start, file_pos, len(compressed), len(raw)])
+        self._starts.append(start)
+        self._save_block_index()
+
+        raw_bytes = raw.encode()
+        for snapshot in list(self._snapshots):
+            if snapshot.generation == self._generation:
+                snapshot._freeze_tail(raw_bytes)
+        with open(self._tail_path, 'w'):
+            pass
+        self._tail_base = self.tail_start
+        self._save_block_index()
+
+    def snapshot(self) -> BlockSnapshot:
+        with self._pin_lock:
+            snapshot = BlockSnapshot(self)
+            self._pins[snapshot.generation] += 1
+            self._snapshots.add(snapshot)
+        return snapshot
+
+    def _unpin(self, generation: int):
+        with self._pin_lock:
+            self._pins[generation] -= 1
+            if self._pins[generation] > 0:
+                return
+            del self._pins[generation]
+            retired = self._retired.pop(generation, ())
+        for f_name in retired:
+            f_name.unlink(missing_ok=True)
+
+    def _retire(self, generation: int, files):
+        with self._pin_lock:
+            if self._pins[generation] > 0:
+                self._retired[generation] = files
+                return
+        for f_name in files:
+            f_name.unlink(missing_ok=True)
+
+    def _read_block(self, f, block_no: int) -> str:
+        _, file_pos, comp_len, _ = self._blocks[block_no]
+        f.seek(file_pos)
+        return self._decompress(f.read(comp_len)).decode()
+
+    def _cached_block(self, f, block_no: int) -> str:
+        key = (self._generation, block_no)
+        data = self._cache.get(key)
+        if data is None:
+            data = self._read_block(f, block_no)
+            self._cache.put(key, data)
+        return data
+
+    def iter_lines(self):
+        # sequential scans read every block exactly once, so they bypass
+        # the cache instead of flushing hot blocks out of it
+        with open(self._data_path, 'rb') as f:
+            for block_no, (start, _, _, _) in enumerate(self._blocks):
+                data = self._read_block(f, block_no)
+                pos = 0
+                while pos < len(data):
+                    end = data.index('\n', pos) + 1
+                    yield start + pos, data[pos:end]
+                    pos = end
+
+        tail_start = self.tail_start
+        with open(self._tail_path) as f:
+            char_no = tail_start
+            for line in f:
+                yield char_no, line
+                char_no += len(line)
+
+    def read_lines_at(self, charno_list: Iterable[int]):
+        tail_start = self.tail_start
+        with open(self._data_path, 'rb') as f, open(self._tail_path) as tail:
+            for char_no in charno_list:
+                if char_no >= tail_start:
+                    tail.seek(char_no - tail_start)
+                    yield char_no, tail.readline()
+                    continue
+
+                block_no = bisect.bisect_right(self._starts, char_no) - 1
+                data = self._cached_block(f, block_no)
+                pos = char_no - self._starts[block_no]
+                yield char_no, data[pos:data.index('\n', pos) + 1]
+
+    def compact(self, deleted: Iterable[int]):
+        deleted = set(deleted)
+        old_generation = self._generation
+        old_files = (self._data_path, self._tail_path)
+
+        new_ops = self._next_generation()
+
+        batch = []
+        for char_no, line in self.iter_lines():
+            if char_no in deleted:
+                continue
+            batch.append(line)
+            if len(batch) >= 1024:
+                new_ops.append_many(batch)
+                batch = []
+        new_ops.append_many(batch)
+
+        # switching the block index is the single commit point
+        self._generation = new_ops._generation
+        self._tail_base = new_ops._tail_base
+        self._blocks = new_ops._blocks
+        self._starts = new_ops._starts
+        self._save_block_index()
+        self._cache.clear()
+
+        self._retire(old_generation, old_files)
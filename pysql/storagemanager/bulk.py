@@ -0,0 +1,160 @@
+"""
+Bulk NDJSON import and export.
+
+Import appends records in large chunks without touching the indexes,
+collects their postings and sorts them externally, then bulk-builds every
+index once. Export streams the live records of a snapshot as stored.
+"""
+import heapq
+import json
+import logging
+import os
+import tempfile
+import typing as tp
+import uuid
+from operator import itemgetter
+
+from pysql.storagemanager.cfg import ID_FIELD_NAME
+from pysql.storagemanager.data_index import flatten
+from pysql.storagemanager.storage import StorageManager
+
+logger = logging.getLogger(__name__)
+
+Posting = tp.Tuple[str, tp.Any, int]
+
+
+class ExternalSorter:
+    """
+    Sorts (field, value, offset) postings by field and value in bounded
+    memory: at most `buffer_size` postings are held, full buffers are
+    sorted and spilled as runs to `directory`, and the runs are merged
+    lazily. Postings with equal field and value keep their input order.
+    """
+
+    def __init__(self, directory, buffer_size: int = 1_000_000):
+        self._directory = directory
+        self._buffer_size = buffer_size
+        self._buffer: tp.List[Posting] = []
+        self._runs: tp.List[str] = []
+
+    @property
+    def runs(self) -> int:
+        return len(self._runs)
+
+    def add(self, field_name: str, value, offset: int):
+        self._buffer.append((field_name, value, offset))
+        if len(self._buffer) >= self._buffer_size:
+            self._spill()
+
+    def _spill(self):
+        self._buffer.sort(key=_posting_key)
+        fd, path = tempfile.mkstemp(prefix='postings-', suffix='.run', dir=self._directory)
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(json.dumps(posting) + '\n' for posting in self._buffer)
+        self._runs.append(path)
+        self._buffer = []
+
+    @staticmethod
+    def _read_run(path: str):
+        with open(path) as f:
+            for line in f:
+                yield tuple(json.loads(line))
+
+    def sorted(self) -> tp.Iterator[Posting]:
+        self._buffer.sort(key=_posting_key)
+        if not self._runs:
+            return iter(self._buffer)
+        # heapq.merge is stable across its inputs, runs are in input order
+        runs = [self._read_run(path) for path in self._runs]
+        return heapq.merge(*runs, iter(self._buffer), key=_posting_key)
+
+    def close(self):
+        for path in self._runs:
+            os.remove(path)
+        self._runs = []
+        self._buffer = []
+
+
+_posting_key = itemgetter(0, 1)
+
+
+def bulk_import(storage: StorageManager, lines: tp.Iterable[str], chunk_records: int = 10_000,
+                sort_buffer: int = 1_000_000) -> int:
+    """
+    Append NDJSON records and rebuild the indexes once at the end; returns
+    the number of records. Records keep an `_id` they already have.
+
+    The storage lock is only held while a chunk is appended and while the
+    indexes are rebuilt, so other readers and writers carry on meanwhile.
+    Until the rebuild, imported records are seen by scans but not by index
+    lookups. If the import is interrupted, records written so far are not
+    indexed until the next vacuum.
+    """
+    imported = 0
+    with tempfile.TemporaryDirectory(dir=storage._storage_dir) as tmp:
+        sorter = ExternalSorter(tmp, buffer_size=sort_buffer)
+        with storage._lock:
+            version = storage._version
+
+        def write(objects, encoded):
+            with storage._lock:
+                offsets = storage.storage_file_ops.append_many(encoded)
+            for obj, offset in zip(objects, offsets):
+                for field_name, value in flatten(obj):
+                    sorter.add(field_name, value, offset)
+
+        objects, encoded = [], []
+        for line_no, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            obj = json.loads(line)
+            if not isinstance(obj, dict):
+                raise ValueError(f'Line {line_no}: expected a JSON object, got {type(obj).__name__}')
+            obj.setdefault(ID_FIELD_NAME, str(uuid.uuid4()))
+            objects.append(obj)
+            encoded.append(json.dumps(obj) + '\n')
+
+            if len(objects) >= chunk_records:
+                write(objects, encoded)
+                imported += len(objects)
+                objects, encoded = [], []
+        write(objects, encoded)
+        imported += len(objects)
+
+        with storage._lock:
+            if storage._version != version:
+                sorter.close()
+                # offsets taken before the vacuum point into the old file
+                logger.info('Storage was vacuumed during the import, reindexing it')
+                storage._index.rebuild(storage.storage_file_ops.all_records(include_charno=True))
+                return imported
+
+            # indexes are rebuilt whole, so their current postings go in too,
+            # including those of records created during the import
+            for field_name in storage._index.fields():
+                for value, postings in storage._index[field_name].iter_range():
+                    for offset in postings:
+                        sorter.add(field_name, value, offset)
+
+            logger.info(f'Building indexes of {imported} imported records from {sorter.runs} sorted runs')
+            try:
+                storage._index.bulk_load(sorter.sorted())
+            finally:
+                sorter.close()
+    return imported
+
+
+def export(storage: StorageManager, out: tp.TextIO, chunk_records: int = 10_000) -> int:
+    """Write live records to `out` as NDJSON in storage order; returns their number."""
+    exported = 0
+    with storage.snapshot() as snapshot:
+        chunk = []
+        for line in snapshot.iter_lines():
+            chunk.append(line)
+            if len(chunk) >= chunk_records:
+                out.writelines(chunk)
+                exported += len(chunk)
+                chunk = []
+        out.writelines(chunk)
+        exported += len(chunk)
+    return exported
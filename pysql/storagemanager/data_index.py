@@ -1,96 +1,465 @@
+import hashlib
 import json
 import logging
 import typing as tp
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
 import os
+import uuid
 
+from pysql.datastructures import postings as postings_list
+from pysql.datastructures.bplustree import BPlusTree
+from pysql.datastructures.postings import SpilledPostings
 from pysql.datastructures.rb_set import RBSet
-from pysql.interfaces import Serializable, Saveable
+from pysql.interfaces import IndexBackend, Saveable
 from pysql.storagemanager import cfg
 
 logger = logging.getLogger(__name__)
 
 
-class Index(Serializable):
+class Index(IndexBackend):
+    """
+    In-memory index backed by a red-black tree.
+
+    Posting lists are sorted `array('q')`s; `spill` moves large ones to
+    memory-mapped files, and changing a spilled list loads it back.
+    Lists returned by `get` and `iter_range` must not be modified.
+    """
+    backend_name = 'rbtree'
 
     def __init__(self, rb_set: RBSet = None):
-        self._rb_set = rb_set or RBSet()
+        self._rb_set = rb_set if rb_set is not None else RBSet()
+        self._count_postings()
+
+    def _count_postings(self):
+        self._postings = 0
+        # bytes of the posting lists held in memory, spilled ones aside
+        self._resident_bytes = 0
+        for _, postings in self._rb_set.items():
+            self._postings += len(postings)
+            if not isinstance(postings, SpilledPostings):
+                self._resident_bytes += len(postings) * postings_list.ITEMSIZE
 
     @classmethod
-    def deserialize(cls, data: tp.Dict[int, tp.List]):
-        source = list(data.values())
-        return cls(RBSet.load(source))
-
-    def serialize(self) -> tp.Dict[int, tp.List]:
-        # we can't represent an array of arrays in JSON just like that.
-        # So instead, we need to find a way how to represent our object
-        # in json. One way to do that is to represent array as an object
-        # where array indexes are keys and values are corresponding
-        # object values
-        data = self._rb_set.dump()
-        keys = range(len(data))
-        return dict(zip(keys, data))
+    def deserialize(cls, data: tp.Union[tp.List[tp.List], tp.Dict[int, tp.List]]):
+        if isinstance(data, dict):
+            # older format: breadth-first tree dump keyed by position
+            source = list(data.values())
+            rb_set = RBSet.load(source)
+            if rb_set is None:
+                # the dump of an empty tree
+                return cls()
+            return cls.from_sorted(rb_set.items())
+        return cls.from_sorted(data)
+
+    @classmethod
+    def from_sorted(cls, items: tp.Iterable[tp.Tuple[tp.Any, tp.List]]):
+        return cls(RBSet.from_sorted(items, postings=postings_list.make))
+
+    def serialize(self) -> tp.List[tp.List]:
+        # sorted [key, postings] pairs, so loading is a linear bulk build
+        return [[key, list(postings)] for key, postings in self._rb_set.items()]
 
     def __getitem__(self, item):
         node = self._rb_set[item]
         return node.value
 
+    def get(self, key):
+        return self[key]
+
+    @property
+    def resident_bytes(self) -> int:
+        return self._resident_bytes
+
+    def _writable(self, node):
+        """Posting list of `node` in memory, to be changed"""
+        if isinstance(node.value, SpilledPostings):
+            node.value = node.value.load()
+            self._resident_bytes += len(node.value) * postings_list.ITEMSIZE
+        return node.value
+
+    def add(self, key, value):
+        node = self._rb_set[key]
+        if node.is_null():
+            self._rb_set[key] = postings_list.make((value,))
+        else:
+            postings_list.insert(self._writable(node), value)
+        self._postings += 1
+        self._resident_bytes += postings_list.ITEMSIZE
+
+    def remove(self, key, value=None):
+        node = self._rb_set[key]
+        if node.is_null():
+            return
+        if value is None:
+            self._postings -= len(node.value)
+            if not isinstance(node.value, SpilledPostings):
+                self._resident_bytes -= len(node.value) * postings_list.ITEMSIZE
+            self._rb_set.delete(key)
+        elif postings_list.discard(self._writable(node), value):
+            self._postings -= 1
+            self._resident_bytes -= postings_list.ITEMSIZE
+            if not node.value:
+                self._rb_set.delete(key)
+
+    def iter_range(self, low=None, high=None, low_inclusive=True, high_inclusive=True):
+        return self._rb_set.iter_range(low, high, low_inclusive, high_inclusive)
+
+    def load_sorted(self, items):
+        self._rb_set = RBSet.from_sorted(items, postings=postings_list.make)
+        self._count_postings()
+
+    def spillable(self, min_bytes: int) -> tp.Iterator[tp.Tuple[int, tp.Any]]:
+        """(bytes, node) of the posting lists in memory taking at least `min_bytes`"""
+        for node in self._rb_set.nodes():
+            if isinstance(node.value, SpilledPostings):
+                continue
+            size = len(node.value) * postings_list.ITEMSIZE
+            if size >= min_bytes:
+                yield size, node
+
+    def spill(self, node, path: Path):
+        """Move the posting list of `node`, from `spillable`, to a file at `path`"""
+        self._resident_bytes -= len(node.value) * postings_list.ITEMSIZE
+        node.value = SpilledPostings.write(node.value, path)
+
+    def stats(self) -> dict:
+        return {
+            'backend': self.backend_name,
+            'keys': len(self._rb_set),
+            'postings': self._postings,
+            'resident_bytes': self._resident_bytes,
+        }
+
+    def save(self):
+        # in-memory trees are written out by `Indexes.save` as part of its file
+        pass
+
+    def close(self):
+        pass
+
+
+class BPlusTreeIndex(IndexBackend):
+    """
+    Index kept in a file-backed B+tree; only hot pages stay in memory.
+
+    Each index lives in its own file, `Indexes` only records where it is.
+    """
+    backend_name = 'bptree'
+
+    def __init__(self, path: tp.Union[str, Path], cache_pages: int = 256):
+        self._path = Path(path)
+        self._tree = BPlusTree(self._path, cache_pages=cache_pages)
+
+    @classmethod
+    def deserialize(cls, data: dict, directory: tp.Union[str, Path] = '.', cache_pages: int = 256):
+        return cls(Path(directory) / data['file'], cache_pages=cache_pages)
+
+    def serialize(self) -> dict:
+        self.save()
+        return {'backend': self.backend_name, 'file': self._path.name}
+
+    def __getitem__(self, item):
+        return self._tree.get(item)
+
+    def get(self, key):
+        return self._tree.get(key)
+
     def add(self, key, value):
-        self._rb_set[key] = value
+        self._tree.insert(key, value)
+
+    def remove(self, key, value=None):
+        self._tree.remove(key, value)
+
+    def iter_range(self, low=None, high=None, low_inclusive=True, high_inclusive=True):
+        return self._tree.iter_range(low, high, low_inclusive, high_inclusive)
+
+    def load_sorted(self, items):
+        self._tree.bulk_load(items)
+
+    def stats(self) -> dict:
+        return {'backend': self.backend_name, **self._tree.stats()}
+
+    def save(self):
+        self._tree.flush()
+
+    def close(self):
+        self._tree.close()
+
+
+class _IndexMap(OrderedDict):
+    """Opens the index of a field on first use. Ordered by last use."""
 
-    def remove(self, key):
-        self._rb_set.delete(key)
+    def __init__(self, factory: tp.Callable[[str], IndexBackend]):
+        super().__init__()
+        self._factory = factory
+
+    def __missing__(self, field_name):
+        index = self[field_name] = self._factory(field_name)
+        return index
 
 
 class Indexes(Saveable):
-    _file_mode_load = 'r'
-    _file_mode_save = 'w'
+    """
+    Indexes of every field, one file per field plus a small manifest.
+
+    Opening only reads the manifest; a field's index is loaded the first
+    time it is used. In-memory indexes that have not been used for a while
+    are dropped again once the ones loaded hold more than `resident_budget`
+    keys and postings in total; on-disk indexes bound their memory with
+    their own page cache.
+
+    With a `postings_budget`, the largest posting lists of in-memory
+    indexes are spilled to memory-mapped files under `spill/` whenever
+    the lists in memory take more bytes than that.
+    """
+    manifest_name = 'manifest.json'
+    spill_dir_name = 'spill'
+    # lists smaller than this stay in memory, spilling them saves little
+    min_spill_bytes = 64 * 1024
+    # spill down to this share of the budget, so it isn't hit on every save
+    spill_target = 0.75
 
-    def __init__(self, file_path: tp.Union[str, Path]):
-        self._index_map = defaultdict(Index)
-        self._path = file_path
+    def __init__(self, dir_path: tp.Union[str, Path], backends: tp.Dict[str, str] = None,
+                 cache_pages: int = 256, resident_budget: int = None,
+                 legacy_file: tp.Union[str, Path] = None, postings_budget: int = None):
+        """
+        :param backends: index backend per field name, 'rbtree' (in memory,
+            the default) or 'bptree' (on disk)
+        :param cache_pages: page cache size of each on-disk index
+        :param resident_budget: number of keys plus postings loaded
+            in-memory indexes may hold before unused ones are evicted.
+            Unbounded by default.
+        :param legacy_file: single-file index written by older versions;
+            it is converted to the per-field layout and removed
+        :param postings_budget: bytes the posting lists of in-memory
+            indexes may take before the largest are spilled to files.
+            Unbounded by default.
+        """
+        self._path = Path(dir_path)
+        self._backends = dict(backends or {})
+        self._cache_pages = cache_pages
+        self._resident_budget = resident_budget
+        self._postings_budget = postings_budget
+        self._spill_dir = self._path / self.spill_dir_name
+        self._manifest = {}
+        self._dirty = set()
+        self._index_map = _IndexMap(self._open_index)
 
         self.init_file_if_not_exists()
+        self._clear_spill_dir()
         self.load()
+        if legacy_file is not None and os.path.exists(legacy_file):
+            self._migrate(Path(legacy_file))
 
     def __getitem__(self, item):
-        return self._index_map[item]
+        index = self._index_map[item]
+        self._index_map.move_to_end(item)
+        return index
+
+    def __contains__(self, item):
+        return item in self._index_map or item in self._manifest
+
+    def fields(self) -> tp.List[str]:
+        return sorted(set(self._manifest) | set(self._index_map))
+
+    def is_loaded(self, field_name: str) -> bool:
+        return field_name in self._index_map
+
+    def _backend_name(self, field_name: str) -> str:
+        if field_name in self._manifest:
+            return self._manifest[field_name]['backend']
+        return self._backends.get(field_name, Index.backend_name)
+
+    def _index_file(self, field_name: str, backend_name: str) -> Path:
+        # field names can hold anything, so files are named by a digest
+        digest = hashlib.sha1(field_name.encode()).hexdigest()[:16]
+        extension = 'bpt' if backend_name == BPlusTreeIndex.backend_name else 'json'
+        return self._path / f'{digest}.{extension}'
+
+    def _new_index(self, field_name: str) -> IndexBackend:
+        backend = self._backend_name(field_name)
+        if backend == BPlusTreeIndex.backend_name:
+            return BPlusTreeIndex(self._index_file(field_name, backend), cache_pages=self._cache_pages)
+        if backend == Index.backend_name:
+            return Index()
+        raise ValueError(f'Unknown index backend: {backend}')
+
+    def _open_index(self, field_name: str) -> IndexBackend:
+        entry = self._manifest.get(field_name)
+        if entry is None:
+            return self._new_index(field_name)
+
+        logger.debug(f'Loading index of field {field_name!r}')
+        if entry['backend'] == BPlusTreeIndex.backend_name:
+            index = BPlusTreeIndex.deserialize(entry, directory=self._path, cache_pages=self._cache_pages)
+        else:
+            with open(self._path / entry['file']) as f:
+                index = Index.deserialize(json.loads(f.read()))
+        # the new index is only counted after it is stored, so it can't evict itself
+        self._evict(keep=field_name, extra=index.stats())
+        self._spill_postings(extra=index)
+        return index
+
+    def _weight(self, stats: dict) -> int:
+        return stats['keys'] + stats['postings']
+
+    def _evict(self, keep: str = None, extra: dict = None):
+        """Drop least recently used in-memory indexes until within budget."""
+        if self._resident_budget is None:
+            return
+
+        resident = [
+            (field_name, index) for field_name, index in self._index_map.items()
+            if isinstance(index, Index)
+        ]
+        total = sum(self._weight(index.stats()) for _, index in resident)
+        if extra is not None:
+            total += self._weight(extra)
+
+        for field_name, index in resident:
+            if total <= self._resident_budget:
+                break
+            if field_name == keep:
+                continue
+            if field_name in self._dirty:
+                self._save_field(field_name, index)
+            del self._index_map[field_name]
+            total -= self._weight(index.stats())
+            logger.debug(f'Evicted index of field {field_name!r}')
+
+    def _clear_spill_dir(self):
+        # spilled lists only live as long as the process that wrote them
+        if self._spill_dir.exists():
+            for path in self._spill_dir.iterdir():
+                path.unlink()
+
+    def _spill_postings(self, extra: IndexBackend = None):
+        """Spill the largest posting lists until within the postings budget."""
+        if self._postings_budget is None:
+            return
+
+        resident = [index for index in [*self._index_map.values(), extra] if isinstance(index, Index)]
+        total = sum(index.resident_bytes for index in resident)
+        if total <= self._postings_budget:
+            return
+
+        candidates = [
+            (size, index, node)
+            for index in resident
+            for size, node in index.spillable(self.min_spill_bytes)
+        ]
+        candidates.sort(key=itemgetter(0), reverse=True)
+        self._spill_dir.mkdir(exist_ok=True)
+        target = self._postings_budget * self.spill_target
+        for size, index, node in candidates:
+            if total <= target:
+                break
+            index.spill(node, self._spill_dir / f'{uuid.uuid4().hex}.postings')
+            total -= size
+        logger.debug(f'Posting lists in memory after spilling: {total} bytes')
+
+    def stats(self) -> tp.Dict[str, dict]:
+        stats = {}
+        for field_name in self.fields():
+            if field_name in self._index_map:
+                stats[field_name] = {**self._index_map[field_name].stats(), 'resident': True}
+            else:
+                entry = self._manifest[field_name]
+                stats[field_name] = {
+                    'backend': entry['backend'],
+                    'keys': entry['keys'],
+                    'postings': entry['postings'],
+                    'resident': False,
+                }
+        return stats
+
+    def close(self):
+        for index in self._index_map.values():
+            index.close()
 
     def init_file_if_not_exists(self):
-        exists = os.path.exists(self._path)
-        if not exists:
-            dir_path, file_name = os.path.split(self._path)
-            os.makedirs(dir_path, exist_ok=True)
-            with open(self._path, 'w'):
-                pass
+        if not os.path.exists(self._path / self.manifest_name):
+            os.makedirs(self._path, exist_ok=True)
+            self._write_manifest()
             logger.info(f'Indexes path does not exist. Creating path: {self._path}')
 
+    def _write_manifest(self):
+        _write_atomic(self._path / self.manifest_name, json.dumps({'fields': self._manifest}, indent=2))
+
     def load(self):
-        with open(self._path, self._file_mode_load) as f:
+        """Read the manifest. Indexes themselves are loaded on first use."""
+        self.close()
+        with open(self._path / self.manifest_name) as f:
+            self._manifest = json.loads(f.read())['fields']
+        self._index_map = _IndexMap(self._open_index)
+        self._dirty = set()
+
+    def load_all(self):
+        for field_name in self.fields():
+            self[field_name]
+
+    def _migrate(self, legacy_file: Path):
+        logger.info(f'Converting {legacy_file} to per-field index files in {self._path}')
+        with open(legacy_file) as f:
             indexes_data = json.loads(f.read() or '{}')
-            self._index_map = defaultdict(Index)
 
-            for index_name, index_data in indexes_data.items():
-                idx = Index.deserialize(index_data)
-                self._index_map[index_name] = idx
+        for index_name, index_data in indexes_data.items():
+            if isinstance(index_data, dict) and 'backend' in index_data:
+                target = self._index_file(index_name, index_data['backend'])
+                os.replace(legacy_file.parent / index_data['file'], target)
+                self._backends[index_name] = index_data['backend']
+                index = BPlusTreeIndex(target, cache_pages=self._cache_pages)
+            else:
+                index = Index.deserialize(index_data)
+            self._index_map[index_name] = index
+            self._dirty.add(index_name)
 
-    def save(self):
+        self.save()
+        os.remove(legacy_file)
+
+    def _save_field(self, field_name: str, index: IndexBackend):
+        backend = index.backend_name
+        path = self._index_file(field_name, backend)
+        if backend == BPlusTreeIndex.backend_name:
+            entry = index.serialize()
+        else:
+            _write_atomic(path, json.dumps(index.serialize()))
+            entry = {'backend': backend, 'file': path.name}
 
-        def default(o: Index):
-            if not isinstance(o, Index):
-                raise TypeError()
-            return o.serialize()
+        stats = index.stats()
+        entry.update(keys=stats['keys'], postings=stats['postings'])
+        self._manifest[field_name] = entry
+        self._dirty.discard(field_name)
 
-        with open(self._path, self._file_mode_save) as f:
-            f.write(json.dumps(self._index_map, default=default, indent=2))
+    def save(self):
+        """Write the indexes changed since the last save, then the manifest."""
+        if not self._dirty:
+            return
+        for field_name in list(self._dirty):
+            self._save_field(field_name, self._index_map[field_name])
+        self._write_manifest()
+        self._evict()
+        self._spill_postings()
 
     def reset(self):
-        self._index_map = defaultdict(Index)
-        self.save()
+        for field_name in self.fields():
+            self._drop_field(field_name)
+        self._write_manifest()
+
+    def _drop_field(self, field_name: str):
+        index = self._index_map.pop(field_name, None)
+        if index is not None:
+            index.close()
+        entry = self._manifest.pop(field_name, None)
+        if entry is not None:
+            (self._path / entry['file']).unlink(missing_ok=True)
+        self._dirty.discard(field_name)
 
     def _index_record(self, data: dict, new_data_start: int, save: bool = True):
-        for field_name, field_value in data.items():
+        for field_name, field_value in flatten(data):
             self._index_record_field(field_name, field_value, new_data_start)
         if save:
             self.save()
@@ -100,12 +469,63 @@ class Indexes(Saveable):
 
     def rebuild(self, data_generator: tp.Generator[dict, tp.Any, tp.Any]):
         logger.info('Reindexing data.')
-        self.reset()
+        postings = defaultdict(list)
 
         for obj in data_generator:
-            data_start = obj[cfg.CHAR_NUM_FIELD_NAME]
-            self._index_record(obj, data_start, save=False)
+            data_start = obj.pop(cfg.CHAR_NUM_FIELD_NAME)
+            for field_name, field_value in flatten(obj):
+                postings[field_name].append((field_value, data_start))
+
+        for field_name in self.fields():
+            if field_name not in postings:
+                self._drop_field(field_name)
+
+        for field_name, field_postings in postings.items():
+            # values need not be hashable, only comparable, so sort pairs
+            # and let the bulk build merge runs of equal keys
+            field_postings.sort(key=itemgetter(0))
+            self._load_field(field_name, field_postings)
         self.save()
 
+    def bulk_load(self, postings: tp.Iterable[tp.Tuple[str, tp.Any, int]]):
+        """
+        Rebuild the indexes of the fields in `postings`, (field, value,
+        offset) triples sorted by field and value. Each field is saved as
+        soon as it is built, so with a resident budget only a few indexes
+        are in memory at a time.
+        """
+        for field_name, field_postings in groupby(postings, key=itemgetter(0)):
+            self._load_field(field_name, ((value, data_start) for _, value, data_start in field_postings))
+            self.save()
+
+    def _load_field(self, field_name: str, pairs: tp.Iterable[tp.Tuple[tp.Any, int]]):
+        index = self._index_map.pop(field_name, None)
+        if index is None:
+            index = self._new_index(field_name)
+        index.load_sorted((value, [data_start]) for value, data_start in pairs)
+        self._index_map[field_name] = index
+        self._dirty.add(field_name)
+
     def _index_record_field(self, field_name, field_value, row_idx):
-        self._index_map[field_name].add(field_value, row_idx)
+        self[field_name].add(field_value, row_idx)
+        self._dirty.add(field_name)
+
+
+def flatten(data: dict, prefix: str = ''):
+    """
+    (field, value) pairs to index. Nested objects are indexed per field
+    under dotted names, e.g. {'a': {'b': 1}} as ('a.b', 1), since objects
+    themselves can't be ordered.
+    """
+    for field_name, field_value in data.items():
+        if isinstance(field_value, dict):
+            yield from flatten(field_value, f'{prefix}{field_name}.')
+        else:
+            yield f'{prefix}{field_name}', field_value
+
+
+def _write_atomic(path: Path, data: str):
+    tmp_path = Path(str(path) + '.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import typing as tp
+from pathlib import Path
+
+from pysql.conf import DEFAULT_STORAGE_DIR
+from pysql.storagemanager.storage import StorageManager
+
+logger = logging.getLogger(__name__)
+
+_NAME = re.compile(r'^[A-Za-z0-9_][A-Za-z0-9_.-]{0,127}$')
+
+# StorageManager options a collection remembers between openings
+_STORED_OPTIONS = (
+    'compression', 'block_size', 'block_cache_size', 'index_backends',
+    'index_cache_pages', 'index_resident_budget', 'index_postings_budget', 'plan_cache_size',
+)
+
+
+class Database:
+    """
+    Named collections, each a StorageManager in its own directory with its
+    own data, index and tombstone files, so queries and vacuum of one
+    collection never touch another.
+
+    Layout:
+        <storage_dir>/collections.json   - collection names, their options
+                                           and vacuum schedules
+        <storage_dir>/collections/<name> - files of one collection
+
+    A collection's vacuum schedule says when `run_vacuum_schedule` vacuums
+    it: once `vacuum_min_deleted` objects are deleted and at least
+    `vacuum_interval` seconds passed since its last vacuum, provided there
+    is something to vacuum at all. Collections without either setting are
+    only vacuumed explicitly.
+    """
+    manifest_name = 'collections.json'
+
+    def __init__(self, storage_dir=DEFAULT_STORAGE_DIR):
+        self._path = Path(storage_dir)
+        self._collections: tp.Dict[str, StorageManager] = {}
+
+        manifest_path = self._path / self.manifest_name
+        if manifest_path.exists():
+            with open(manifest_path) as f:
+                self._manifest = json.loads(f.read())['collections']
+        else:
+            os.makedirs(self._path, exist_ok=True)
+            self._manifest = {}
+            self._write_manifest()
+
+    def _write_manifest(self):
+        tmp_path = self._path / (self.manifest_name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({'collections': self._manifest}, indent=2))
+        os.replace(tmp_path, self._path / self.manifest_name)
+
+    def _collection_dir(self, name: str) -> Path:
+        return self._path / 'collections' / name
+
+    def collections(self) -> tp.List[str]:
+        return sorted(self._manifest)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._manifest
+
+    def __getitem__(self, name: str) -> StorageManager:
+        """An existing collection, opened on first use."""
+        if name not in self._manifest:
+            raise KeyError(f'No collection named {name!r}')
+        storage = self._collections.get(name)
+        if storage is None:
+            storage = StorageManager(self._collection_dir(name), **self._manifest[name]['options'])
+            self._collections[name] = storage
+        return storage
+
+    def collection(self, name: str, vacuum_min_deleted: int = None, vacuum_interval: float = None,
+                   **storage_options) -> StorageManager:
+        """
+        Open a collection, creating it on first use.
+
+        :param vacuum_min_deleted: vacuum on schedule once this many objects
+            are deleted
+        :param vacuum_interval: minimal number of seconds between scheduled
+            vacuums
+        :param storage_options: StorageManager options of a new collection.
+            An existing collection keeps the options it was created with,
+            passing different ones raises ValueError.
+        """
+        if name in self._manifest:
+            stored = self._manifest[name]['options']
+            conflicting = sorted(
+                option for option, value in storage_options.items() if stored.get(option) != value
+            )
+            if conflicting:
+                raise ValueError(
+                    f'Collection {name!r} exists with other options: '
+                    + ', '.join(f'{option}={stored.get(option)!r}' for option in conflicting)
+                )
+            if vacuum_min_deleted is not None or vacuum_interval is not None:
+                self.set_vacuum_schedule(name, vacuum_min_deleted, vacuum_interval)
+            return self[name]
+
+        if not _NAME.match(name):
+            raise ValueError(f'Invalid collection name: {name!r}')
+        unknown = set(storage_options) - set(_STORED_OPTIONS)
+        if unknown:
+            raise TypeError(f'Unknown storage options: {", ".join(sorted(unknown))}')
+
+        os.makedirs(self._collection_dir(name), exist_ok=True)
+        self._manifest[name] = {
+            'options': storage_options,
+            'vacuum': {'min_deleted': vacuum_min_deleted, 'interval': vacuum_interval},
+            'last_vacuum': time.time(),
+        }
+        self._write_manifest()
+        logger.info(f'Created collection {name!r}')
+        return self[name]
+
+    def set_vacuum_schedule(self, name: str, min_deleted: int = None, interval: float = None):
+        self[name]
+        self._manifest[name]['vacuum'] = {'min_deleted': min_deleted, 'interval': interval}
+        self._write_manifest()
+
+    def drop_collection(self, name: str):
+        # files are closed first, some platforms can't remove open files;
+        # if removing fails the collection stays listed and can be dropped again
+        self[name].close()
+        self._collections.pop(name)
+        shutil.rmtree(self._collection_dir(name))
+        del self._manifest[name]
+        self._write_manifest()
+
+    def vacuum(self, name: str):
+        self[name].vacuum()
+        self._manifest[name]['last_vacuum'] = time.time()
+        self._write_manifest()
+
+    def vacuum_due(self, now: float = None) -> tp.List[str]:
+        """Collections whose vacuum schedule says they should be vacuumed."""
+        now = time.time() if now is None else now
+        due = []
+        for name, entry in sorted(self._manifest.items()):
+            min_deleted = entry['vacuum']['min_deleted']
+            interval = entry['vacuum']['interval']
+            if min_deleted is None and interval is None:
+                continue
+            if interval is not None and now - entry['last_vacuum'] < interval:
+                continue
+            deleted = self[name].deleted_count
+            if not deleted or (min_deleted is not None and deleted < min_deleted):
+                continue
+            due.append(name)
+        return due
+
+    def run_vacuum_schedule(self, now: float = None) -> tp.List[str]:
+        """Vacuum every collection that is due; returns their names."""
+        due = self.vacuum_due(now)
+        for name in due:
+            logger.info(f'Vacuuming collection {name!r}')
+            self.vacuum(name)
+        return due
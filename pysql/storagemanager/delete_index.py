@@ -19,6 +19,9 @@ class DeletionIndex(Saveable):
     def __iter__(self):
         return iter(sorted(self._data + self._buffer))
 
+    def __len__(self):
+        return len(self._data) + len(self._buffer)
+
     def _flush_buffer(self):
         for item in self._buffer:
             self._data.insert_sorted(item)
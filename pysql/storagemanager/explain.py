@@ -0,0 +1,168 @@
+"""
+Query plans as the storage would run them, see `StorageManager.explain`.
+"""
+import json
+import time
+import typing as tp
+
+from pysql.compiler import Probe
+from pysql.datastructures import postings
+from pysql.storagemanager.cfg import ID_FIELD_NAME
+
+
+def explain(snapshot, *where_args, analyze: bool = False, **constraints) -> dict:
+    """
+    Probe the indexes like a query on `snapshot` would and report:
+
+    - strategy: 'index' (probes decide), 'index+residual' (probed
+      candidates are read and checked) or 'full_scan', with a reason
+    - probes: in the order they run, the index each one looks up and the
+      number of postings it returned (None if it can't answer the values)
+    - intersection: candidate counts after each step, smallest set first
+    - candidates, past_snapshot, tombstoned: candidates after intersecting
+      and those dropped as newer than the snapshot or deleted
+    - fetch and estimated_bytes: records that will be read from disk
+
+    With `analyze` the query is run as well, adding the records actually
+    fetched and matched, and seconds per stage in `timings`.
+    """
+    storage = snapshot._storage
+    timings = {}
+    report = {'strategy': 'full_scan', 'reason': None, 'cached_plan': None, 'probes': [],
+              'intersection': [], 'candidates': None, 'past_snapshot': 0, 'tombstoned': 0,
+              'residual': False}
+
+    with storage._lock:
+        start = time.perf_counter()
+        hits = storage._compiler.hits
+        plan, params = storage._compile(*where_args, **constraints)
+        timings['compile'] = time.perf_counter() - start
+        indexes = storage._index
+        stale = storage._version != snapshot._version
+        records = _record_estimate(indexes, snapshot, stale)
+
+        candidates = predicate = None
+        if plan is None:
+            report['reason'] = 'no constraints'
+        else:
+            report['cached_plan'] = storage._compiler.hits > hits
+            if stale:
+                report['reason'] = 'storage was vacuumed since the snapshot, its indexes no longer apply'
+                predicate = plan.predicate
+            elif plan.full_scan:
+                report['reason'] = 'no constraint can be answered by an index'
+                predicate = plan.residual
+            else:
+                offset_sets = []
+                last = time.perf_counter()
+
+                def on_probe(probe, offsets):
+                    nonlocal last
+                    now = time.perf_counter()
+                    offset_sets.append(offsets)
+                    report['probes'].append({
+                        'order': len(report['probes']) + 1,
+                        'index': _probe_fields(probe),
+                        'backend': _backend(indexes, probe),
+                        'lookup': probe.describe(params),
+                        'postings': len(offsets) if offsets is not None else None,
+                        'seconds': now - last,
+                    })
+                    last = now
+
+                candidates, predicate = plan.select(indexes, params, on_probe=on_probe)
+                timings['intersect'] = time.perf_counter() - last
+                timings['probes'] = sum(p['seconds'] for p in report['probes'])
+                report['intersection'] = _intersection_steps(offset_sets)
+                if candidates is None:
+                    report['reason'] = 'no probe can answer these values'
+                else:
+                    report['strategy'] = 'index' if predicate is None else 'index+residual'
+                    if predicate is not plan.residual:
+                        report['reason'] = 'some probe can\'t answer these values, candidates are checked in full'
+
+    report['residual'] = predicate is not None
+    charnos = None
+    if candidates is not None:
+        start = time.perf_counter()
+        report['candidates'] = len(candidates)
+        charnos = [
+            char_no for char_no in candidates
+            if char_no < snapshot.size and char_no not in snapshot._tombstones
+        ]
+        report['past_snapshot'] = sum(1 for char_no in candidates if char_no >= snapshot.size)
+        report['tombstoned'] = len(candidates) - report['past_snapshot'] - len(charnos)
+        timings['filter'] = time.perf_counter() - start
+
+    if charnos is not None:
+        report['fetch'] = len(charnos)
+        average = snapshot.size / records if records else 0
+        report['estimated_bytes'] = round(len(charnos) * average)
+    else:
+        report['fetch'] = records
+        report['estimated_bytes'] = snapshot.size
+
+    if analyze:
+        _analyze(snapshot, params, charnos, predicate, report, timings)
+        timings['total'] = sum(timings.values())
+        report['timings'] = timings
+    else:
+        for probe in report['probes']:
+            del probe['seconds']
+    return report
+
+
+def _analyze(snapshot, params, charnos, predicate, report, timings):
+    start = time.perf_counter()
+    if charnos is None:
+        lines = list(snapshot._iter_live_lines())
+    else:
+        lines = list(snapshot._file.read_lines_at(charnos))
+    timings['read'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    objects = [json.loads(line) for _, line in lines]
+    timings['decode'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if predicate is not None:
+        objects = [o for o in objects if predicate(o, params)]
+    timings['residual'] = time.perf_counter() - start
+
+    report['fetched'] = len(lines)
+    report['bytes_read'] = sum(len(line) for _, line in lines)
+    report['matched'] = len(objects)
+
+
+def _probe_fields(probe) -> tp.Union[str, tp.List[str]]:
+    if isinstance(probe, Probe):
+        return probe.field
+    return sorted({p.field for probes in probe.alternatives for p in probes})
+
+
+def _backend(indexes, probe) -> tp.Optional[str]:
+    if not isinstance(probe, Probe) or probe.field not in indexes:
+        return None
+    return indexes[probe.field].stats()['backend']
+
+
+def _intersection_steps(offset_lists: tp.List[tp.Optional[postings.Offsets]]) -> tp.List[int]:
+    """Candidates left after each step of `postings.intersect_all`, smallest list first"""
+    usable = sorted((offsets for offsets in offset_lists if offsets is not None), key=len)
+    if not usable:
+        return []
+    result = usable[0]
+    steps = [len(result)]
+    for offsets in usable[1:]:
+        if not result:
+            break
+        result = postings.intersect(result, offsets)
+        steps.append(len(result))
+    return steps
+
+
+def _record_estimate(indexes, snapshot, stale: bool) -> tp.Optional[int]:
+    """Live records of the snapshot as far as the `_id` index tells, None if unknown"""
+    if stale or ID_FIELD_NAME not in indexes:
+        return None
+    return max(indexes[ID_FIELD_NAME].stats()['postings'] - len(snapshot._tombstones), 0)
@@ -0,0 +1,153 @@
+import json
+import os
+from pathlib import Path
+from typing import Iterable
+
+from pysql.storagemanager.cfg import CHAR_NUM_FIELD_NAME
+from pysql.util import read_lines
+
+
+def read_line_at(fd: int, offset: int, chunk_size: int = 4096) -> bytes:
+    """The line starting at `offset`, read without moving the file position"""
+    parts = []
+    while True:
+        data = os.pread(fd, chunk_size, offset)
+        if not data:
+            break
+        end = data.find(b'\n')
+        if end != -1:
+            parts.append(data[:end + 1])
+            break
+        parts.append(data)
+        offset += len(data)
+        chunk_size *= 2
+    return b''.join(parts)
+
+
+def split_lines(data: bytes, start: int):
+    """(char_no, line) pairs of a run of whole lines beginning at `start`"""
+    pos = 0
+    while pos < len(data):
+        end = data.find(b'\n', pos) + 1 or len(data)
+        yield start + pos, data[pos:end].decode()
+        pos = end
+
+
+class RecordReader:
+    """Decodes records from `iter_lines` and `read_lines_at`."""
+
+    def iter_lines(self):
+        raise NotImplementedError
+
+    def read_lines_at(self, charno_list: Iterable[int]):
+        raise NotImplementedError
+
+    def all_records(self, include_charno=False):
+        for char_no, line in self.iter_lines():
+            obj = json.loads(line)
+            if include_charno:
+                obj[CHAR_NUM_FIELD_NAME] = char_no
+            yield obj
+
+    def records_by_charno(self, charno_list: Iterable[int], include_charno=False):
+        for char_no, line in self.read_lines_at(charno_list):
+            obj = json.loads(line)
+
+            if include_charno:
+                obj[CHAR_NUM_FIELD_NAME] = char_no
+
+            yield obj
+
+
+class FileSnapshot(RecordReader):
+    """
+    The storage file as it was when the snapshot was taken.
+
+    The file stays open, so vacuum replacing it doesn't affect the snapshot
+    and the replaced version is only released once the snapshot is closed.
+    Records appended later lie past `size` and are not seen. Reads use
+    positional I/O, so a snapshot can serve a scan and point reads at once.
+    """
+    scan_chunk_size = 1024 * 1024
+
+    def __init__(self, path):
+        self._fd = os.open(path, os.O_RDONLY)
+        self.size = os.fstat(self._fd).st_size
+
+    def iter_lines(self):
+        offset = 0
+        rest = b''
+        while offset < self.size:
+            data = rest + os.pread(self._fd, min(self.scan_chunk_size, self.size - offset), offset)
+            offset += len(data) - len(rest)
+            cut = data.rfind(b'\n') + 1
+            yield from split_lines(data[:cut], offset - len(data))
+            rest = data[cut:]
+        if rest:
+            yield from split_lines(rest, offset - len(rest))
+
+    def read_lines_at(self, charno_list: Iterable[int]):
+        for char_no in charno_list:
+            yield char_no, read_line_at(self._fd, char_no).decode()
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        self.close()
+
+
+class FileOps(RecordReader):
+    """Plain append-only storage file with one JSON record per line."""
+
+    def __init__(self, path):
+        self._path = path
+
+    @property
+    def size(self) -> int:
+        return os.stat(self._path).st_size
+
+    def append(self, line: str) -> int:
+        return self.append_many([line])[0]
+
+    def append_many(self, lines: Iterable[str]):
+        offsets = []
+        with open(self._path, 'a') as f:
+            char_no = f.tell()
+            for line in lines:
+                offsets.append(char_no)
+                f.write(line)
+                char_no += len(line)
+        return offsets
+
+    def iter_lines(self):
+        with open(self._path, 'r') as f:
+            yield from read_lines(f)
+
+    def read_lines_at(self, charno_list: Iterable[int]):
+        with open(self._path, 'r') as f:
+            for char_no in charno_list:
+                f.seek(char_no)
+                yield char_no, f.readline()
+
+    def snapshot(self) -> FileSnapshot:
+        return FileSnapshot(self._path)
+
+    def compact(self, deleted: Iterable[int]):
+        """Rewrite the file without the lines starting at `deleted` offsets (sorted)."""
+        new_path = Path(str(self._path) + '.new')
+        prev_to_be_deleted_idx = 0
+
+        with open(self._path) as in_fp, open(new_path, 'w') as out_fp:
+            for to_be_deleted_idx in deleted:
+                char_count = to_be_deleted_idx - prev_to_be_deleted_idx
+                chunk = in_fp.read(char_count)
+                out_fp.write(chunk)
+                # skip line as it's the one we want to delete. Save its length
+                prev_to_be_deleted_idx = to_be_deleted_idx + len(in_fp.readline())
+
+            # carry over any remaining data
+            out_fp.write(in_fp.read())
+        os.replace(new_path, self._path)
@@ -0,0 +1,166 @@
+"""
+Operation metrics of a StorageManager: latency histograms, I/O and index
+counters, hooks and a slow-operation log.
+
+Metrics are off unless a `Metrics` is given to the storage; then every
+instrumented call checks one attribute and nothing else is recorded.
+"""
+import functools
+import logging
+import threading
+import time
+import typing as tp
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from pysql.interfaces import OperationHook
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = (
+    'bytes_read',
+    'bytes_written',
+    'records_decoded',
+    'index_probes',
+    'postings_scanned',
+    'tombstones_filtered',
+)
+
+
+class Histogram:
+    """
+    Latencies in power-of-two microsecond buckets: bucket `b` holds those
+    below 2**b µs, the last one everything slower.
+    """
+    buckets = 32
+
+    def __init__(self):
+        self.counts = [0] * self.buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        bucket = min(int(seconds * 1e6).bit_length(), self.buckets - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the `q` (0 to 1) latency, in seconds"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(2 ** bucket / 1e6, self.max)
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'buckets_us': {2 ** b: n for b, n in enumerate(self.counts) if n},
+        }
+
+
+class Metrics:
+    """
+    Collects operation latencies and counters; share one between storages
+    to aggregate them.
+
+    Hooks are called with the operation name, its duration in seconds and
+    details (its arguments), after the operation finished. Operations that
+    took at least `slow_threshold` seconds are logged as warnings.
+    """
+
+    def __init__(self, slow_threshold: float = None, hooks: tp.Iterable[OperationHook] = ()):
+        self.slow_threshold = slow_threshold
+        self._hooks = list(hooks)
+        self._latencies = defaultdict(Histogram)
+        self._counters = Counter(dict.fromkeys(COUNTERS, 0))
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: OperationHook):
+        with self._lock:
+            self._hooks = self._hooks + [hook]
+
+    def remove_hook(self, hook: OperationHook):
+        with self._lock:
+            self._hooks = [h for h in self._hooks if h is not hook]
+
+    def incr(self, **amounts: int):
+        with self._lock:
+            self._counters.update(amounts)
+
+    def record(self, op: str, seconds: float, details: dict = None):
+        with self._lock:
+            self._latencies[op].add(seconds)
+            hooks = self._hooks
+
+        if self.slow_threshold is not None and seconds >= self.slow_threshold:
+            logger.warning(f'Slow {op}: {seconds * 1000:.1f} ms {_format_details(details)}')
+        for hook in hooks:
+            try:
+                hook(op, seconds, details or {})
+            except Exception:
+                logger.exception(f'Metrics hook {hook!r} failed')
+
+    @contextmanager
+    def timed(self, op: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(op, time.perf_counter() - start)
+
+    def on_probe(self, probe, offsets):
+        """`Plan.select` callback counting index probes and their postings"""
+        self.incr(index_probes=1, postings_scanned=len(offsets) if offsets is not None else 0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'latency': {op: h.as_dict() for op, h in sorted(self._latencies.items())},
+            }
+
+    def reset(self):
+        with self._lock:
+            self._latencies.clear()
+            self._counters = Counter(dict.fromkeys(COUNTERS, 0))
+
+
+def _format_details(details: tp.Optional[dict]) -> str:
+    if not details:
+        return ''
+    return ' '.join(f'{key}={value!r}' for key, value in details.items() if value)
+
+
+def instrumented(op: str):
+    """
+    Times a StorageManager method as operation `op` when the storage has
+    metrics; otherwise calls it straight away.
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metrics = self._metrics
+            if metrics is None:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                metrics.record(op, time.perf_counter() - start, {'args': args, 'kwargs': kwargs})
+        return wrapper
+    return decorate
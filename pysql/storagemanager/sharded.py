@@ -0,0 +1,159 @@
+import hashlib
+import heapq
+import json
+import os
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from pysql.compiler import sort_key
+from pysql.conf import DEFAULT_STORAGE_DIR
+from pysql.storagemanager.cfg import ID_FIELD_NAME
+from pysql.storagemanager.storage import StorageManager
+
+# the shard owned by a worker process, opened by its initializer
+_shard: StorageManager = None
+
+
+def _open_shard(storage_dir, options):
+    global _shard
+    _shard = StorageManager(storage_dir, **options)
+
+
+def _call_shard(method: str, args: tuple, kwargs: dict):
+    return getattr(_shard, method)(*args, **kwargs)
+
+
+def shard_of(obj_id: str, shards: int) -> int:
+    # a digest, unlike hash(), is the same in every process and every run
+    digest = hashlib.md5(obj_id.encode()).digest()
+    return int.from_bytes(digest[:8], 'big') % shards
+
+
+class ShardedStorageManager:
+    """
+    Records hash-partitioned by `_id` over several StorageManagers, each in
+    its own `shard-NNN` directory.
+
+    Every shard is owned by one worker process, which runs that shard's
+    operations one after another; different shards work in parallel.
+    Queries fan out to all shards and their results are merged, a query
+    that fixes `_id` only goes to the shard holding it. With
+    `processes=False` shards are opened in this process instead and run
+    sequentially, which is handy for debugging.
+
+    The number of shards is fixed when the storage is created.
+    """
+    meta_name = 'shards.json'
+    default_shards = 4
+
+    def __init__(self, storage_dir=DEFAULT_STORAGE_DIR, shards: int = None,
+                 processes: bool = True, **storage_options):
+        """
+        :param shards: number of shards of a new storage
+        :param processes: run each shard in its own worker process
+        :param storage_options: passed to every shard's StorageManager
+        """
+        self._storage_dir = Path(storage_dir)
+        self._shards = self._init_meta(shards)
+
+        self._shard_dirs = [self._storage_dir / f'shard-{i:03d}' for i in range(self._shards)]
+        for shard_dir in self._shard_dirs:
+            os.makedirs(shard_dir, exist_ok=True)
+
+        if processes:
+            self._executors = [
+                ProcessPoolExecutor(max_workers=1, initializer=_open_shard,
+                                    initargs=(shard_dir, storage_options))
+                for shard_dir in self._shard_dirs
+            ]
+            self._storages = None
+        else:
+            self._executors = None
+            self._storages = [StorageManager(shard_dir, **storage_options) for shard_dir in self._shard_dirs]
+
+    def _init_meta(self, shards: int = None) -> int:
+        meta_path = self._storage_dir / self.meta_name
+        if meta_path.exists():
+            with open(meta_path) as f:
+                stored = json.loads(f.read())['shards']
+            if shards is not None and shards != stored:
+                raise ValueError(f'{self._storage_dir} has {stored} shards, not {shards}')
+            return stored
+
+        shards = shards or self.default_shards
+        os.makedirs(self._storage_dir, exist_ok=True)
+        with open(meta_path, 'w') as f:
+            f.write(json.dumps({'shards': shards}))
+        return shards
+
+    @property
+    def shards(self) -> int:
+        return self._shards
+
+    def _submit(self, shard: int, method: str, *args, **kwargs) -> Future:
+        if self._executors is not None:
+            return self._executors[shard].submit(_call_shard, method, args, kwargs)
+
+        future = Future()
+        try:
+            future.set_result(getattr(self._storages[shard], method)(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _fan_out(self, shards, method: str, *args, **kwargs) -> list:
+        futures = [self._submit(shard, method, *args, **kwargs) for shard in shards]
+        wait(futures)
+        return [future.result() for future in futures]
+
+    def _target_shards(self, constraints: dict):
+        obj_id = constraints.get(ID_FIELD_NAME)
+        if isinstance(obj_id, str):
+            return [shard_of(obj_id, self._shards)]
+        return range(self._shards)
+
+    def create_object(self, obj: dict) -> str:
+        obj[ID_FIELD_NAME] = str(uuid.uuid4())
+        shard = shard_of(obj[ID_FIELD_NAME], self._shards)
+        return self._submit(shard, '_insert_object', obj).result()
+
+    def get_objects(self, *where_args, **constraints):
+        results = self._fan_out(self._target_shards(constraints), 'get_objects', *where_args, **constraints)
+        return [o for objects in results for o in objects]
+
+    def get_objects_sorted(self, order_by: str, *where_args, descending=False, limit=None, **constraints):
+        """
+        Matching objects ordered by the `order_by` field, at most `limit`.
+        Each shard sorts and cuts its own part, which are then merged.
+        """
+        results = self._fan_out(
+            self._target_shards(constraints), 'get_objects_sorted', order_by, *where_args,
+            descending=descending, limit=limit, **constraints
+        )
+        merged = heapq.merge(*results, key=sort_key(order_by), reverse=descending)
+        if limit is not None:
+            return [o for _, o in zip(range(limit), merged)]
+        return list(merged)
+
+    def count(self, *where_args, **constraints) -> int:
+        return sum(self._fan_out(self._target_shards(constraints), 'count', *where_args, **constraints))
+
+    def delete_objects(self, *where_args, **constraints) -> int:
+        return sum(self._fan_out(self._target_shards(constraints), 'delete_objects', *where_args, **constraints))
+
+    def vacuum(self, shards=None):
+        """Vacuum the given shards, all by default; each one on its own."""
+        self._fan_out(range(self._shards) if shards is None else shards, 'vacuum')
+
+    def close(self):
+        if self._executors is not None:
+            for executor in self._executors:
+                executor.shutdown(wait=True)
+            self._executors = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
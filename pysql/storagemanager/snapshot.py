@@ -0,0 +1,145 @@
+import heapq
+import json
+import time
+import typing as tp
+
+from pysql.compiler import sort_key
+from pysql.storagemanager.cfg import CHAR_NUM_FIELD_NAME
+from pysql.storagemanager.explain import explain
+
+
+class Snapshot:
+    """
+    Point-in-time, read-only view of a StorageManager.
+
+    A snapshot pins the storage file version (see `FileOps.snapshot`) and
+    the set of deleted offsets as of when it was taken, so a long scan
+    sees a consistent view while other threads create, delete and vacuum.
+    Writers never wait for it; it only takes the storage lock for the
+    moment it probes the indexes.
+
+    Indexes are only ever appended to between vacuums, so as long as the
+    storage wasn't vacuumed since, they are probed as they are and newer
+    records are told apart by their offsets lying past the snapshot.
+    After a vacuum the offsets in the indexes refer to the new file, and
+    the snapshot answers queries by scanning its own version instead.
+
+    Close snapshots when done, so old file versions can be released.
+    """
+
+    def __init__(self, storage, file_snapshot, tombstones: tp.FrozenSet[int], version: int):
+        self._storage = storage
+        self._file = file_snapshot
+        self._tombstones = tombstones
+        self._version = version
+        self._metrics = storage._metrics
+
+    @property
+    def size(self) -> int:
+        return self._file.size
+
+    def _select(self, *where_args, **constraints):
+        """Plan params, offsets to read (None means scan) and their predicate"""
+        storage = self._storage
+        metrics = self._metrics
+        with storage._lock:
+            plan, params = storage._compile(*where_args, **constraints)
+            if plan is None:
+                return params, None, None
+            if storage._version != self._version:
+                return params, None, plan.predicate
+            if metrics is None:
+                candidates, predicate = plan.select(storage._index, params)
+            else:
+                start = time.perf_counter()
+                candidates, predicate = plan.select(storage._index, params, on_probe=metrics.on_probe)
+                metrics.record('index_probe', time.perf_counter() - start)
+
+        if candidates is None:
+            return params, None, predicate
+        # candidates come in ascending order, as the file is read
+        charnos = [
+            char_no for char_no in candidates
+            if char_no < self._file.size and char_no not in self._tombstones
+        ]
+        if metrics is not None:
+            metrics.incr(tombstones_filtered=sum(1 for char_no in candidates if char_no in self._tombstones))
+        return params, charnos, predicate
+
+    def iter_objects(self, *where_args, include_charno=False, **constraints):
+        """Stream matching objects; see `StorageManager.get_objects`"""
+        selection = self._select(*where_args, **constraints)
+        return self._iter_selected(*selection, include_charno=include_charno)
+
+    def _iter_selected(self, params, charnos, predicate, include_charno=False):
+        if charnos is None:
+            # deleted records are skipped before they are decoded
+            lines = self._iter_live_lines()
+        else:
+            lines = self._file.read_lines_at(charnos)
+        if self._metrics is not None:
+            lines = self._counted(lines)
+
+        for char_no, line in lines:
+            o = json.loads(line)
+            if predicate is not None and not predicate(o, params):
+                continue
+            if include_charno:
+                o[CHAR_NUM_FIELD_NAME] = char_no
+            yield o
+
+    def _iter_live_lines(self):
+        tombstones = self._tombstones
+        for char_no, line in self._file.iter_lines():
+            if char_no not in tombstones:
+                yield char_no, line
+
+    def _counted(self, lines):
+        """Pass lines through, counting them for the metrics once done"""
+        records = size = 0
+        try:
+            for char_no, line in lines:
+                records += 1
+                size += len(line)
+                yield char_no, line
+        finally:
+            self._metrics.incr(records_decoded=records, bytes_read=size)
+
+    def get_objects(self, *where_args, **constraints):
+        return list(self.iter_objects(*where_args, **constraints))
+
+    def get_objects_sorted(self, order_by: str, *where_args, descending=False, limit=None, **constraints):
+        objects = self.iter_objects(*where_args, **constraints)
+        key = sort_key(order_by)
+        if limit is not None:
+            select = heapq.nlargest if descending else heapq.nsmallest
+            return select(limit, objects, key=key)
+        return sorted(objects, key=key, reverse=descending)
+
+    def iter_lines(self):
+        """Encoded live records in offset order"""
+        for _, line in self._iter_live_lines():
+            yield line
+
+    def count(self, *where_args, **constraints) -> int:
+        params, charnos, predicate = self._select(*where_args, **constraints)
+        if predicate is None:
+            if charnos is not None:
+                # the probes alone decide, no need to decode records
+                return len(charnos)
+            if not where_args and not constraints:
+                return sum(1 for _ in self._iter_live_lines())
+        return sum(1 for _ in self._iter_selected(params, charnos, predicate, include_charno=True))
+
+    def explain(self, *where_args, analyze=False, **constraints) -> dict:
+        """How a query would run on this snapshot; see `explain.explain`"""
+        return explain(self, *where_args, analyze=analyze, **constraints)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
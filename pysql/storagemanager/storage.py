@@ -1,152 +1,242 @@
 import json
 import os
 import uuid
+from contextlib import nullcontext
 from pathlib import Path
-from threading import Lock
-from typing import Iterable
+from threading import RLock
 
+from pysql.compiler import QueryCompiler, where
 from pysql.conf import DEFAULT_STORAGE_DIR
+from pysql.storagemanager.block_storage import BlockFileOps
 from pysql.storagemanager.cfg import CHAR_NUM_FIELD_NAME, ID_FIELD_NAME
 from pysql.storagemanager.data_index import Indexes
 from pysql.storagemanager.delete_index import DeletionIndex
-from pysql.util import read_lines
-
-
-class FileOps:
-
-    def __init__(self, path):
-        self._path = path
-
-    def all_records(self, include_charno=False):
-        with open(self._path, 'r') as f:
-            for char_no, line in read_lines(f):
-                obj = json.loads(line)
-                if include_charno:
-                    obj[CHAR_NUM_FIELD_NAME] = char_no
-                yield obj
-
-    def records_by_charno(self, charno_list: Iterable[int], include_charno=False):
-        with open(self._path, 'r') as f:
-            for char_no in charno_list:
-                f.seek(char_no)
-                line = f.readline()
-                obj = json.loads(line)
-
-                if include_charno:
-                    obj[CHAR_NUM_FIELD_NAME] = char_no
-
-                yield obj
+from pysql.storagemanager.file_ops import FileOps
+from pysql.storagemanager.metrics import Metrics, instrumented
+from pysql.storagemanager.snapshot import Snapshot
 
 
 class StorageManager:
 
-    def __init__(self, storage_dir = DEFAULT_STORAGE_DIR):
+    def __init__(self, storage_dir = DEFAULT_STORAGE_DIR, compression: str = None,
+                 block_size: int = None, block_cache_size: int = 64,
+                 index_backends: dict = None, index_cache_pages: int = 256,
+                 index_resident_budget: int = None, index_postings_budget: int = None,
+                 plan_cache_size: int = 256, metrics: Metrics = None):
+        """
+        :param compression: store records in compressed blocks using the
+            given codec ('zlib' or 'lzma'). Existing compressed storages
+            are detected automatically.
+        :param block_size: uncompressed size of a compressed block, in chars
+        :param block_cache_size: number of decoded blocks kept in memory
+        :param index_backends: index backend per field: 'rbtree' (in memory,
+            the default) or 'bptree' (on-disk B+tree)
+        :param index_cache_pages: page cache size of each on-disk index
+        :param index_resident_budget: keys plus postings that lazily loaded
+            in-memory indexes may hold before unused ones are evicted
+        :param index_postings_budget: bytes the posting lists of in-memory
+            indexes may take before the largest are spilled to
+            memory-mapped files
+        :param plan_cache_size: number of compiled query plans kept, by
+            query shape
+        :param metrics: collects latencies and counters of operations,
+            see `stats`; none are collected without it
+        """
         self._storage_dir = storage_dir
         self._storage_file = Path(storage_dir) / 'pynosql.data'
         self._delete_file = Path(storage_dir) / 'pynosql.delete.data'
 
-        index_file = Path(storage_dir) / 'pynosql.index.data'
-        self._index = Indexes(file_path=index_file)
+        self._index = Indexes(
+            Path(storage_dir) / 'pynosql.index',
+            backends=index_backends,
+            cache_pages=index_cache_pages,
+            resident_budget=index_resident_budget,
+            postings_budget=index_postings_budget,
+            legacy_file=Path(storage_dir) / 'pynosql.index.data',
+        )
         self._deleted_index = DeletionIndex(self._delete_file)
-        self._deletion_lock = Lock()
-
-        for f_name in (self._storage_file, index_file):
-            if not os.path.exists(f_name):
-                f_name.touch(exist_ok=True)
+        # deleted offsets; replaced, never changed, so snapshots can share it
+        self._tombstones = frozenset(self._deleted_index)
+        # guards writes and index access; readers only hold it briefly
+        self._lock = RLock()
+        # bumped by vacuum, which moves records to new offsets
+        self._version = 0
+        self._compiler = QueryCompiler(cache_size=plan_cache_size)
+        self._metrics = metrics
+
+        if not os.path.exists(self._storage_file):
+            self._storage_file.touch(exist_ok=True)
+
+        if compression or BlockFileOps.exists(self._storage_file):
+            self._file_ops = BlockFileOps(
+                self._storage_file,
+                codec=compression,
+                block_size=block_size,
+                cache_blocks=block_cache_size,
+            )
+        else:
+            self._file_ops = FileOps(self._storage_file)
 
     @property
     def storage_file_ops(self):
-        return FileOps(self._storage_file)
+        return self._file_ops
 
     def _update_index(self, obj: dict, new_data_start_idx: int):
         self._index.index_record(obj, new_data_start_idx)
 
     @property
     def storage_size(self):
-        return os.stat(self._storage_file).st_size
+        return self._file_ops.size
 
-    def get_next_write_index(self, data_size=-1):
-        # TODO: this can be used as a hook for more efficient writing mechanisms
-        #       e.g. someone might prefer block-writes pattern instead of append log.
-        #       This function would serve as a hook to redefine this behaviour
-        return self.storage_size
+    @property
+    def metrics(self) -> Metrics:
+        return self._metrics
+
+    def stats(self) -> dict:
+        """
+        Latency histograms per operation and counters of bytes, decoded
+        records, index probes and postings; empty without metrics.
+        """
+        if self._metrics is None:
+            return {}
+        return self._metrics.stats()
+
+    def _timed(self, op: str):
+        if self._metrics is None:
+            return nullcontext()
+        return self._metrics.timed(op)
+
+    @property
+    def deleted_count(self):
+        """Number of deleted objects waiting for vacuum"""
+        return len(self._deleted_index)
 
     # todo: multiple creations of the same object?
+    @instrumented('create_object')
     def create_object(self, obj: dict):
         obj[ID_FIELD_NAME] = str(uuid.uuid4())
+        return self._insert_object(obj)
+
+    def _insert_object(self, obj: dict):
+        line = json.dumps(obj) + '\n'
+        with self._lock:
+            new_data_start_idx = self._file_ops.append(line)
+            with self._timed('index_update'):
+                self._update_index(obj, new_data_start_idx)
+        if self._metrics is not None:
+            self._metrics.incr(bytes_written=len(line))
+        return obj[ID_FIELD_NAME]
+
+    def _compile(self, *where_args, **constraints):
+        """Plan and params of a query, (None, None) if nothing is constrained"""
+        expr = where(*where_args, **constraints)
+        if expr is None:
+            return None, None
+        return self._compiler.compile(expr)
+
+    def snapshot(self) -> Snapshot:
+        """
+        Consistent read-only view of the storage as of now, unaffected by
+        later writes and vacuums. Close it when done.
+        """
+        with self._lock:
+            return Snapshot(self, self._file_ops.snapshot(), self._tombstones, self._version)
 
-        new_data_start_idx = self.get_next_write_index()
-        with open(self._storage_file, 'a') as f:
-            f.write(json.dumps(obj) + '\n')
-        self._update_index(obj, new_data_start_idx)
-
-    def _get_objects_indexed(self, include_charno=False, **constraints):
-        lines = None
-
-        for constraint_key, constraint_val in constraints.items():
-            cur_line_nos = self._index[constraint_key][constraint_val] or set()
-            if lines is None:
-                lines = set(cur_line_nos)
-            else:
-                lines.intersection_update(cur_line_nos)
-
-        not_deleted_lines = [
-            char_no for char_no in lines
-            if not self._deleted_index.is_deleted(char_no)
-        ]
-        return self.storage_file_ops.records_by_charno(
-            not_deleted_lines,
-            include_charno=include_charno
-        )
+    def iter_objects(self, *where_args, **constraints):
+        """
+        Stream matching objects from a snapshot taken at the call. The
+        snapshot is closed when the iterator is exhausted or closed.
+        """
+        snapshot = self.snapshot()
+        objects = snapshot.iter_objects(*where_args, **constraints)
 
-    def _get_objects(self, include_charno=False, **constraints):
-        if not constraints:
-            objects = self.storage_file_ops.all_records(include_charno=True)
-            not_deleted_objects = [o for o in objects if not self._deleted_index.is_deleted(o[CHAR_NUM_FIELD_NAME])]
-            if not include_charno:
-                for o in not_deleted_objects:
-                    o.pop(CHAR_NUM_FIELD_NAME)
-            return not_deleted_objects
-        return self._get_objects_indexed(include_charno=include_charno, **constraints)
+        def stream():
+            with snapshot:
+                yield from objects
+        return stream()
 
-    def get_objects(self, **constraints):
-        return self._get_objects(include_charno=False, **constraints)
+    def _get_objects(self, *where_args, include_charno=False, **constraints):
+        with self.snapshot() as snapshot:
+            return snapshot.get_objects(*where_args, include_charno=include_charno, **constraints)
 
-    def delete_objects(self, **constraints):
-        objects = self._get_objects(include_charno=True, **constraints)
+    @instrumented('get_objects')
+    def get_objects(self, *where_args, **constraints):
+        """
+        Objects matching all constraints. Besides field=value constraints,
+        takes query expressions or dict queries, see `pysql.compiler`:
 
-        deleted_objects_count = 0
-        with self._deleted_index.atomic as delete:
-            for _, o in enumerate(objects):
-                delete.mark_deleted(o[CHAR_NUM_FIELD_NAME])
-                deleted_objects_count += 1
+            storage.get_objects(F('age') >= 18, {'status': {'$in': ['new', 'open']}}, city='Kyiv')
 
-        return deleted_objects_count
+        `$in` matches when the whole field value is one of the listed
+        values; it doesn't look inside array fields.
+        """
+        return self._get_objects(*where_args, include_charno=False, **constraints)
 
+    @instrumented('get_objects_sorted')
+    def get_objects_sorted(self, order_by: str, *where_args, descending=False, limit=None, **constraints):
+        """
+        Matching objects ordered by the `order_by` field, at most `limit`
+        of them. Objects without the field come first.
+        """
+        with self.snapshot() as snapshot:
+            return snapshot.get_objects_sorted(
+                order_by, *where_args, descending=descending, limit=limit, **constraints
+            )
+
+    @instrumented('count')
+    def count(self, *where_args, **constraints):
+        """Number of live objects matching constraints"""
+        with self.snapshot() as snapshot:
+            return snapshot.count(*where_args, **constraints)
+
+    def explain(self, *where_args, analyze=False, **constraints) -> dict:
+        """
+        The plan of a query: the indexes probed and in what order, posting
+        counts before and after intersecting and filtering deleted records,
+        and the records that will be fetched. With `analyze` the query also
+        runs and every stage is timed. See `pysql.storagemanager.explain`.
+        """
+        with self.snapshot() as snapshot:
+            return snapshot.explain(*where_args, analyze=analyze, **constraints)
+
+    def close(self):
+        """Save and close the indexes; the storage can't be used afterwards"""
+        with self._lock:
+            self._index.save()
+            self._index.close()
+
+    @instrumented('delete_objects')
+    def delete_objects(self, *where_args, **constraints):
+        with self._lock:
+            objects = self._get_objects(*where_args, include_charno=True, **constraints)
+
+            deleted = []
+            with self._deleted_index.atomic as delete:
+                for o in objects:
+                    delete.mark_deleted(o[CHAR_NUM_FIELD_NAME])
+                    deleted.append(o[CHAR_NUM_FIELD_NAME])
+            # a new set rather than an update, snapshots keep the old one
+            self._tombstones = self._tombstones.union(deleted)
+
+        return len(deleted)
+
+    @instrumented('vacuum')
     def vacuum(self):
         """
         Overwrite the storage file with all deletions applied, reset delete index
 
         :return:
         """
-        new_storage_file = Path(str(self._storage_file) + '.new')
-        prev_to_be_deleted_idx = 0
-
         # do we need lock here? `os.replace` is atomic on os level
         # according to pydocs
-        with self._deletion_lock, open(self._storage_file) as in_fp, open(new_storage_file, 'w') as out_fp:
+        with self._lock:
             # deleted index is always sorted
-            for to_be_deleted_idx in self._deleted_index:
-                char_count = to_be_deleted_idx - prev_to_be_deleted_idx
-                chunk = in_fp.read(char_count)
-                out_fp.write(chunk)
-                # skip line as it's the one we want to delete. Save its length
-                prev_to_be_deleted_idx += len(in_fp.readline())
-
-            # carry over any remaining data
-            out_fp.write(in_fp.read())
-            os.replace(new_storage_file, self._storage_file)
+            self._file_ops.compact(self._deleted_index)
             self._deleted_index.reset()
-            self._index.rebuild(
-                data_generator=self.storage_file_ops.all_records(include_charno=True)
-            )
+            self._tombstones = frozenset()
+            with self._timed('index_rebuild'):
+                self._index.rebuild(
+                    data_generator=self.storage_file_ops.all_records(include_charno=True)
+                )
+            # offsets in the indexes now refer to the new file
+            self._version += 1
@@ -0,0 +1,118 @@
+import json
+
+from pysql.storagemanager.data_index import Index, Indexes
+from pysql.storagemanager.storage import StorageManager
+
+
+def _fill(storage, n=30):
+    for i in range(n):
+        storage.create_object({'i': i, 'k': i % 3, 'name': f'n{i}'})
+
+
+def test_indexes_load_lazily(tmp_path):
+    _fill(StorageManager(tmp_path))
+
+    reopened = StorageManager(tmp_path)
+    indexes = reopened._index
+    assert indexes.fields() == ['_id', 'i', 'k', 'name']
+    assert not any(indexes.is_loaded(f) for f in indexes.fields())
+    assert indexes.stats()['k'] == {'backend': 'rbtree', 'keys': 3, 'postings': 30, 'resident': False}
+
+    assert len(list(reopened.get_objects(k=1))) == 10
+    assert [f for f in indexes.fields() if indexes.is_loaded(f)] == ['k']
+
+
+def test_indexes_save_only_changed_fields(tmp_path):
+    storage = StorageManager(tmp_path)
+    _fill(storage)
+    index_dir = tmp_path / 'pynosql.index'
+    files = {p.name: p.stat().st_mtime_ns for p in index_dir.iterdir()}
+
+    storage._index.index_record({'k': 5}, 10 ** 6)
+    changed = [p.name for p in index_dir.iterdir() if p.stat().st_mtime_ns != files.get(p.name)]
+    assert sorted(changed) == sorted(['manifest.json', storage._index._index_file('k', 'rbtree').name])
+
+
+def test_indexes_evict_under_budget(tmp_path):
+    _fill(StorageManager(tmp_path))
+
+    # each index holds 30 postings plus its keys; two never fit at once
+    reopened = StorageManager(tmp_path, index_resident_budget=70)
+    assert len(list(reopened.get_objects(k=1))) == 10
+    assert len(list(reopened.get_objects(name='n4'))) == 1
+    indexes = reopened._index
+    assert not indexes.is_loaded('k') and indexes.is_loaded('name')
+
+    # changes to an evicted index are not lost
+    reopened.create_object({'k': 1, 'name': 'x'})
+    assert len(list(reopened.get_objects(k=1))) == 11
+    assert len(list(StorageManager(tmp_path).get_objects(name='x'))) == 1
+
+
+def test_indexes_migrate_single_file_layout(tmp_path):
+    storage = StorageManager(tmp_path)
+    _fill(storage, 6)
+    legacy = {
+        field: storage._index[field].serialize()
+        for field in storage._index.fields()
+    }
+    # breadth-first dump used before indexes were stored as sorted pairs
+    legacy['k'] = {'0': [1, [1, 4], 0], '1': [0, [0, 3], 1], '2': [2, [2, 5], 1],
+                   '3': None, '4': None, '5': None, '6': None}
+    for p in (tmp_path / 'pynosql.index').iterdir():
+        p.unlink()
+    (tmp_path / 'pynosql.index').rmdir()
+    (tmp_path / 'pynosql.index.data').write_text(json.dumps(legacy))
+
+    indexes = Indexes(tmp_path / 'pynosql.index', legacy_file=tmp_path / 'pynosql.index.data')
+    assert not (tmp_path / 'pynosql.index.data').exists()
+    assert list(indexes['k'][2]) == [2, 5]
+    assert Indexes(tmp_path / 'pynosql.index').stats()['i']['keys'] == 6
+
+
+def test_postings_budget_spills_largest_lists(tmp_path):
+    indexes = Indexes(tmp_path / 'index', postings_budget=100_000)
+    indexes.min_spill_bytes = 1024
+    indexes.bulk_load(
+        [('g', g, offset) for g in range(4) for offset in range(g, 40_000, 4)]
+        + [('n', n, n) for n in range(5_000)]
+    )
+
+    stats = indexes.stats()
+    assert stats['g']['resident_bytes'] + stats['n']['resident_bytes'] <= 100_000 * indexes.spill_target
+    # the small lists of `n` stay in memory
+    assert stats['n']['resident_bytes'] == 5_000 * 8
+    assert list(indexes['g'][2])[:3] == [2, 6, 10]
+
+    # changing a spilled list loads it back, saving spills it again
+    indexes['g'].add(1, 40_001)
+    assert list(indexes['g'][1])[-2:] == [39_997, 40_001]
+    assert indexes['g'].resident_bytes == 10_001 * 8
+    indexes.index_record({'g': 3}, 40_003)
+    assert indexes['g'].resident_bytes == 0
+    assert len(list((tmp_path / 'index' / 'spill').iterdir())) == 4
+
+    reopened = Indexes(tmp_path / 'index')
+    assert len(reopened['g'][1]) == 10_001
+
+
+def test_queries_on_spilled_postings(tmp_path):
+    storage = StorageManager(tmp_path, index_postings_budget=0)
+    storage._index.min_spill_bytes = 0
+    _fill(storage, n=60)
+    spilled = tmp_path / 'pynosql.index' / 'spill'
+    assert any(spilled.iterdir())
+
+    assert sorted(o['i'] for o in storage.get_objects(k=1)) == list(range(1, 60, 3))
+    assert storage.count(k=2, i=5) == 1
+    storage.delete_objects(k=0)
+    storage.vacuum()
+    assert storage.count() == 40
+
+
+def test_deserialize_empty_legacy_dump():
+    index = Index.deserialize({})
+    assert index.stats()['keys'] == 0
+    assert index.get(1) is None
+    index.add(1, 10)
+    assert list(index.get(1)) == [10]
@@ -0,0 +1,77 @@
+import pytest
+
+from pysql.storagemanager.database import Database
+
+
+def test_database_collections_are_separate(tmp_path):
+    db = Database(tmp_path)
+    users = db.collection('users')
+    orders = db.collection('orders', compression='zlib')
+
+    users.create_object({'status': 'active'})
+    for i in range(50):
+        orders.create_object({'status': 'active', 'n': i})
+
+    assert users.count(status='active') == 1
+    assert orders.count(status='active') == 50
+    assert (tmp_path / 'collections' / 'users' / 'pynosql.data').stat().st_size < orders.storage_size
+
+    reopened = Database(tmp_path)
+    assert reopened.collections() == ['orders', 'users']
+    assert reopened['orders'].count() == 50
+    assert type(reopened['orders'].storage_file_ops).__name__ == 'BlockFileOps'
+
+
+def test_database_drop_and_names(tmp_path):
+    db = Database(tmp_path)
+    db.collection('tmp').create_object({'a': 1})
+    db.drop_collection('tmp')
+    assert 'tmp' not in db and not (tmp_path / 'collections' / 'tmp').exists()
+
+    with pytest.raises(KeyError):
+        db['tmp']
+    with pytest.raises(ValueError):
+        db.collection('../escape')
+
+
+def test_database_vacuum_schedule(tmp_path):
+    db = Database(tmp_path)
+    hot = db.collection('hot', vacuum_min_deleted=10)
+    slow = db.collection('slow', vacuum_interval=3600)
+    db.collection('manual')
+
+    for name in ('hot', 'slow', 'manual'):
+        for i in range(20):
+            db[name].create_object({'n': i})
+    hot.delete_objects(n=1)
+    slow.delete_objects(n=1)
+    db['manual'].delete_objects(n=1)
+    assert db.vacuum_due() == []
+
+    for i in range(2, 12):
+        hot.delete_objects(n=i)
+    assert db.run_vacuum_schedule() == ['hot']
+    assert hot.deleted_count == 0 and hot.count() == 9
+
+    later = db._manifest['slow']['last_vacuum'] + 3601
+    assert db.run_vacuum_schedule(now=later) == ['slow']
+    assert db['manual'].deleted_count == 1
+
+
+def test_database_drop_closes_bptree_files(tmp_path):
+    db = Database(tmp_path)
+    events = db.collection('events', index_backends={'k': 'bptree'})
+    events.create_object({'k': 1})
+    bptree = events._index['k']._tree
+    db.drop_collection('events')
+    assert bptree._f.closed
+    assert not (tmp_path / 'collections' / 'events').exists()
+
+
+def test_database_rejects_conflicting_options(tmp_path):
+    db = Database(tmp_path)
+    db.collection('orders', compression='zlib')
+    assert db.collection('orders', compression='zlib') is db['orders']
+    assert db.collection('orders') is db['orders']
+    with pytest.raises(ValueError, match='compression'):
+        Database(tmp_path).collection('orders', compression='lzma')
@@ -0,0 +1,56 @@
+import pytest
+
+from pysql.compiler import F
+from pysql.storagemanager.storage import StorageManager
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = StorageManager(tmp_path)
+    for i in range(100):
+        storage.create_object({'n': i, 'g': i % 4, 'meta': {'odd': i % 2 == 1}})
+    storage.delete_objects(n=4)
+    return storage
+
+
+def test_explain_index_intersection(storage):
+    plan = storage.explain(F('n') < 50, g=0)
+    assert plan['strategy'] == 'index'
+    assert [(p['index'], p['postings']) for p in plan['probes']] == [('g', 25), ('n', 50)]
+    assert [p['order'] for p in plan['probes']] == [1, 2]
+    assert plan['intersection'] == [25, 13]
+    assert plan['tombstoned'] == 1
+    assert plan['fetch'] == 12
+    assert 'timings' not in plan
+
+
+def test_explain_analyze_matches_query(storage):
+    queries = [
+        ((F('n') < 50,), {'g': 0}),
+        ((F('n') >= 90,), {'meta': {'odd': True}}),
+        ((~(F('g') == 1),), {}),
+        ((), {}),
+    ]
+    for where_args, constraints in queries:
+        plan = storage.explain(*where_args, analyze=True, **constraints)
+        assert plan['matched'] == len(storage.get_objects(*where_args, **constraints))
+        assert plan['fetched'] == plan['fetch']
+        assert plan['timings']['total'] > 0
+
+
+def test_explain_fallbacks(storage):
+    plan = storage.explain(~(F('g') == 1))
+    assert plan['strategy'] == 'full_scan'
+    assert plan['residual']
+    assert plan['fetch'] == 99
+
+    plan = storage.explain(F('n') < 10, meta={'odd': True})
+    assert plan['strategy'] == 'index+residual'
+    assert plan['probes'][0]['postings'] is None
+    assert plan['fetch'] == 9
+
+    with storage.snapshot() as snapshot:
+        storage.vacuum()
+        plan = snapshot.explain(g=0, analyze=True)
+    assert plan['strategy'] == 'full_scan'
+    assert plan['matched'] == 24
@@ -0,0 +1,58 @@
+import logging
+
+from pysql.compiler import F
+from pysql.storagemanager.metrics import Histogram, Metrics
+from pysql.storagemanager.storage import StorageManager
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    for micros in [1] * 90 + [1000] * 9 + [100_000]:
+        histogram.add(micros / 1e6)
+    assert histogram.count == 100
+    assert histogram.percentile(0.5) <= 2e-6
+    assert 1e-3 <= histogram.percentile(0.95) <= 2.048e-3
+    assert histogram.percentile(1.0) == histogram.max == 0.1
+
+
+def test_storage_stats_count_operations(tmp_path):
+    storage = StorageManager(tmp_path, metrics=Metrics())
+    for i in range(20):
+        storage.create_object({'n': i, 'g': i % 4})
+    storage.delete_objects(g=0)
+
+    storage.metrics.reset()
+    assert len(storage.get_objects(g=1)) == 5
+    assert storage.count(F('g') >= 0) == 15
+
+    stats = storage.stats()
+    counters = stats['counters']
+    assert counters['index_probes'] == 2
+    assert counters['postings_scanned'] == 5 + 20
+    assert counters['tombstones_filtered'] == 5
+    # the count is answered by the index alone
+    assert counters['records_decoded'] == 5
+    assert counters['bytes_read'] > 0
+    assert stats['latency']['get_objects']['count'] == 1
+    assert stats['latency']['count']['count'] == 1
+    assert stats['latency']['index_probe']['count'] == 2
+
+
+def test_hooks_and_slow_log(tmp_path, caplog):
+    calls = []
+    metrics = Metrics(slow_threshold=0.0)
+    metrics.add_hook(lambda op, seconds, details: calls.append((op, details)))
+    storage = StorageManager(tmp_path, metrics=metrics)
+
+    with caplog.at_level(logging.WARNING, logger='pysql.storagemanager.metrics'):
+        storage.create_object({'n': 1})
+        storage.get_objects(n=1)
+    assert ('get_objects', {'args': (), 'kwargs': {'n': 1}}) in calls
+    assert any('Slow get_objects' in r.message and "'n': 1" in r.message for r in caplog.records)
+
+
+def test_metrics_disabled(tmp_path):
+    storage = StorageManager(tmp_path)
+    storage.create_object({'n': 1})
+    assert storage.get_objects(n=1)[0]['n'] == 1
+    assert storage.stats() == {}
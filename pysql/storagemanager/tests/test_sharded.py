@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from pysql.compiler import F
+from pysql.storagemanager.sharded import ShardedStorageManager, shard_of
+from pysql.storagemanager.storage import StorageManager
+
+
+def fill(storage, n=200, seed=3):
+    rnd = random.Random(seed)
+    ids = []
+    for i in range(n):
+        ids.append(storage.create_object({'n': i, 'g': rnd.randint(0, 4)}))
+    return ids
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_sharded_fan_out(tmp_path, processes):
+    with ShardedStorageManager(tmp_path, shards=3, processes=processes) as storage:
+        ids = fill(storage)
+
+        # every shard holds exactly the records hashed to it
+        for shard in range(3):
+            shard_ids = {o['_id'] for o in StorageManager(tmp_path / f'shard-{shard:03d}').get_objects()}
+            assert shard_ids == {i for i in ids if shard_of(i, 3) == shard}
+            assert shard_ids
+
+        assert storage.count() == 200
+        assert sorted(o['n'] for o in storage.get_objects(F('n') < 10)) == list(range(10))
+        assert storage.get_objects(_id=ids[5])[0]['n'] == 5
+
+        deleted = storage.delete_objects(g=0)
+        assert storage.count() == 200 - deleted
+        storage.vacuum()
+        assert storage.count(g=0) == 0
+        assert storage.count() == 200 - deleted
+
+
+def test_sharded_sorted_merge(tmp_path):
+    with ShardedStorageManager(tmp_path, shards=4, processes=False) as storage:
+        fill(storage)
+        expected = sorted(storage.get_objects(g=2), key=lambda o: o['n'])
+
+        assert storage.get_objects_sorted('n', g=2) == expected
+        assert storage.get_objects_sorted('n', g=2, limit=5) == expected[:5]
+        assert storage.get_objects_sorted('n', g=2, descending=True, limit=5) == expected[::-1][:5]
+
+
+def test_sharded_vacuum_single_shard(tmp_path):
+    with ShardedStorageManager(tmp_path, shards=2, processes=False) as storage:
+        fill(storage, n=50)
+        storage.delete_objects(F('n') >= 0)
+        sizes = [StorageManager(tmp_path / f'shard-{i:03d}').storage_size for i in range(2)]
+
+        storage.vacuum(shards=[1])
+        assert StorageManager(tmp_path / 'shard-000').storage_size == sizes[0]
+        assert StorageManager(tmp_path / 'shard-001').storage_size == 0
+
+
+def test_sharded_shard_count_is_fixed(tmp_path):
+    ShardedStorageManager(tmp_path, shards=2, processes=False).close()
+    assert ShardedStorageManager(tmp_path, processes=False).shards == 2
+    with pytest.raises(ValueError):
+        ShardedStorageManager(tmp_path, shards=3, processes=False)
@@ -0,0 +1,95 @@
+import threading
+
+import pytest
+
+from pysql.compiler import F
+from pysql.storagemanager.storage import StorageManager
+
+
+def ids(objects):
+    return sorted(o['_id'] for o in objects)
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_snapshot_survives_writes_and_vacuum(tmp_path, compression):
+    storage = StorageManager(tmp_path, compression=compression, block_size=512)
+    for i in range(100):
+        storage.create_object({'n': i, 'even': i % 2 == 0})
+    storage.delete_objects(n=0)
+    expected_all = ids(storage.get_objects())
+    expected_even = ids(storage.get_objects(even=True))
+
+    with storage.snapshot() as snapshot:
+        for i in range(100, 150):
+            storage.create_object({'n': i, 'even': i % 2 == 0})
+        # indexes are still valid for the snapshot before the vacuum
+        storage.delete_objects(F('n') < 50)
+        assert ids(snapshot.get_objects(even=True)) == expected_even
+
+        storage.vacuum()
+        storage.create_object({'n': 1000, 'even': True})
+
+        assert ids(snapshot.get_objects()) == expected_all
+        assert ids(snapshot.get_objects(even=True)) == expected_even
+        assert snapshot.count() == 99
+
+    assert storage.count() == 101
+    assert storage.count(F('n') < 50) == 0
+
+
+def test_snapshot_stream_while_other_thread_vacuums(tmp_path):
+    storage = StorageManager(tmp_path, compression='zlib', block_size=256)
+    for i in range(200):
+        storage.create_object({'n': i})
+    expected = ids(storage.get_objects())
+
+    stream = storage.iter_objects()
+    seen = [next(stream) for _ in range(10)]
+
+    def writer():
+        storage.delete_objects(F('n') >= 100)
+        storage.vacuum()
+        for i in range(20):
+            storage.create_object({'n': -i})
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    # the writer doesn't wait for the open stream
+    thread.join(timeout=30)
+    assert not thread.is_alive()
+
+    seen.extend(stream)
+    assert ids(seen) == expected
+    assert storage.count() == 120
+
+
+def test_snapshot_pins_old_generation_until_closed(tmp_path):
+    storage = StorageManager(tmp_path, compression='zlib', block_size=256)
+    for i in range(50):
+        storage.create_object({'n': i})
+    old_files = {tmp_path / 'pynosql.data.g0', tmp_path / 'pynosql.data.g0.tail'}
+
+    first, second = storage.snapshot(), storage.snapshot()
+    storage.delete_objects(n=1)
+    storage.vacuum()
+    assert all(f.exists() for f in old_files)
+
+    first.close()
+    assert all(f.exists() for f in old_files)
+    assert second.count() == 50
+    second.close()
+    assert not any(f.exists() for f in old_files)
+
+
+def test_snapshot_keeps_tail_after_it_is_sealed(tmp_path):
+    storage = StorageManager(tmp_path, compression='zlib', block_size=4096)
+    for i in range(5):
+        storage.create_object({'n': i})
+
+    with storage.snapshot() as snapshot:
+        # fills the tail past the block size, so it is sealed and truncated
+        for i in range(5, 200):
+            storage.create_object({'n': i})
+        assert storage.storage_file_ops.tail_start > 0
+        assert sorted(o['n'] for o in snapshot.get_objects()) == list(range(5))
+        assert snapshot.get_objects(n=3)[0]['n'] == 3
@@ -39,3 +39,53 @@ def test_storage_delete_some_obj(storage_manager_mock):
         o.pop('_id')
         objects.append(o)
     assert objects == [{'a': 1, 'b': 2}]
+
+
+def test_storage_vacuum(storage_manager_mock):
+    for i in range(10):
+        storage_manager_mock.create_object({'i': i, 'odd': i % 2})
+    assert storage_manager_mock.delete_objects(odd=1) == 5
+
+    storage_manager_mock.vacuum()
+    objects = list(storage_manager_mock.get_objects())
+    assert [o['i'] for o in objects] == [0, 2, 4, 6, 8]
+    assert [o['i'] for o in storage_manager_mock.get_objects(i=8)] == [8]
+
+
+def test_storage_index_survives_reopen(tmp_path):
+    mng = StorageManager(tmp_path)
+    for i in range(20):
+        mng.create_object({'i': i, 'k': i % 2})
+
+    reopened = StorageManager(tmp_path)
+    reopened.create_object({'i': 99, 'k': 1})
+    assert reopened.delete_objects(k=0) == 10
+    assert sorted(o['i'] for o in reopened.get_objects(k=1)) == list(range(1, 20, 2)) + [99]
+    assert [o['i'] for o in reopened.get_objects(i=99)] == [99]
+
+
+def test_storage_index_bulk_build_on_vacuum(tmp_path):
+    mng = StorageManager(tmp_path)
+    for i in range(30):
+        mng.create_object({'i': i, 'k': i % 3, 'tags': ['x', str(i % 2)]})
+    mng.delete_objects(k=0)
+    mng.vacuum()
+
+    reopened = StorageManager(tmp_path)
+    assert sorted(o['i'] for o in reopened.get_objects(k=1)) == list(range(1, 30, 3))
+    assert len(list(reopened.get_objects(tags=['x', '1']))) == 10
+    assert not list(reopened.get_objects(k=0))
+
+
+def test_storage_bptree_index_backend(tmp_path):
+    mng = StorageManager(tmp_path, index_backends={'k': 'bptree'})
+    for i in range(30):
+        mng.create_object({'i': i, 'k': i % 3})
+    assert mng._index['k'].stats()['backend'] == 'bptree'
+    assert mng.delete_objects(k=0) == 10
+    mng.vacuum()
+
+    reopened = StorageManager(tmp_path)
+    assert reopened._index['k'].stats()['backend'] == 'bptree'
+    assert sorted(o['i'] for o in reopened.get_objects(k=1)) == list(range(1, 30, 3))
+    assert [k for k, _ in reopened._index['k'].iter_range(low=1)] == [1, 2]
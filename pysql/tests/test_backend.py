@@ -0,0 +1,135 @@
+import asyncio
+import struct
+
+import pytest
+
+from pysql.backend import Client, Connection, RemoteError, Server
+from pysql.storagemanager.storage import StorageManager
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, timeout=30))
+
+
+def test_backend_roundtrip(tmp_path):
+    async def scenario():
+        async with Server(StorageManager(tmp_path)) as server:
+            host, port = server.address
+            async with Client(host, port) as client:
+                assert await client.ping() == 'pong'
+                obj_id = await client.create_object({'a': 1, 'b': 2})
+                await client.create_object({'a': 2, 'b': 2})
+
+                objects = await client.get_objects(a=1)
+                assert objects == [{'a': 1, 'b': 2, '_id': obj_id}]
+                assert await client.count(b=2) == 2
+                assert await client.count({'a': {'$gt': 1}}, b=2) == 1
+                assert await client.delete_objects(a=2) == 1
+                assert await client.count() == 1
+                await client.vacuum()
+                assert await client.count(b=2) == 1
+
+    run(scenario())
+
+
+def test_backend_pipelining_keeps_order(tmp_path):
+    async def scenario():
+        async with Server(StorageManager(tmp_path)) as server:
+            host, port = server.address
+            conn = await Connection.open(host, port)
+            # all requests are in flight on one connection at once
+            ids = await asyncio.gather(*(conn.request('create', obj={'n': i}) for i in range(200)))
+            assert len(set(ids)) == 200
+
+            counts = await asyncio.gather(*(conn.request('count', constraints={'n': i}) for i in range(200)))
+            assert counts == [1] * 200
+            await conn.close()
+
+    run(scenario())
+
+
+def test_backend_batch_and_errors(tmp_path):
+    async def scenario():
+        async with Server(StorageManager(tmp_path)) as server:
+            host, port = server.address
+            async with Client(host, port, pool_size=2) as client:
+                results = await client.batch([
+                    ('create', {'obj': {'a': 1}}),
+                    ('nope', {}),
+                    ('count', {'constraints': {'a': 1}}),
+                ])
+                assert results[0]['ok']
+                assert not results[1]['ok'] and 'Unknown operation' in results[1]['error']
+                assert results[2] == {'ok': True, 'result': 1}
+
+                with pytest.raises(RemoteError):
+                    await client.request('nope')
+                # the connection survives a failed request
+                assert await client.count(a=1) == 1
+
+    run(scenario())
+
+
+def test_backend_pool_and_unix_socket(tmp_path):
+    async def scenario():
+        path = str(tmp_path / 'pysql.sock')
+        async with Server(StorageManager(tmp_path), path=path):
+            async with Client(path=path, pool_size=3) as client:
+                await asyncio.gather(*(client.create_object({'n': i % 10}) for i in range(100)))
+                assert len(client._connections) <= 3
+                assert await client.count(n=3) == 10
+
+    run(scenario())
+
+
+def test_backend_drops_oversized_frame(tmp_path):
+    async def scenario():
+        async with Server(StorageManager(tmp_path)) as server:
+            host, port = server.address
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(struct.pack('>I', 2 ** 31))
+            await writer.drain()
+            assert await reader.read() == b''
+            writer.close()
+
+    run(scenario())
+
+
+@pytest.mark.parametrize('data', [
+    struct.pack('>I', 100) + b'{"op": "pi',
+    struct.pack('>I', 3) + b'[1]',
+    struct.pack('>I', 4) + b'nope',
+])
+def test_backend_drops_bad_frames(tmp_path, data, caplog):
+    async def scenario():
+        async with Server(StorageManager(tmp_path)) as server:
+            host, port = server.address
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(data)
+            await writer.drain()
+            # a truncated frame ends when the client stops sending
+            writer.write_eof()
+            assert await reader.read() == b''
+            writer.close()
+
+            async with Client(host, port) as client:
+                assert await client.ping() == 'pong'
+
+    run(scenario())
+    assert 'Dropping connection' in caplog.text
+    assert 'Task exception was never retrieved' not in caplog.text
+
+
+def test_connection_request_after_close_raises(tmp_path):
+    async def scenario():
+        async with Server(StorageManager(tmp_path)) as server:
+            host, port = server.address
+            conn = await Connection.open(host, port)
+        # the server closed the connection
+        await asyncio.sleep(0.1)
+        assert conn.closed
+        with pytest.raises(ConnectionError):
+            await conn.request('ping')
+        await conn.close()
+
+    run(scenario())
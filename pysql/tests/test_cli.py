@@ -0,0 +1,98 @@
+import json
+import threading
+
+from pysql.__main__ import main
+from pysql.compiler import F
+from pysql.storagemanager.bulk import ExternalSorter, bulk_import
+from pysql.storagemanager.database import Database
+from pysql.storagemanager.storage import StorageManager
+
+
+def write_ndjson(path, records):
+    with open(path, 'w') as f:
+        for rec in records:
+            f.write(json.dumps(rec) + '\n')
+
+
+def test_external_sorter_spills_and_merges(tmp_path):
+    sorter = ExternalSorter(tmp_path, buffer_size=7)
+    postings = [(f'f{i % 3}', (i * 7) % 11, i) for i in range(50)]
+    for posting in postings:
+        sorter.add(*posting)
+    assert sorter.runs == 7
+
+    result = list(sorter.sorted())
+    assert result == sorted(postings, key=lambda p: (p[0], p[1]))
+    sorter.close()
+    assert not list(tmp_path.iterdir())
+
+
+def test_cli_import_builds_indexes(tmp_path):
+    db_dir = tmp_path / 'db'
+    src = tmp_path / 'in.ndjson'
+    write_ndjson(src, [{'n': i, 'g': i % 5, 'meta': {'odd': i % 2 == 1}} for i in range(500)])
+
+    main(['import', str(src), '--dir', str(db_dir), '--sort-buffer', '100', '--chunk-records', '64'])
+
+    storage = StorageManager(db_dir)
+    assert storage.count() == 500
+    assert storage.count(g=3) == 100
+    assert storage.count(F('n') >= 490) == 10
+    assert storage.count(F('meta.odd') == True) == 250
+    # importing again merges with the existing indexes
+    main(['import', str(src), '--dir', str(db_dir)])
+    storage = StorageManager(db_dir)
+    assert storage.count(g=3) == 200
+    assert len(storage.get_objects(n=7)) == 2
+
+
+def test_cli_export_roundtrip(tmp_path):
+    storage = StorageManager(tmp_path / 'db', compression='zlib', block_size=1024)
+    for i in range(100):
+        storage.create_object({'n': i})
+    storage.delete_objects(F('n') < 10)
+
+    out = tmp_path / 'out.ndjson'
+    main(['export', '--dir', str(tmp_path / 'db'), '-o', str(out)])
+    with open(out) as f:
+        exported = [json.loads(line) for line in f]
+    assert [o['n'] for o in exported] == list(range(10, 100))
+
+    main(['import', str(out), '--dir', str(tmp_path / 'copy'), '--collection', 'items'])
+    copy = Database(tmp_path / 'copy')['items']
+    assert sorted(o['_id'] for o in copy.get_objects()) == sorted(o['_id'] for o in exported)
+
+
+def test_cli_import_into_bptree_index(tmp_path):
+    db_dir = tmp_path / 'db'
+    storage = StorageManager(db_dir, index_backends={'g': 'bptree'})
+    storage.create_object({'n': -1, 'g': 'x' * 50})
+    storage.close()
+
+    src = tmp_path / 'in.ndjson'
+    write_ndjson(src, [{'n': i, 'g': 'x' * 50 if i % 3 else 'y' * 50} for i in range(3000)])
+    main(['import', str(src), '--dir', str(db_dir), '--sort-buffer', '500'])
+
+    storage = StorageManager(db_dir)
+    assert storage._index['g'].stats()['backend'] == 'bptree'
+    assert storage.count(g='x' * 50) == 2001
+    assert storage.count(g='y' * 50) == 1000
+
+
+def test_bulk_import_lets_writers_in(tmp_path):
+    storage = StorageManager(tmp_path)
+    created = []
+
+    def lines():
+        for i in range(200):
+            if i == 100:
+                writer = threading.Thread(target=lambda: created.append(storage.create_object({'n': -1})))
+                writer.start()
+                writer.join(timeout=10)
+                assert created
+            yield json.dumps({'n': i})
+
+    assert bulk_import(storage, lines(), chunk_records=50) == 200
+    assert storage.count() == 201
+    assert [o['_id'] for o in storage.get_objects(n=-1)] == created
+    assert storage.count(F('n') >= 150) == 50
@@ -0,0 +1,83 @@
+import random
+
+import pytest
+
+from pysql.compiler import F, QueryCompiler, QueryError, UnionProbe, normalize, parse, where
+from pysql.storagemanager.storage import StorageManager
+
+
+def test_compiler_shape_ignores_constants_and_order():
+    a = (F('x') == 1) & (F('y') > 2)
+    b = (F('y') > 7) & (F('x') == 5)
+    shape_a, params_a = normalize(a)
+    shape_b, params_b = normalize(b)
+    assert shape_a == shape_b
+    assert params_a == [1, 2] and params_b == [5, 7]
+
+    # nested ANDs flatten, double negation cancels
+    shape_c, params_c = normalize((F('x') == 3) & ~~(F('y') > 4))
+    assert shape_c == shape_a and params_c == [3, 4]
+    assert normalize(parse({'x': 1, 'y': {'$gt': 2}}))[0] == shape_a
+
+
+def test_compiler_caches_plans_by_shape():
+    compiler = QueryCompiler()
+    plan, _ = compiler.compile(where(a=1, b=2))
+    again, params = compiler.compile(where(b=3, a=4))
+    assert again is plan and params == [4, 3]
+    assert (compiler.hits, compiler.misses) == (1, 1)
+
+
+def test_compiler_splits_probes_and_residual():
+    compiler = QueryCompiler()
+
+    plan, _ = compiler.compile((F('a') >= 1) & (F('a') < 5) & (F('b') == 2))
+    assert sorted(p.field for p in plan.probes) == ['a', 'b']
+    assert plan.residual is None
+
+    plan, _ = compiler.compile((F('a') == 1) & (F('n.x') != 2) & (F('n.y') > 0))
+    assert sorted(p.field for p in plan.probes) == ['a', 'n.y']
+    assert plan.residual is not None
+
+    plan, _ = compiler.compile((F('a') == 1) | (F('b') == 2))
+    assert isinstance(plan.probes[0], UnionProbe) and plan.residual is None
+
+    plan, _ = compiler.compile(~(F('a') == 1))
+    assert plan.full_scan
+
+
+def test_compiler_rejects_unknown_operators():
+    with pytest.raises(QueryError):
+        parse({'a': {'$regex': 'x'}})
+    with pytest.raises(QueryError):
+        parse({'$nor': []})
+
+
+@pytest.fixture
+def populated(tmp_path):
+    rnd = random.Random(7)
+    storage = StorageManager(tmp_path)
+    for i in range(300):
+        obj = {'a': rnd.randint(0, 9), 'b': rnd.choice(['x', 'y', 'z'])}
+        if rnd.random() < 0.7:
+            obj['n'] = {'v': rnd.randint(0, 4)}
+        storage.create_object(obj)
+    storage.delete_objects(a=3)
+    return storage
+
+
+@pytest.mark.parametrize('query, predicate', [
+    ((F('a') > 2) & (F('a') <= 6), lambda o: 2 < o['a'] <= 6),
+    ((F('a') == 1) | (F('b') == 'z'), lambda o: o['a'] == 1 or o['b'] == 'z'),
+    (F('n.v') >= 3, lambda o: 'n' in o and o['n']['v'] >= 3),
+    ((F('n') == {'v': 2}) & (F('a') < 5), lambda o: o.get('n') == {'v': 2} and o['a'] < 5),
+    (F('n.v') != 1, lambda o: 'n' not in o or o['n']['v'] != 1),
+    (~F('n').exists() & F('b').in_(['x', 'y']), lambda o: 'n' not in o and o['b'] in ('x', 'y')),
+    (F('a') > 'text', lambda o: False),
+    ({'$or': [{'a': {'$lt': 2}}, {'n.v': 0}], 'b': 'y'},
+     lambda o: (o['a'] < 2 or o.get('n', {}).get('v') == 0) and o['b'] == 'y'),
+])
+def test_compiler_queries_match_brute_force(populated, query, predicate):
+    expected = sorted(o['_id'] for o in populated.get_objects() if predicate(o))
+    assert sorted(o['_id'] for o in populated.get_objects(query)) == expected
+    assert populated.count(query) == len(expected)